@@ -0,0 +1,210 @@
+"""
+Agent 注册表
+在处理请求的进程中缓存已编译的 agent，按 (角色名称, 模型名称, 温度参数) 复用，
+共享数据库管理器、检查点保存器和聊天模型，角色变化后只重建受影响的 agent
+"""
+
+import asyncio
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+
+from db_utils import DatabaseManager
+from async_db_utils import AsyncDatabaseManager
+from engine_registry import env_bool
+from create_agent import create_chat_model, create_checkpointer, create_skills_agent, resolve_model_settings
+from instrumentation import instrumentation
+
+load_dotenv()
+
+
+class _Entry(NamedTuple):
+    """缓存的 agent 及其构建时的角色版本"""
+    agent: object
+    stamp: Tuple
+
+
+class AgentRegistry:
+    """已编译 agent 的缓存
+
+    每次 get() 只读取角色的技能目录版本号（带缓存，见 DatabaseManager.get_catalog_version），
+    版本未变化时直接返回已编译的 agent。需要重建的情况：
+
+    - 角色行变化（系统提示词等，通过 agents.updated_at 判断）
+    - 启用 API 工具时角色的技能变化（API 工具在创建 agent 时确定）
+
+    技能目录的其他变化由 SkillMiddleware 在每次模型调用时按版本号刷新，不需要重建 agent。
+    重建期间其他请求继续使用旧的 agent，同一个 agent 只由一个线程重建。
+
+    所有 agent 共用一个检查点保存器，不同角色的会话需要使用不同的 thread_id。
+    """
+
+    def __init__(
+        self,
+        db_manager: Optional[DatabaseManager] = None,
+        use_async: bool = False,
+        checkpointer=None,
+        checkpointer_type: Optional[str] = None,
+        max_skills: Optional[int] = None,
+        skill_token_budget: Optional[int] = None,
+        api_tools: Optional[bool] = None,
+        llm_factory: Optional[Callable[[str, float], BaseChatModel]] = None
+    ):
+        """初始化注册表
+
+        Args:
+            db_manager: 数据库管理器（可选），所有 agent 共用，如果不提供则从环境变量构建
+            use_async: 是否为 agent.ainvoke/astream 启用异步数据库访问，默认为 False
+            checkpointer: 共用的检查点保存器（可选），如果不提供则按 checkpointer_type 创建
+            checkpointer_type: 会话状态存储方式，见 create_skills_agent
+            max_skills: 系统提示中最多列出的技能数，见 create_skills_agent
+            skill_token_budget: 技能列表的 token 预算，见 create_skills_agent
+            api_tools: 是否提供 API 调用工具，如果不提供则从环境变量 SKILL_API_TOOLS 读取，默认为 False
+            llm_factory: 按 (模型名称, 温度参数) 创建聊天模型的函数（可选），默认创建 ChatOpenAI；
+                同一组参数的模型只创建一次，由多个 agent 共用
+        """
+        self.db_manager = db_manager or DatabaseManager()
+        self.async_db_manager = AsyncDatabaseManager(self.db_manager.db_url) if use_async else None
+        self.checkpointer = checkpointer or create_checkpointer(
+            self.db_manager, self.async_db_manager, checkpointer_type
+        )
+        self.max_skills = max_skills
+        self.skill_token_budget = skill_token_budget
+        if api_tools is None:
+            api_tools = env_bool("SKILL_API_TOOLS", "false")
+        self.api_tools = api_tools
+        self.llm_factory = llm_factory or create_chat_model
+        self.builds = 0
+
+        # 读取 _entries 不加锁（整体替换条目），写入和重建按 key 加锁
+        self._entries: Dict[Tuple, _Entry] = {}
+        self._llms: Dict[Tuple[str, float], BaseChatModel] = {}
+        self._build_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, version: Tuple) -> Tuple:
+        """由技能目录版本号得到需要重建 agent 的部分"""
+        # 版本号第一项为角色的 updated_at，其余为技能和关联的变化
+        return tuple(version) if self.api_tools else (version[0],)
+
+    def _build_lock(self, key: Tuple) -> threading.Lock:
+        with self._lock:
+            lock = self._build_locks.get(key)
+            if lock is None:
+                lock = self._build_locks[key] = threading.Lock()
+            return lock
+
+    def _chat_model(self, model_name: str, temperature: float) -> BaseChatModel:
+        """获取（或创建）共用的聊天模型"""
+        key = (model_name, temperature)
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is None:
+                llm = self._llms[key] = self.llm_factory(model_name, temperature)
+            return llm
+
+    def _build(self, agent_name: str, model_name: str, temperature: float):
+        with instrumentation.span("AgentRegistry.build", agent=agent_name, model=model_name):
+            agent = create_skills_agent(
+                agent_name,
+                model_name=model_name,
+                temperature=temperature,
+                db_manager=self.db_manager,
+                max_skills=self.max_skills,
+                skill_token_budget=self.skill_token_budget,
+                api_tools=self.api_tools,
+                llm=self._chat_model(model_name, temperature),
+                checkpointer=self.checkpointer,
+                async_db_manager=self.async_db_manager
+            )
+        self.builds += 1
+        return agent
+
+    def _lookup(self, key: Tuple, version: Optional[Tuple]):
+        """版本未变化时返回缓存的 agent，否则返回 None；角色不存在时移除缓存并抛出异常"""
+        if version is None:
+            self._entries.pop(key, None)
+            raise ValueError(f"角色 '{key[0]}' 不存在或未启用。")
+        entry = self._entries.get(key)
+        if entry is not None and entry.stamp == self._stamp(version):
+            return entry.agent
+        return None
+
+    def get(self, agent_name: str, model_name: Optional[str] = None, temperature: Optional[float] = None):
+        """获取角色的 agent（必要时创建或重建）
+
+        Args:
+            agent_name: 角色名称
+            model_name: 模型名称，如果不提供则从环境变量 MODEL_NAME 读取，默认为 "gpt-4o"
+            temperature: 温度参数，如果不提供则从环境变量 TEMPERATURE 读取，默认为 0.7
+
+        Returns:
+            已编译的 agent
+
+        Raises:
+            ValueError: 角色不存在或未启用
+        """
+        model_name, temperature = resolve_model_settings(model_name, temperature)
+        key = (agent_name, model_name, temperature)
+        agent = self._lookup(key, self.db_manager.get_catalog_version(agent_name))
+        if agent is not None:
+            return agent
+
+        with self._build_lock(key):
+            # 等待锁期间可能已由其他线程重建
+            version = self.db_manager.get_catalog_version(agent_name)
+            agent = self._lookup(key, version)
+            if agent is None:
+                agent = self._build(agent_name, model_name, temperature)
+                self._entries[key] = _Entry(agent, self._stamp(version))
+            return agent
+
+    async def aget(self, agent_name: str, model_name: Optional[str] = None, temperature: Optional[float] = None):
+        """get() 的异步版本：版本号通过异步数据库管理器读取，重建在线程池中进行，不阻塞事件循环
+
+        Args:
+            agent_name: 角色名称
+            model_name: 模型名称，见 get()
+            temperature: 温度参数，见 get()
+
+        Returns:
+            已编译的 agent
+        """
+        model_name, temperature = resolve_model_settings(model_name, temperature)
+        if self.async_db_manager is not None:
+            version = await self.async_db_manager.get_catalog_version(agent_name)
+            agent = self._lookup((agent_name, model_name, temperature), version)
+            if agent is not None:
+                return agent
+        return await asyncio.to_thread(self.get, agent_name, model_name, temperature)
+
+    def warm(self, model_name: Optional[str] = None, temperature: Optional[float] = None) -> List[str]:
+        """为所有启用的角色预先创建 agent（服务启动时调用）
+
+        Args:
+            model_name: 模型名称，见 get()
+            temperature: 温度参数，见 get()
+
+        Returns:
+            已创建 agent 的角色名称
+        """
+        names = []
+        for agent in self.db_manager.get_all_agents():
+            self.get(agent.name, model_name, temperature)
+            names.append(agent.name)
+        return names
+
+    def invalidate(self, agent_name: Optional[str] = None) -> None:
+        """移除缓存的 agent，下次 get() 时重新创建
+
+        Args:
+            agent_name: 角色名称，如果不提供则移除所有 agent
+        """
+        for key in list(self._entries):
+            if agent_name is None or key[0] == agent_name:
+                self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
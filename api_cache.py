@@ -0,0 +1,466 @@
+"""
+API 调用响应缓存
+为 skill_api.ApiExecutor 缓存幂等 API 调用的响应：进程内的 LRU 缓存层，
+可选的数据库共享层（skill_api_responses 表），相同请求并发时只发出一次；
+命令行 `python api_cache.py prune` 清理共享层中过期的响应
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+import httpx
+from sqlalchemy import select, delete, func, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from db_utils import DatabaseManager, SkillApiResponse
+from async_db_utils import AsyncDatabaseManager
+from instrumentation import track_cache
+
+logger = logging.getLogger(__name__)
+
+RESPONSES = SkillApiResponse.__table__
+
+# 缓存的响应头（其余响应头不影响返回给模型的内容）
+CACHED_HEADERS = ("content-type",)
+
+GET_RESPONSE_STMT = (
+    select(RESPONSES.c.status_code, RESPONSES.c.headers, RESPONSES.c.body, RESPONSES.c.expires_at)
+    .where(RESPONSES.c.cache_key == bindparam("cache_key"), RESPONSES.c.expires_at > func.now())
+)
+
+_upsert_response = pg_insert(RESPONSES)
+UPSERT_RESPONSE_STMT = _upsert_response.on_conflict_do_update(
+    index_elements=[RESPONSES.c.cache_key],
+    set_={
+        "status_code": _upsert_response.excluded.status_code,
+        "headers": _upsert_response.excluded.headers,
+        "body": _upsert_response.excluded.body,
+        "expires_at": _upsert_response.excluded.expires_at,
+        "created_at": func.now(),
+    }
+)
+
+DELETE_EXPIRED_STMT = delete(RESPONSES).where(RESPONSES.c.expires_at <= func.now())
+
+
+class CachedResponse(NamedTuple):
+    """缓存的响应（expires_at 为 Unix 时间戳）"""
+    status_code: int
+    headers: Dict[str, str]
+    body: bytes
+    expires_at: float
+
+    @classmethod
+    def from_response(cls, response: httpx.Response, ttl: float) -> "CachedResponse":
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        return cls(response.status_code, headers, response.content, time.time() + ttl)
+
+    def to_response(self, method: str, url: str) -> httpx.Response:
+        return httpx.Response(
+            self.status_code,
+            headers=self.headers,
+            content=self.body,
+            request=httpx.Request(method, url)
+        )
+
+
+def cache_ttl(spec) -> float:
+    """API 调用的缓存时间（秒），取自 response_format 的 cache_ttl_seconds，未声明时为 0（不缓存）"""
+    response_format = spec.response_format if isinstance(spec.response_format, dict) else {}
+    try:
+        return max(float(response_format.get("cache_ttl_seconds") or 0), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _canonical(value: Any) -> Any:
+    """把请求内容转换为可稳定序列化的形式（JSON 文本按解析后的值比较）"""
+    if isinstance(value, bytes):
+        try:
+            return {"json": json.loads(value)}
+        except ValueError:
+            return {"bytes": hashlib.sha256(value).hexdigest()}
+    return value
+
+
+def cache_key(spec, method: str, url: str, kwargs: Dict[str, Any]) -> str:
+    """计算缓存键
+
+    由 API（技能ID、名称）、方法、URL、规范化的参数和请求体（键排序、去掉未提供的参数）
+    以及认证范围（请求头和认证信息的摘要，不同凭据的响应互不共享）组成，不包含明文凭据。
+
+    Args:
+        spec: API 调用配置
+        method: HTTP 方法
+        url: 替换路径参数后的 URL
+        kwargs: build_request() 返回的请求参数
+
+    Returns:
+        SHA-256 十六进制字符串
+    """
+    headers = sorted((k.lower(), v) for k, v in (kwargs.get("headers") or {}).items())
+    auth_scope = hashlib.sha256(
+        json.dumps([headers, kwargs.get("auth")], ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+    payload = {
+        "api": [getattr(spec, "skill_id", None), spec.api_name],
+        "method": method,
+        "url": url,
+        "params": {str(k): v for k, v in (kwargs.get("params") or {}).items()},
+        "body": _canonical(kwargs["content"]) if "content" in kwargs else kwargs.get("json"),
+        "auth": auth_scope,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class _Flight:
+    """一次正在进行的请求（同步调用方共享结果）"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[CachedResponse] = None
+        self.error: Optional[BaseException] = None
+
+
+class ApiResponseCache:
+    """API 响应缓存
+
+    只缓存声明了 cache_ttl_seconds 的 API 的成功响应（2xx）。读取顺序为进程内 LRU 缓存、
+    数据库共享层（设置了 db_manager 时）、实际请求；相同缓存键的并发调用只发出一次请求，
+    其他调用方等待并共享该请求的结果（包括异常）。
+
+    数据库共享层只是优化：读写出错时记录日志并按未命中处理，照常返回实际请求的响应。
+    过期的响应不会在请求时清理，由 prune_expired() 或 `python api_cache.py prune` 定期删除。
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        db_manager: Optional[DatabaseManager] = None,
+        async_db_manager: Optional[AsyncDatabaseManager] = None
+    ):
+        """初始化缓存
+
+        Args:
+            max_size: 进程内缓存的最大条目数，如果不提供则从环境变量 SKILL_API_CACHE_SIZE 读取，
+                默认为 1024，0 表示不使用进程内缓存
+            db_manager: 数据库管理器（可选），提供时使用 skill_api_responses 表作为多个进程共享的缓存层
+            async_db_manager: 异步数据库管理器（可选），提供时异步调用不会阻塞事件循环，
+                否则在线程池中访问共享缓存层
+        """
+        if max_size is None:
+            max_size = int(os.getenv("SKILL_API_CACHE_SIZE", "1024"))
+        self.max_size = max_size
+        self.db_manager = db_manager
+        self.async_db_manager = async_db_manager
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_errors = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        track_cache("api_response", self)
+
+    def set_database(
+        self,
+        db_manager: DatabaseManager,
+        async_db_manager: Optional[AsyncDatabaseManager] = None
+    ) -> None:
+        """设置数据库共享层（已设置时不变）"""
+        with self._lock:
+            if self.db_manager is None:
+                self.db_manager = db_manager
+                self.async_db_manager = async_db_manager
+
+    # ========== 进程内缓存层 ==========
+
+    def _get_local(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _set_local(self, key: str, entry: CachedResponse) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    # ========== 数据库共享层 ==========
+
+    def _shared_row(self, key: str, api_name: str, entry: CachedResponse) -> Dict[str, Any]:
+        return {
+            "cache_key": key,
+            "api_name": api_name,
+            "status_code": entry.status_code,
+            "headers": entry.headers,
+            "body": entry.body,
+            "expires_at": datetime.fromtimestamp(entry.expires_at, timezone.utc),
+        }
+
+    def _shared_failed(self, action: str, error: SQLAlchemyError) -> None:
+        """记录共享缓存层的读写错误（不影响请求）"""
+        self._count("shared_errors")
+        logger.warning("API 响应缓存%s数据库共享层失败，按未命中处理: %s", action, error)
+
+    def _get_shared(self, key: str) -> Optional[CachedResponse]:
+        session = self.db_manager.get_session()
+        try:
+            row = session.execute(GET_RESPONSE_STMT, {"cache_key": key}).first()
+            if row is None:
+                return None
+            return CachedResponse(row.status_code, row.headers or {}, row.body, row.expires_at.timestamp())
+        finally:
+            session.close()
+
+    def _set_shared(self, key: str, api_name: str, entry: CachedResponse) -> None:
+        session = self.db_manager.get_session()
+        try:
+            session.execute(UPSERT_RESPONSE_STMT, self._shared_row(key, api_name, entry))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    async def _aget_shared(self, key: str) -> Optional[CachedResponse]:
+        if self.async_db_manager is None:
+            return await asyncio.to_thread(self._get_shared, key)
+        async with self.async_db_manager.get_session() as session:
+            row = (await session.execute(GET_RESPONSE_STMT, {"cache_key": key})).first()
+            if row is None:
+                return None
+            return CachedResponse(row.status_code, row.headers or {}, row.body, row.expires_at.timestamp())
+
+    async def _aset_shared(self, key: str, api_name: str, entry: CachedResponse) -> None:
+        if self.async_db_manager is None:
+            return await asyncio.to_thread(self._set_shared, key, api_name, entry)
+        async with self.async_db_manager.get_session() as session:
+            try:
+                await session.execute(UPSERT_RESPONSE_STMT, self._shared_row(key, api_name, entry))
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+
+    def prune_expired(self) -> int:
+        """删除数据库共享层中过期的响应（请求时不会清理，需要由定时任务调用）
+
+        Returns:
+            删除的响应数
+        """
+        if self.db_manager is None:
+            return 0
+        session = self.db_manager.get_session()
+        try:
+            result = session.execute(DELETE_EXPIRED_STMT)
+            session.commit()
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    # ========== 读取或请求 ==========
+
+    def _fetch(self, key: str, api_name: str, ttl: float, fetch: Callable[[], httpx.Response]):
+        """读取共享缓存层，未命中时发出请求并缓存成功响应，返回 (响应, 缓存条目)"""
+        if self.db_manager is not None:
+            try:
+                entry = self._get_shared(key)
+            except SQLAlchemyError as e:
+                self._shared_failed("读取", e)
+                entry = None
+            if entry is not None:
+                self._count("shared_hits")
+                self._set_local(key, entry)
+                return None, entry
+        self._count("misses")
+        response = fetch()
+        if not 200 <= response.status_code < 300:
+            return response, None
+        entry = CachedResponse.from_response(response, ttl)
+        self._set_local(key, entry)
+        if self.db_manager is not None:
+            try:
+                self._set_shared(key, api_name, entry)
+            except SQLAlchemyError as e:
+                self._shared_failed("写入", e)
+        return response, entry
+
+    def get_or_fetch(
+        self,
+        key: str,
+        api_name: str,
+        ttl: float,
+        method: str,
+        url: str,
+        fetch: Callable[[], httpx.Response]
+    ) -> httpx.Response:
+        """读取缓存的响应，未命中时调用 fetch 发出请求（相同缓存键的并发调用共享一次请求）
+
+        Args:
+            key: 缓存键（见 cache_key()）
+            api_name: API 名称
+            ttl: 缓存时间（秒）
+            method: HTTP 方法（用于构造缓存命中时返回的响应）
+            url: 请求 URL
+            fetch: 发出请求的函数
+
+        Returns:
+            HTTP 响应
+        """
+        entry = self._get_local(key)
+        if entry is not None:
+            self._count("hits")
+            return entry.to_response(method, url)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count("coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if flight.result is not None:
+                return flight.result.to_response(method, url)
+            # 共享的请求没有得到可缓存的响应，自己重新请求
+            return fetch()
+
+        try:
+            response, flight.result = self._fetch(key, api_name, ttl, fetch)
+            return response if response is not None else flight.result.to_response(method, url)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    async def aget_or_fetch(
+        self,
+        key: str,
+        api_name: str,
+        ttl: float,
+        method: str,
+        url: str,
+        fetch: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        """get_or_fetch 的异步版本（并发调用在同一个事件循环内共享请求）"""
+        entry = self._get_local(key)
+        if entry is not None:
+            self._count("hits")
+            return entry.to_response(method, url)
+
+        flight_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_flights.get(flight_key)
+        if future is not None:
+            self._count("coalesced")
+            result = await asyncio.shield(future)
+            if result is not None:
+                return result.to_response(method, url)
+            return await fetch()
+
+        future = self._async_flights[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            if self.db_manager is not None:
+                try:
+                    entry = await self._aget_shared(key)
+                except SQLAlchemyError as e:
+                    self._shared_failed("读取", e)
+                if entry is not None:
+                    self._count("shared_hits")
+                    self._set_local(key, entry)
+                    future.set_result(entry)
+                    return entry.to_response(method, url)
+
+            self._count("misses")
+            response = await fetch()
+            if 200 <= response.status_code < 300:
+                entry = CachedResponse.from_response(response, ttl)
+                self._set_local(key, entry)
+                if self.db_manager is not None:
+                    try:
+                        await self._aset_shared(key, api_name, entry)
+                    except SQLAlchemyError as e:
+                        self._shared_failed("写入", e)
+            future.set_result(entry)
+            return response
+        except asyncio.CancelledError:
+            # 发起请求的调用被取消时，等待的调用方各自重新请求
+            if not future.done():
+                future.set_result(None)
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+                # 没有其他调用方等待时避免 "exception was never retrieved" 警告
+                future.exception()
+            raise
+        finally:
+            self._async_flights.pop(flight_key, None)
+
+    def clear(self) -> None:
+        """清空进程内缓存（不影响数据库共享层）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "shared_errors": self.shared_errors,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API 响应缓存维护")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("prune", help="删除数据库共享层中过期的响应（可由定时任务执行）")
+    parser.parse_args()
+
+    removed = ApiResponseCache(max_size=0, db_manager=DatabaseManager()).prune_expired()
+    print(f"已删除 {removed} 条过期的 API 响应")
+
+
+if __name__ == "__main__":
+    main()
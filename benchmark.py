@@ -0,0 +1,376 @@
+"""
+性能基准测试
+在单机离线运行（本地 PostgreSQL，模型使用 fake_chat_model.FakeChatModel，不访问网络），
+按不同技能数量测量技能目录和技能加载热路径的耗时，结果写入 JSON 文件，便于比较不同版本
+
+用法:
+    python benchmark.py --sizes 10,1000,10000,100000 --output benchmark.json
+
+测试数据写入 --prefix 开头的角色和技能（默认 bench_），开始前和结束后都会删除，不影响其他数据。
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from importlib import metadata as importlib_metadata
+from typing import Callable, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from langchain.agents.middleware import ModelRequest
+from langchain.messages import HumanMessage, SystemMessage
+from sqlalchemy import delete, select, text
+
+from db_utils import DatabaseManager, Agent, Skill
+from create_agent import SkillMiddleware, create_load_skill_tool, create_skills_agent
+from fake_chat_model import FakeChatModel
+
+load_dotenv()
+
+
+DEFAULT_SIZES = "10,1000,10000,100000"
+
+# 生成技能描述和内容时使用的词（让 BM25 排序有区分度）
+_TOPICS = [
+    "数据分析", "代码审查", "文档写作", "翻译", "测试", "部署", "监控", "安全审计", "性能优化", "数据库",
+    "前端", "后端", "机器学习", "报表", "客服", "合同", "财务", "招聘", "运维", "产品设计",
+]
+
+
+def synthetic_skill(prefix: str, i: int) -> Dict:
+    """生成第 i 个测试技能（add_skill_from_json 的参数字典）"""
+    topic = _TOPICS[i % len(_TOPICS)]
+    skill_id = f"{prefix}skill_{i:06d}"
+    sections = "\n\n".join(
+        f"## {title}\n\n" + f"{topic}技能的{title}说明，第 {i} 号技能。" * 8
+        for title in ("概述", "工作流程", "最佳实践", "常见问题")
+    )
+    return {
+        "skill_json": {
+            "id": skill_id,
+            "name": f"{topic}-{i:06d}",
+            "version": "1.0.0",
+            "description": f"{topic}相关的专业技能（编号 {i}），提供{topic}的流程、规范和示例。",
+            "short_description": f"{topic}专家 {i}",
+            "category": "benchmark",
+            "tags": [topic, f"tag{i % 97}", "benchmark"],
+            "priority": i % 100,
+            "requirements": {"dependencies": [], "api_keys": []},
+        },
+        "content": f"# {topic}-{i:06d}\n\n{sections}\n",
+        "examples": {"examples": [{"input": f"{topic}问题", "output": f"{topic}回答"}]},
+        "metadata": {"benchmark": True},
+    }
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """耗时样本（秒）的统计值（毫秒）"""
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return ordered[index] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def measure(func: Callable[[], object], iterations: int, setup: Optional[Callable[[], None]] = None) -> Dict:
+    """多次调用 func 并统计耗时（setup 在每次调用前执行，不计入耗时）"""
+    samples = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def reset_benchmark_data(db: DatabaseManager, prefix: str) -> None:
+    """删除测试数据（技能的子表通过外键级联删除）"""
+    session = db.get_session()
+    try:
+        session.execute(delete(Skill).where(Skill.skill_id.like(f"{prefix}%")))
+        session.execute(delete(Agent).where(Agent.name.like(f"{prefix}%")))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+    db.invalidate_cache()
+
+
+def bench_import(db: DatabaseManager, agent_name: str, prefix: str, size: int, single_imports: int) -> Dict:
+    """导入测试技能：前 size - single_imports 个批量导入，其余逐个通过 add_skill_from_json 导入"""
+    singles = min(size, single_imports)
+    bulk = size - singles
+    result = {}
+
+    start = time.perf_counter()
+    if bulk:
+        results = db.bulk_import_skills(agent_name, (synthetic_skill(prefix, i) for i in range(bulk)))
+        failed = [r for r in results if r.status == "failed"]
+        if failed:
+            raise RuntimeError(f"批量导入失败: {failed[0]}")
+    elapsed = time.perf_counter() - start
+    result["bulk_import_skills"] = {
+        "skills": bulk,
+        "seconds": elapsed,
+        "skills_per_second": bulk / elapsed if bulk and elapsed > 0 else None,
+    }
+
+    samples = []
+    for i in range(bulk, size):
+        item = synthetic_skill(prefix, i)
+        start = time.perf_counter()
+        db.add_skill_from_json(
+            agent_name, item["skill_json"], item["content"], item["examples"], item["metadata"]
+        )
+        samples.append(time.perf_counter() - start)
+    result["add_skill_from_json"] = {
+        **summarize(samples),
+        "catalog_size_before": bulk,
+        "skills_per_second": len(samples) / sum(samples),
+    }
+    return result
+
+
+def _skill_names(prefix: str, size: int, count: int, rng: random.Random) -> List[str]:
+    """随机选取 count 个测试技能的名称"""
+    return [synthetic_skill(prefix, rng.randrange(size))["skill_json"]["name"] for _ in range(count)]
+
+
+def bench_size(db_url: str, size: int, args) -> Dict:
+    """在 size 个技能下运行所有测量"""
+    prefix = args.prefix
+    agent_name = f"{prefix}agent_{size}"
+    rng = random.Random(size)
+    iterations = args.iterations
+    # 整个技能目录的测量（get_all_skills、构建 agent 等）在大规模下耗时较长，减少次数
+    catalog_iterations = max(3, min(iterations, 200_000 // max(size, 1)))
+
+    db = DatabaseManager(db_url)
+    reset_benchmark_data(db, prefix)
+    db.add_agent(agent_name, "基准测试角色", "你是基准测试使用的智能助手。")
+    result: Dict = {"skills": size}
+
+    print(f"[{size}] 导入技能...", flush=True)
+    result["import"] = bench_import(db, agent_name, prefix, size, args.single_imports)
+    session = db.get_session()
+    try:
+        session.execute(text("ANALYZE"))
+        session.commit()
+    finally:
+        session.close()
+
+    # 冷路径使用禁用缓存的管理器（每次都查询数据库），热路径使用预热过缓存的管理器
+    cold_db = DatabaseManager(db_url, cache_size=0)
+    warm_db = DatabaseManager(db_url)
+    names = _skill_names(prefix, size, iterations, rng)
+    name_iter = iter(names * 2)
+
+    print(f"[{size}] get_skill / load_skill...", flush=True)
+    for name in names:
+        warm_db.get_skill(agent_name, name)
+    result["get_skill"] = {
+        "cold": measure(lambda: cold_db.get_skill(agent_name, next(name_iter)), iterations),
+        "warm": measure(lambda: warm_db.get_skill(agent_name, next(name_iter)), iterations),
+    }
+
+    cold_tool = create_load_skill_tool(cold_db, agent_name)
+    warm_tool = create_load_skill_tool(warm_db, agent_name)
+    for name in names:
+        warm_tool.invoke({"skill_name": name})
+    name_iter = iter(names * 2)
+    result["load_skill"] = {
+        "cold": measure(lambda: cold_tool.invoke({"skill_name": next(name_iter)}), iterations),
+        "warm": measure(lambda: warm_tool.invoke({"skill_name": next(name_iter)}), iterations),
+    }
+
+    print(f"[{size}] get_all_skills / 技能提示...", flush=True)
+    warm_db.get_all_skills(agent_name)
+    result["get_all_skills"] = {
+        "cold": measure(lambda: cold_db.get_all_skills(agent_name), catalog_iterations),
+        "warm": measure(lambda: warm_db.get_all_skills(agent_name), iterations),
+    }
+
+    model = FakeChatModel()
+    request = ModelRequest(
+        model=model,
+        messages=[HumanMessage(content=f"请帮我处理{_TOPICS[3]}相关的问题")],
+        system_message=SystemMessage(content="你是基准测试使用的智能助手。"),
+    )
+    query = request.messages[0].text
+    prompt = {}
+    for mode, options in (("full", {}), ("ranked", {"max_skills": 20, "token_budget": 2000})):
+        middleware = SkillMiddleware(warm_db, agent_name, **options)
+        version, skills = middleware._catalog[:2]
+
+        def build():
+            middleware._set_catalog(version, skills)
+            return middleware._build_addendum(middleware._catalog, query)
+
+        # 技能目录变化后的重建：生成提示行（排序模式下同时构建检索索引）并生成附加内容块
+        prompt[f"{mode}_build"] = measure(build, catalog_iterations)
+        # 每次模型调用：技能目录未变化时只检查版本号并复用注入后的系统消息
+        middleware.wrap_model_call(request, lambda r: r)
+        prompt[f"{mode}_per_call"] = measure(lambda: middleware.wrap_model_call(request, lambda r: r), iterations)
+        prompt[f"{mode}_prompt_chars"] = len(build()["text"])
+    # 构造中间件（读取技能目录并构建），不使用缓存
+    prompt["construct_cold"] = measure(lambda: SkillMiddleware(cold_db, agent_name), catalog_iterations)
+    result["skill_middleware"] = prompt
+
+    print(f"[{size}] create_skills_agent / agent 对话...", flush=True)
+    result["create_skills_agent"] = {
+        "cold": measure(
+            lambda: create_skills_agent(agent_name, db_manager=DatabaseManager(db_url), llm=model),
+            catalog_iterations,
+        ),
+        "warm": measure(
+            lambda: create_skills_agent(agent_name, db_manager=warm_db, llm=model),
+            catalog_iterations,
+        ),
+    }
+
+    agent = create_skills_agent(agent_name, db_manager=warm_db, llm=model)
+    questions = iter([f"请帮我处理{name}相关的问题" for name in names] * 2)
+    turns = max(3, iterations // 4)
+    result["agent_turn"] = measure(
+        lambda: agent.invoke(
+            {"messages": [{"role": "user", "content": next(questions)}]},
+            {"configurable": {"thread_id": uuid.uuid4().hex}},
+        ),
+        turns,
+    )
+
+    if not args.keep:
+        reset_benchmark_data(db, prefix)
+    return result
+
+
+def _package_version(name: str) -> Optional[str]:
+    try:
+        return importlib_metadata.version(name)
+    except importlib_metadata.PackageNotFoundError:
+        return None
+
+
+def environment_info(db_url: str) -> Dict:
+    """运行环境信息（随结果一起保存，便于比较不同版本和机器上的结果）"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    db = DatabaseManager(db_url)
+    session = db.get_session()
+    try:
+        if db.engine.dialect.name == "sqlite":
+            server_version = "SQLite " + session.execute(select(text("sqlite_version()"))).scalar()
+        else:
+            server_version = session.execute(select(text("version()"))).scalar()
+    finally:
+        session.close()
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "database": server_version,
+        "packages": {
+            name: _package_version(name)
+            for name in ("sqlalchemy", "psycopg2-binary", "langchain", "langchain-core", "langgraph")
+        },
+    }
+
+
+def run(db_url: str, sizes: Sequence[int], args) -> Dict:
+    """运行所有规模的测量
+
+    Args:
+        db_url: 数据库连接 URL
+        sizes: 技能数量列表
+        args: 命令行参数
+
+    Returns:
+        {"environment": 运行环境, "config": 参数, "results": {技能数: 测量结果}}
+    """
+    report = {
+        "environment": environment_info(db_url),
+        "config": {
+            "sizes": list(sizes),
+            "iterations": args.iterations,
+            "single_imports": args.single_imports,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        start = time.perf_counter()
+        report["results"][str(size)] = bench_size(db_url, size, args)
+        print(f"[{size}] 完成，用时 {time.perf_counter() - start:.1f} 秒", flush=True)
+    return report
+
+
+def _print_summary(report: Dict) -> None:
+    rows = [
+        ("add_skill_from_json p50", lambda r: r["import"]["add_skill_from_json"]["p50_ms"]),
+        ("get_skill 冷 p50", lambda r: r["get_skill"]["cold"]["p50_ms"]),
+        ("load_skill 冷 p50", lambda r: r["load_skill"]["cold"]["p50_ms"]),
+        ("load_skill 热 p50", lambda r: r["load_skill"]["warm"]["p50_ms"]),
+        ("get_all_skills 冷 p50", lambda r: r["get_all_skills"]["cold"]["p50_ms"]),
+        ("技能提示构建 p50", lambda r: r["skill_middleware"]["full_build"]["p50_ms"]),
+        ("create_skills_agent 热 p50", lambda r: r["create_skills_agent"]["warm"]["p50_ms"]),
+        ("agent 对话 p50", lambda r: r["agent_turn"]["p50_ms"]),
+    ]
+    sizes = list(report["results"])
+    print("\n" + "指标（毫秒）".ljust(28) + "".join(s.rjust(12) for s in sizes))
+    for label, getter in rows:
+        print(label.ljust(28) + "".join(f"{getter(report['results'][s]):12.2f}" for s in sizes))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="技能目录和技能加载的性能基准测试（离线运行）")
+    parser.add_argument("--db-url", default=None, help="数据库连接 URL，默认从环境变量构建（同 DatabaseManager）")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"技能数量，逗号分隔，默认 {DEFAULT_SIZES}")
+    parser.add_argument("--iterations", type=int, default=200, help="单个技能操作的测量次数，默认 200")
+    parser.add_argument("--single-imports", type=int, default=200,
+                        help="每个规模下逐个通过 add_skill_from_json 导入的技能数，其余批量导入，默认 200")
+    parser.add_argument("--prefix", default="bench_", help="测试角色和技能的名称前缀，默认 bench_")
+    parser.add_argument("--output", default="benchmark-results.json", help="结果 JSON 文件路径")
+    parser.add_argument("--keep", action="store_true", help="结束后保留测试数据")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    db_url = args.db_url or DatabaseManager().db_url
+    db = DatabaseManager(db_url)
+    db.create_tables()
+
+    report = run(db_url, sizes, args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    _print_summary(report)
+    print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
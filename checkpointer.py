@@ -0,0 +1,607 @@
+"""
+数据库检查点存储
+将 LangGraph 的会话检查点保存在技能数据库中，复用 DatabaseManager 的引擎和连接池，
+多个 worker 进程可以共享会话状态，进程重启后会话不丢失；
+命令行 `python checkpointer.py prune` 清理过期的会话和检查点
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_serializable_checkpoint_metadata,
+)
+from sqlalchemy import and_, delete, exists, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from db_utils import DatabaseManager, AgentCheckpoint, AgentCheckpointBlob, AgentCheckpointWrite
+from async_db_utils import AsyncDatabaseManager
+
+
+CHECKPOINTS = AgentCheckpoint.__table__
+BLOBS = AgentCheckpointBlob.__table__
+WRITES = AgentCheckpointWrite.__table__
+
+# 通道值按 (会话, 命名空间, 通道, 版本) 保存，已存在的版本不重复写入
+UPSERT_BLOBS_STMT = pg_insert(BLOBS).on_conflict_do_nothing()
+
+_upsert_checkpoint = pg_insert(CHECKPOINTS)
+UPSERT_CHECKPOINT_STMT = _upsert_checkpoint.on_conflict_do_update(
+    index_elements=[CHECKPOINTS.c.thread_id, CHECKPOINTS.c.checkpoint_ns, CHECKPOINTS.c.checkpoint_id],
+    set_={
+        "checkpoint_type": _upsert_checkpoint.excluded.checkpoint_type,
+        "checkpoint": _upsert_checkpoint.excluded.checkpoint,
+        "metadata_json": _upsert_checkpoint.excluded.metadata_json,
+    }
+)
+
+# 普通写入已存在时保留旧值；错误、中断等特殊写入（序号为负）覆盖旧值
+_upsert_writes = pg_insert(WRITES)
+INSERT_WRITES_STMT = _upsert_writes.on_conflict_do_nothing()
+UPSERT_WRITES_STMT = _upsert_writes.on_conflict_do_update(
+    index_elements=[
+        WRITES.c.thread_id, WRITES.c.checkpoint_ns, WRITES.c.checkpoint_id, WRITES.c.task_id, WRITES.c.idx
+    ],
+    set_={
+        "channel": _upsert_writes.excluded.channel,
+        "blob_type": _upsert_writes.excluded.blob_type,
+        "blob": _upsert_writes.excluded.blob,
+        "task_path": _upsert_writes.excluded.task_path,
+    }
+)
+
+CHECKPOINT_COLUMNS = (
+    CHECKPOINTS.c.thread_id,
+    CHECKPOINTS.c.checkpoint_ns,
+    CHECKPOINTS.c.checkpoint_id,
+    CHECKPOINTS.c.parent_checkpoint_id,
+    CHECKPOINTS.c.checkpoint_type,
+    CHECKPOINTS.c.checkpoint,
+    CHECKPOINTS.c.metadata_json,
+)
+
+
+def _metadata_filter(filter: Dict[str, Any], dialect: str):
+    """检查点元数据的过滤条件（PostgreSQL 使用 JSONB 包含运算，SQLite 逐个键比较 JSON 值）"""
+    if dialect == "postgresql":
+        return CHECKPOINTS.c.metadata_json.contains(filter)
+    return and_(*(
+        func.json_extract(CHECKPOINTS.c.metadata_json, f'$."{key}"').is_(func.json_extract(json.dumps(value), "$"))
+        for key, value in filter.items()
+    ))
+
+
+def _list_stmt(
+    config: Optional[RunnableConfig],
+    filter: Optional[Dict[str, Any]] = None,
+    before: Optional[RunnableConfig] = None,
+    limit: Optional[int] = None,
+    dialect: str = "postgresql"
+):
+    """构建检查点查询（按 checkpoint_id 倒序，即最新的在前）"""
+    stmt = select(*CHECKPOINT_COLUMNS)
+    if config:
+        configurable = config["configurable"]
+        stmt = stmt.where(CHECKPOINTS.c.thread_id == configurable["thread_id"])
+        if configurable.get("checkpoint_ns") is not None:
+            stmt = stmt.where(CHECKPOINTS.c.checkpoint_ns == configurable["checkpoint_ns"])
+        if checkpoint_id := get_checkpoint_id(config):
+            stmt = stmt.where(CHECKPOINTS.c.checkpoint_id == checkpoint_id)
+    if filter:
+        stmt = stmt.where(_metadata_filter(filter, dialect))
+    if before and (before_id := get_checkpoint_id(before)):
+        stmt = stmt.where(CHECKPOINTS.c.checkpoint_id < before_id)
+    stmt = stmt.order_by(CHECKPOINTS.c.checkpoint_id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def _blobs_stmt(keys: List[Tuple[str, str, str, str]]):
+    """查询一组 (会话, 命名空间, 通道, 版本) 的通道值"""
+    return select(
+        BLOBS.c.thread_id, BLOBS.c.checkpoint_ns, BLOBS.c.channel, BLOBS.c.version,
+        BLOBS.c.blob_type, BLOBS.c.blob
+    ).where(
+        tuple_(BLOBS.c.thread_id, BLOBS.c.checkpoint_ns, BLOBS.c.channel, BLOBS.c.version).in_(keys)
+    )
+
+
+def _writes_stmt(keys: List[Tuple[str, str, str]]):
+    """查询一组检查点的待写入，按任务路径、任务ID和序号排序"""
+    return select(
+        WRITES.c.thread_id, WRITES.c.checkpoint_ns, WRITES.c.checkpoint_id,
+        WRITES.c.task_id, WRITES.c.channel, WRITES.c.blob_type, WRITES.c.blob
+    ).where(
+        tuple_(WRITES.c.thread_id, WRITES.c.checkpoint_ns, WRITES.c.checkpoint_id).in_(keys)
+    ).order_by(WRITES.c.task_path, WRITES.c.task_id, WRITES.c.idx)
+
+
+def _expired_thread_ids_stmt(cutoff: datetime):
+    """查询最近的检查点也早于 cutoff 的会话"""
+    newer = CHECKPOINTS.alias("newer")
+    return select(CHECKPOINTS.c.thread_id).distinct().where(
+        CHECKPOINTS.c.created_at < cutoff,
+        ~exists().where(newer.c.thread_id == CHECKPOINTS.c.thread_id, newer.c.created_at >= cutoff)
+    )
+
+
+def _expired_checkpoints_stmt(cutoff: datetime):
+    """删除早于 cutoff 的检查点（每个会话和命名空间保留最新的一个），返回被删除的检查点"""
+    latest = CHECKPOINTS.alias("latest")
+    return delete(CHECKPOINTS).where(
+        CHECKPOINTS.c.created_at < cutoff,
+        exists().where(
+            latest.c.thread_id == CHECKPOINTS.c.thread_id,
+            latest.c.checkpoint_ns == CHECKPOINTS.c.checkpoint_ns,
+            latest.c.checkpoint_id > CHECKPOINTS.c.checkpoint_id
+        )
+    ).returning(CHECKPOINTS.c.thread_id, CHECKPOINTS.c.checkpoint_ns, CHECKPOINTS.c.checkpoint_id)
+
+
+def _expired_blobs_stmt(cutoff: datetime):
+    """删除早于 cutoff 且已被更新版本取代的通道值
+
+    每个通道保留早于 cutoff 的最新版本：保留下来的检查点引用的要么是它，要么是更新的版本。
+    """
+    newer = BLOBS.alias("newer")
+    return delete(BLOBS).where(
+        BLOBS.c.created_at < cutoff,
+        exists().where(
+            newer.c.thread_id == BLOBS.c.thread_id,
+            newer.c.checkpoint_ns == BLOBS.c.checkpoint_ns,
+            newer.c.channel == BLOBS.c.channel,
+            newer.c.created_at > BLOBS.c.created_at,
+            newer.c.created_at < cutoff
+        )
+    )
+
+
+def _delete_threads_stmts(thread_ids: Sequence[str]):
+    """删除会话的所有检查点、通道值和待写入"""
+    return [
+        delete(table).where(table.c.thread_id.in_(thread_ids))
+        for table in (WRITES, BLOBS, CHECKPOINTS)
+    ]
+
+
+class DatabaseCheckpointSaver(BaseCheckpointSaver[str]):
+    """保存在技能数据库中的 LangGraph 检查点存储
+
+    - 检查点、通道值和待写入分别保存在 agent_checkpoints、agent_checkpoint_blobs、
+      agent_checkpoint_writes 表中（由 DatabaseManager.create_tables() 创建）
+    - 通道值按版本保存，未变化的通道（例如很长的消息历史）不会在每个检查点重复写入
+    - 每次 put / put_writes 的所有行在一个事务中批量写入
+    - 设置 ttl_seconds 后由 prune_expired()（或 `python checkpointer.py prune` 定时任务）清理过期数据：
+      最近的检查点也已过期的会话整体删除，其他会话删除过期的历史检查点（保留最新的一个）
+      及不再被引用的通道值；保存检查点时不会清理
+
+    清理假设会话的检查点是线性的（不从历史检查点分叉），且图中没有使用 DeltaChannel。
+    """
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        async_db_manager: Optional[AsyncDatabaseManager] = None,
+        ttl_seconds: Optional[float] = None,
+        serde=None
+    ):
+        """初始化检查点存储
+
+        Args:
+            db_manager: 数据库管理器（复用其引擎和连接池）
+            async_db_manager: 异步数据库管理器（可选），提供时异步方法不会阻塞事件循环，
+                否则异步方法在线程池中执行同步版本
+            ttl_seconds: 检查点保留时间（秒），prune_expired() 的默认值，None 表示不清理
+            serde: LangGraph 序列化器，默认为 JsonPlusSerializer
+        """
+        super().__init__(serde=serde)
+        self.db_manager = db_manager
+        self.async_db_manager = async_db_manager
+        self.ttl_seconds = ttl_seconds
+
+    # ========== 行与检查点的转换 ==========
+
+    def _checkpoint_rows(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> Tuple[Dict, List[Dict], RunnableConfig]:
+        """将检查点转换为 agent_checkpoints 行和 agent_checkpoint_blobs 行"""
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+
+        values = checkpoint.get("channel_values", {})
+        stripped = {k: v for k, v in checkpoint.items() if k != "channel_values"}
+        blob_rows = []
+        for channel, version in new_versions.items():
+            blob_type, blob = (
+                self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None)
+            )
+            blob_rows.append({
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "channel": channel,
+                "version": str(version),
+                "blob_type": blob_type,
+                "blob": blob,
+            })
+
+        checkpoint_type, data = self.serde.dumps_typed(stripped)
+        checkpoint_row = {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+            "parent_checkpoint_id": configurable.get("checkpoint_id"),
+            "checkpoint_type": checkpoint_type,
+            "checkpoint": data,
+            "metadata_json": get_serializable_checkpoint_metadata(config, metadata),
+        }
+        next_config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+        return checkpoint_row, blob_rows, next_config
+
+    def _write_rows(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str
+    ) -> Tuple[Any, List[Dict]]:
+        """将待写入转换为 agent_checkpoint_writes 行，返回 (写入语句, 行列表)"""
+        configurable = config["configurable"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            blob_type, blob = self.serde.dumps_typed(value)
+            rows.append({
+                "thread_id": configurable["thread_id"],
+                "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+                "checkpoint_id": configurable["checkpoint_id"],
+                "task_id": task_id,
+                "idx": WRITES_IDX_MAP.get(channel, idx),
+                "channel": channel,
+                "blob_type": blob_type,
+                "blob": blob,
+                "task_path": task_path,
+            })
+        special = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        return (UPSERT_WRITES_STMT if special else INSERT_WRITES_STMT), rows
+
+    def _loads(self, blob_type: str, blob: Optional[bytes]) -> Any:
+        return self.serde.loads_typed((blob_type, blob or b""))
+
+    def _decode_checkpoints(self, rows) -> Tuple[List[Tuple[Any, Checkpoint]], List, List]:
+        """解码检查点行，返回 (行和检查点, 需要读取的通道值键, 需要读取的待写入键)"""
+        decoded = []
+        blob_keys = []
+        for row in rows:
+            checkpoint = self._loads(row.checkpoint_type, row.checkpoint)
+            decoded.append((row, checkpoint))
+            for channel, version in checkpoint.get("channel_versions", {}).items():
+                blob_keys.append((row.thread_id, row.checkpoint_ns, channel, str(version)))
+        write_keys = [(row.thread_id, row.checkpoint_ns, row.checkpoint_id) for row, _ in decoded]
+        return decoded, blob_keys, write_keys
+
+    def _build_tuples(self, decoded, blob_rows, write_rows) -> List[CheckpointTuple]:
+        """将检查点、通道值和待写入组装为 CheckpointTuple"""
+        blobs = {
+            (r.thread_id, r.checkpoint_ns, r.channel, r.version): r
+            for r in blob_rows
+        }
+        writes: Dict[Tuple[str, str, str], List] = {}
+        for r in write_rows:
+            writes.setdefault((r.thread_id, r.checkpoint_ns, r.checkpoint_id), []).append(
+                (r.task_id, r.channel, self._loads(r.blob_type, r.blob))
+            )
+
+        tuples = []
+        for row, checkpoint in decoded:
+            channel_values = {}
+            for channel, version in checkpoint.get("channel_versions", {}).items():
+                blob = blobs.get((row.thread_id, row.checkpoint_ns, channel, str(version)))
+                if blob is not None and blob.blob_type != "empty":
+                    channel_values[channel] = self._loads(blob.blob_type, blob.blob)
+            tuples.append(CheckpointTuple(
+                config={
+                    "configurable": {
+                        "thread_id": row.thread_id,
+                        "checkpoint_ns": row.checkpoint_ns,
+                        "checkpoint_id": row.checkpoint_id,
+                    }
+                },
+                checkpoint={**checkpoint, "channel_values": channel_values},
+                metadata=row.metadata_json or {},
+                parent_config=(
+                    {
+                        "configurable": {
+                            "thread_id": row.thread_id,
+                            "checkpoint_ns": row.checkpoint_ns,
+                            "checkpoint_id": row.parent_checkpoint_id,
+                        }
+                    }
+                    if row.parent_checkpoint_id
+                    else None
+                ),
+                pending_writes=writes.get((row.thread_id, row.checkpoint_ns, row.checkpoint_id), []),
+            ))
+        return tuples
+
+    def _cutoff(self, ttl_seconds: float) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+
+    # ========== 同步接口 ==========
+
+    def _load(self, session, stmt) -> List[CheckpointTuple]:
+        """执行检查点查询，并批量读取这些检查点的通道值和待写入"""
+        decoded, blob_keys, write_keys = self._decode_checkpoints(session.execute(stmt).all())
+        if not decoded:
+            return []
+        blob_rows = session.execute(_blobs_stmt(blob_keys)).all() if blob_keys else []
+        write_rows = session.execute(_writes_stmt(write_keys)).all()
+        return self._build_tuples(decoded, blob_rows, write_rows)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """读取检查点（config 中没有 checkpoint_id 时读取会话的最新检查点）"""
+        config = {"configurable": {"checkpoint_ns": "", **config["configurable"]}}
+        session = self.db_manager.get_session()
+        try:
+            tuples = self._load(session, _list_stmt(config, limit=1))
+            return tuples[0] if tuples else None
+        finally:
+            session.close()
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[CheckpointTuple]:
+        """列出检查点（最新的在前）"""
+        session = self.db_manager.get_session()
+        try:
+            tuples = self._load(
+                session, _list_stmt(config, filter, before, limit, self.db_manager.engine.dialect.name)
+            )
+        finally:
+            session.close()
+        yield from tuples
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        """保存检查点及其变化的通道值（一个事务）"""
+        checkpoint_row, blob_rows, next_config = self._checkpoint_rows(
+            config, checkpoint, metadata, new_versions
+        )
+        session = self.db_manager.get_session()
+        try:
+            if blob_rows:
+                session.execute(UPSERT_BLOBS_STMT, blob_rows)
+            session.execute(UPSERT_CHECKPOINT_STMT, checkpoint_row)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = ""
+    ) -> None:
+        """批量保存节点的待写入"""
+        if not writes:
+            return
+        stmt, rows = self._write_rows(config, writes, task_id, task_path)
+        session = self.db_manager.get_session()
+        try:
+            session.execute(stmt, rows)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def delete_thread(self, thread_id: str) -> None:
+        """删除会话的所有检查点"""
+        session = self.db_manager.get_session()
+        try:
+            for stmt in _delete_threads_stmts([thread_id]):
+                session.execute(stmt)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def prune_expired(self, ttl_seconds: Optional[float] = None) -> Dict[str, int]:
+        """清理过期的会话和检查点（保存检查点时不会自动清理，需要由定时任务调用）
+
+        Args:
+            ttl_seconds: 保留时间（秒），默认使用初始化时的 ttl_seconds
+
+        Returns:
+            删除的会话数和检查点数
+        """
+        ttl_seconds = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        if ttl_seconds is None:
+            return {"threads": 0, "checkpoints": 0}
+        session = self.db_manager.get_session()
+        try:
+            cutoff = self._cutoff(ttl_seconds)
+            thread_ids = session.execute(_expired_thread_ids_stmt(cutoff)).scalars().all()
+            if thread_ids:
+                for stmt in _delete_threads_stmts(thread_ids):
+                    session.execute(stmt)
+            removed = session.execute(_expired_checkpoints_stmt(cutoff)).all()
+            if removed:
+                session.execute(
+                    delete(WRITES).where(
+                        tuple_(WRITES.c.thread_id, WRITES.c.checkpoint_ns, WRITES.c.checkpoint_id).in_(
+                            [tuple(r) for r in removed]
+                        )
+                    )
+                )
+            session.execute(_expired_blobs_stmt(cutoff))
+            session.commit()
+            return {"threads": len(thread_ids), "checkpoints": len(removed)}
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    # ========== 异步接口 ==========
+
+    async def _aload(self, session, stmt) -> List[CheckpointTuple]:
+        """_load 的异步版本"""
+        decoded, blob_keys, write_keys = self._decode_checkpoints((await session.execute(stmt)).all())
+        if not decoded:
+            return []
+        blob_rows = (await session.execute(_blobs_stmt(blob_keys))).all() if blob_keys else []
+        write_rows = (await session.execute(_writes_stmt(write_keys))).all()
+        return self._build_tuples(decoded, blob_rows, write_rows)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """get_tuple 的异步版本"""
+        if self.async_db_manager is None:
+            return await asyncio.to_thread(self.get_tuple, config)
+        config = {"configurable": {"checkpoint_ns": "", **config["configurable"]}}
+        async with self.async_db_manager.get_session() as session:
+            tuples = await self._aload(session, _list_stmt(config, limit=1))
+            return tuples[0] if tuples else None
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None
+    ) -> AsyncIterator[CheckpointTuple]:
+        """list 的异步版本"""
+        if self.async_db_manager is None:
+            tuples = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+            )
+        else:
+            async with self.async_db_manager.get_session() as session:
+                tuples = await self._aload(
+                    session, _list_stmt(config, filter, before, limit, self.async_db_manager.engine.dialect.name)
+                )
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        """put 的异步版本"""
+        if self.async_db_manager is None:
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+        checkpoint_row, blob_rows, next_config = self._checkpoint_rows(
+            config, checkpoint, metadata, new_versions
+        )
+        async with self.async_db_manager.get_session() as session:
+            try:
+                if blob_rows:
+                    await session.execute(UPSERT_BLOBS_STMT, blob_rows)
+                await session.execute(UPSERT_CHECKPOINT_STMT, checkpoint_row)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+        return next_config
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = ""
+    ) -> None:
+        """put_writes 的异步版本"""
+        if not writes:
+            return
+        if self.async_db_manager is None:
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+        stmt, rows = self._write_rows(config, writes, task_id, task_path)
+        async with self.async_db_manager.get_session() as session:
+            try:
+                await session.execute(stmt, rows)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        """delete_thread 的异步版本"""
+        if self.async_db_manager is None:
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+        async with self.async_db_manager.get_session() as session:
+            try:
+                for stmt in _delete_threads_stmts([thread_id]):
+                    await session.execute(stmt)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话检查点维护")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prune = subparsers.add_parser("prune", help="清理过期的会话和检查点（可由定时任务执行）")
+    prune.add_argument(
+        "--ttl-seconds", type=float, default=None,
+        help="保留时间（秒），默认从环境变量 CHECKPOINT_TTL_SECONDS 读取"
+    )
+    args = parser.parse_args()
+
+    ttl_seconds = args.ttl_seconds
+    if ttl_seconds is None and os.getenv("CHECKPOINT_TTL_SECONDS"):
+        ttl_seconds = float(os.getenv("CHECKPOINT_TTL_SECONDS"))
+    if ttl_seconds is None:
+        print("未设置保留时间（--ttl-seconds 或 CHECKPOINT_TTL_SECONDS），不清理检查点")
+        return
+    removed = DatabaseCheckpointSaver(DatabaseManager()).prune_expired(ttl_seconds)
+    print(f"已删除 {removed['threads']} 个过期会话、{removed['checkpoints']} 个过期检查点")
+
+
+if __name__ == "__main__":
+    main()
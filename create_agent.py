@@ -4,55 +4,359 @@
 """
 
 from langchain.agents import create_agent
-from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
-from langchain.messages import SystemMessage
-from langchain.tools import tool
+from langchain.agents.middleware import AgentMiddleware, AgentState, ModelRequest, ModelResponse
+from langchain.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain.tools import ToolRuntime
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
-from typing import Callable, Optional
+from langgraph.types import Command
+from typing import Annotated, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from typing_extensions import NotRequired
+import logging
 import os
 from dotenv import load_dotenv
 
-from db_utils import DatabaseManager
+from db_utils import DatabaseManager, CATALOG_COLUMNS, RANKING_COLUMNS
+from skill_cache import MISSING
+from skill_ranker import SkillIndex, estimate_tokens, select_within_budget
+from skill_sections import find_section, format_toc
+from skill_api import create_api_tools, get_api_executor
+from async_db_utils import AsyncDatabaseManager
+from checkpointer import DatabaseCheckpointSaver
+from engine_registry import env_bool
+from instrumentation import instrumentation
+from model_cache import ModelResponseCache, catalog_digest, get_model_cache, model_cache_key
 
 # 加载环境变量
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-def create_load_skill_tool(db_manager: DatabaseManager, agent_name: str):
+
+def _merge_loaded_skills(current: Optional[Dict], update: Optional[Dict]) -> Dict:
+    """loaded_skills 的合并函数（同一技能的新记录覆盖旧记录）"""
+    return {**(current or {}), **(update or {})}
+
+
+class SkillState(AgentState):
+    """带有已加载技能记录的 agent 状态"""
+    # skill_id（或按章节加载时的 "skill_id#锚点"）-> {"version", "updated_at", "tool_call_id"}，
+    # 随会话检查点保存
+    loaded_skills: NotRequired[Annotated[Dict[str, Dict], _merge_loaded_skills]]
+
+
+def _has_tool_message(messages, tool_call_id: Optional[str]) -> bool:
+    """会话消息中是否仍有指定工具调用的结果（消息可能已被裁剪或摘要）"""
+    if not tool_call_id:
+        return False
+    return any(
+        isinstance(message, ToolMessage) and message.tool_call_id == tool_call_id
+        for message in reversed(messages)
+    )
+
+
+def _skill_revision(skill) -> Dict:
+    """技能的版本信息（用于判断之前加载的内容是否过时）"""
+    return {
+        "version": skill.version,
+        "updated_at": skill.updated_at.isoformat() if skill.updated_at else None,
+    }
+
+
+def _loaded_status(runtime: ToolRuntime, key: str, skill) -> Optional[str]:
+    """本会话之前加载该技能（或章节）的状态
+    
+    Returns:
+        "current"（未变化且之前的工具结果仍在消息中）、"stale"（技能已更新）或 None（未加载过或结果已不在消息中）
+    """
+    loaded = (runtime.state.get("loaded_skills") or {}).get(key)
+    if not loaded:
+        return None
+    if any(loaded.get(k) != v for k, v in _skill_revision(skill).items()):
+        return "stale"
+    if _has_tool_message(runtime.state.get("messages", []), loaded.get("tool_call_id")):
+        return "current"
+    return None
+
+
+def skill_load_result(skill, title: str, content: str, runtime: Optional[ToolRuntime], section=None):
+    """返回 load_skill 的结果
+    
+    同一会话中已加载过该技能（或章节）、技能未更新且之前的工具结果仍在消息中时，只返回简短提示，
+    避免技能内容在消息历史中重复出现；否则返回完整内容并记录到会话状态的 loaded_skills。
+    
+    Args:
+        skill: get_skill_content 或 get_skill_outline 返回的技能记录
+        title: 结果标题，例如 "已加载技能: data_analysis"
+        content: 技能内容或章节文本
+        runtime: 工具运行时（在 agent 之外直接调用工具时为 None）
+        section: 加载单个章节时的章节记录
+    
+    Returns:
+        工具结果文本，或同时更新会话状态的 Command
+    """
+    if runtime is None:
+        return f"{title}\n\n{content}"
+    
+    # 章节按 "skill_id#锚点" 单独记录
+    key = f"{skill.skill_id}#{section.anchor}" if section else skill.skill_id
+    status = _loaded_status(runtime, key, skill)
+    if status == "current":
+        target = f"技能 '{skill.name}' 的章节 '{section.title}'" if section else f"技能 '{skill.name}'"
+        return (
+            f"{target}已在本会话中加载（版本 {skill.version}），"
+            "内容未变化，请直接参考之前 load_skill 返回的内容。"
+        )
+    if status == "stale":
+        title = f"{title}（技能已更新，以下为最新内容，之前加载的内容已过时）"
+    
+    return Command(update={
+        "loaded_skills": {key: {**_skill_revision(skill), "tool_call_id": runtime.tool_call_id}},
+        "messages": [ToolMessage(f"{title}\n\n{content}", tool_call_id=runtime.tool_call_id)],
+    })
+
+
+def skill_bundle_result(records, skill_name: str, runtime: Optional[ToolRuntime]):
+    """返回技能及其依赖技能的 load_skill 结果
+    
+    依赖技能的内容排在前面；本会话中已加载过且未变化的依赖只给出提示，不重复返回内容。
+    
+    Args:
+        records: get_skill_with_dependencies 返回的记录（技能本身在最后）
+        skill_name: 调用 load_skill 时的技能名称
+        runtime: 工具运行时（在 agent 之外直接调用工具时为 None）
+    
+    Returns:
+        工具结果文本，或同时更新会话状态的 Command
+    """
+    skill, dependencies = records[-1], records[:-1]
+    title = f"已加载技能: {skill_name}"
+    if not dependencies:
+        return skill_load_result(skill, title, skill.content, runtime)
+    
+    title = f"{title}（及其依赖的技能: {', '.join(d.name for d in dependencies)}）"
+    statuses = [_loaded_status(runtime, r.skill_id, r) if runtime else None for r in records]
+    if all(status == "current" for status in statuses):
+        return (
+            f"技能 '{skill.name}' 及其依赖的技能已在本会话中加载，"
+            "内容未变化，请直接参考之前 load_skill 返回的内容。"
+        )
+    
+    parts = [title]
+    for record, status in zip(records, statuses):
+        heading = f"===== 依赖技能: {record.name} =====" if record.depth else f"===== 技能: {record.name} ====="
+        if status == "current":
+            parts.append(f"{heading}\n（已在本会话中加载，内容未变化，请参考之前 load_skill 返回的内容）")
+        elif status == "stale":
+            parts.append(f"{heading}\n（技能已更新，以下为最新内容，之前加载的内容已过时）\n\n{record.content}")
+        else:
+            parts.append(f"{heading}\n\n{record.content}")
+    text = "\n\n".join(parts)
+    if runtime is None:
+        return text
+    
+    return Command(update={
+        "loaded_skills": {
+            record.skill_id: {**_skill_revision(record), "tool_call_id": runtime.tool_call_id}
+            for record, status in zip(records, statuses) if status != "current"
+        },
+        "messages": [ToolMessage(text, tool_call_id=runtime.tool_call_id)],
+    })
+
+
+def skill_toc_result(outline, skill_name: str, note: str = "") -> str:
+    """返回技能的章节目录，提示模型按章节加载"""
+    return (
+        f"{note}技能 '{skill_name}' 内容较长（{outline.content_length} 个字符），"
+        "以下为章节目录。请使用 load_skill(skill_name, section=锚点) 加载需要的章节，"
+        "或使用 section=\"all\" 加载全部内容。\n\n"
+        f"{format_toc(outline.sections)}"
+    )
+
+
+def create_load_skill_tool(
+    db_manager: DatabaseManager,
+    agent_name: str,
+    async_db_manager: Optional[AsyncDatabaseManager] = None,
+    section_threshold: Optional[int] = None
+):
     """创建 load_skill 工具
     
+    内容超过 section_threshold 个字符且有章节标题的技能，不指定章节时只返回章节目录，
+    模型再按需加载单个章节；章节文本在数据库中截取，不读取整个技能内容。
+    加载完整内容时，技能依赖的其他技能（requirements.dependencies，含间接依赖）在同一次查询中读取并一起返回。
+    
     Args:
         db_manager: 数据库管理器
         agent_name: 角色名称
+        async_db_manager: 异步数据库管理器（可选），提供时工具的异步调用
+            （agent.ainvoke/astream）不会阻塞事件循环
+        section_threshold: 按章节加载的内容长度阈值（字符数），如果不提供则从环境变量
+            SKILL_SECTION_THRESHOLD 读取，默认为 4000，0 表示始终返回完整内容
     
     Returns:
-        load_skill 工具函数
+        load_skill 工具
     """
-    @tool
-    def load_skill(skill_name: str) -> str:
+    if section_threshold is None:
+        section_threshold = int(os.getenv("SKILL_SECTION_THRESHOLD", "4000"))
+    
+    def plan(outline, skill_name: str, section: Optional[str]):
+        """决定加载方式：返回 ("full", None)、("section", 章节记录) 或 ("toc", 提示文本)"""
+        if section and section.strip().lower() != "all":
+            found = find_section(outline.sections, section)
+            if found is None:
+                return "toc", skill_toc_result(outline, skill_name, f"章节 '{section}' 未找到。")
+            return "section", found
+        if section or section_threshold <= 0 or not outline.sections or outline.content_length <= section_threshold:
+            return "full", None
+        return "toc", skill_toc_result(outline, skill_name)
+    
+    def load_skill(skill_name: str, section: Optional[str] = None, runtime: ToolRuntime = None):
         """按需加载技能的完整内容到 agent 的上下文中。
 
         当你需要处理特定类型的请求时，使用此工具加载详细的技能信息。
         这将为你提供该技能领域的全面指导、策略和最佳实践。
+        内容较长的技能会先返回章节目录，再通过 section 参数加载需要的章节。
+        加载完整内容时会同时返回该技能依赖的其他技能，无需再逐个加载。
 
         Args:
             skill_name: 要加载的技能名称
+            section: 要加载的章节（章节目录中的锚点、标题或序号），"all" 表示加载全部内容
         
         Returns:
-            技能的完整内容，包括指导原则、工作流程和最佳实践
+            技能的完整内容、单个章节的内容或章节目录
         """
-        # 从数据库获取技能
-        skill = db_manager.get_skill(agent_name, skill_name)
-        if skill:
-            return f"已加载技能: {skill_name}\n\n{skill.content}"
+        # 先读取技能概要和章节目录（不读取技能内容）
+        outline = db_manager.get_skill_outline(agent_name, skill_name)
+        if outline:
+            mode, detail = plan(outline, skill_name, section)
+            if mode == "toc":
+                return detail
+            if mode == "section":
+                text = db_manager.get_section_text(outline.id, detail)
+                return skill_load_result(
+                    outline, f"已加载技能 {skill_name} 的章节: {detail.title}", text, runtime, detail
+                )
+            # 技能及其依赖的技能在一次查询中读取
+            records = db_manager.get_skill_with_dependencies(agent_name, skill_name)
+            if records:
+                return skill_bundle_result(records, skill_name, runtime)
+            skill = db_manager.get_skill_content(agent_name, skill_name)
+            if skill:
+                return skill_load_result(skill, f"已加载技能: {skill_name}", skill.content, runtime)
         
         # 技能未找到，列出可用技能
-        all_skills = db_manager.get_all_skills(agent_name)
-        available = ", ".join(s["name"] for s in all_skills)
+        catalog = db_manager.get_skill_catalog(agent_name, ("name",))
+        available = ", ".join(s.name for s in catalog)
         return f"技能 '{skill_name}' 未找到。可用技能: {available}"
     
-    return load_skill
+    async def aload_skill(skill_name: str, section: Optional[str] = None, runtime: ToolRuntime = None):
+        """load_skill 的异步版本，使用异步数据库管理器查询"""
+        outline = await async_db_manager.get_skill_outline(agent_name, skill_name)
+        if outline:
+            mode, detail = plan(outline, skill_name, section)
+            if mode == "toc":
+                return detail
+            if mode == "section":
+                text = await async_db_manager.get_section_text(outline.id, detail)
+                return skill_load_result(
+                    outline, f"已加载技能 {skill_name} 的章节: {detail.title}", text, runtime, detail
+                )
+            records = await async_db_manager.get_skill_with_dependencies(agent_name, skill_name)
+            if records:
+                return skill_bundle_result(records, skill_name, runtime)
+            skill = await async_db_manager.get_skill_content(agent_name, skill_name)
+            if skill:
+                return skill_load_result(skill, f"已加载技能: {skill_name}", skill.content, runtime)
+        
+        catalog = await async_db_manager.get_skill_catalog(agent_name, ("name",))
+        available = ", ".join(s.name for s in catalog)
+        return f"技能 '{skill_name}' 未找到。可用技能: {available}"
+    
+    # 未提供异步管理器时，异步调用由 LangChain 放到线程池执行同步版本
+    return StructuredTool.from_function(
+        func=load_skill,
+        coroutine=aload_skill if async_db_manager else None,
+        name="load_skill"
+    )
+
+
+def skill_line(skill) -> str:
+    """技能目录中单个技能的提示行"""
+    return f"- **{skill.name}**: {skill.short_description or skill.description}"
+
+
+def build_skills_prompt(skills) -> str:
+    """构建技能列表提示（每个技能一行，顺序与技能目录一致）
+    
+    Args:
+        skills: get_skill_catalog 返回的技能目录
+    
+    Returns:
+        技能列表文本
+    """
+    return "\n".join(skill_line(skill) for skill in skills)
+
+
+def skill_search_text(skill) -> str:
+    """技能用于相关性检索的文本（名称、简短描述和标签）"""
+    return " ".join([skill.name, skill.short_description or skill.description or "", *(skill.tags or [])])
+
+
+def _latest_user_text(messages) -> str:
+    """返回最近一条用户消息的文本"""
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.text
+    return ""
+
+
+def create_search_skills_tool(middleware: "SkillMiddleware", limit: int = 10):
+    """创建 search_skills 工具（排序模式下用于查找未列入系统提示的技能）
+    
+    Args:
+        middleware: 技能中间件，工具使用其技能目录和检索索引
+        limit: 每次最多返回的技能数
+    
+    Returns:
+        search_skills 工具
+    """
+    def format_results(catalog, query: str) -> str:
+        lines, index = catalog[2], catalog[4]
+        matched = index.search(query, limit)
+        if not matched:
+            return f"没有找到与 '{query}' 相关的技能。"
+        return "\n".join(lines[i] for i, _ in matched)
+    
+    def search_skills(query: str) -> str:
+        """按关键词搜索可用技能。
+
+        系统提示中只列出了与当前问题最相关的部分技能，
+        需要其他技能时，使用此工具按关键词搜索，再使用 load_skill 加载。
+
+        Args:
+            query: 搜索关键词，例如技能的名称、用途或标签
+        
+        Returns:
+            匹配的技能列表（名称和简短描述）
+        """
+        middleware._refresh_catalog()
+        return format_results(middleware._catalog, query)
+    
+    async def asearch_skills(query: str) -> str:
+        """search_skills 的异步版本，使用异步数据库管理器检查技能目录版本"""
+        await middleware._arefresh_catalog()
+        return format_results(middleware._catalog, query)
+    
+    return StructuredTool.from_function(
+        func=search_skills,
+        coroutine=asearch_skills if middleware.async_db_manager else None,
+        name="search_skills"
+    )
 
 
 class SkillMiddleware(AgentMiddleware):
@@ -60,55 +364,502 @@ class SkillMiddleware(AgentMiddleware):
     
     这个中间件使技能可被发现，而无需预先加载其完整内容。
     它使用渐进式披露模式，让 agent 按需加载技能。
+    
+    技能目录按版本号缓存：每次模型调用只检查版本号（命中缓存时不查询数据库），
+    版本号变化时才重新读取技能目录并重建；系统消息未变化时复用上次构建的 SystemMessage。
+    技能顺序固定（优先级、名称、skill_id），相同的技能目录生成逐字节相同的提示，
+    便于模型服务端的提示前缀缓存命中。
+    
+    已加载的技能记录在会话状态的 loaded_skills 中（见 SkillState），同一会话重复加载
+    未变化的技能时 load_skill 只返回简短提示。
+    
+    设置 max_skills 或 token_budget 时启用排序模式：按最近一条用户消息对技能做 BM25 排序
+    （检索索引随技能目录版本构建一次），只注入最相关且不超出预算的技能，
+    并提供 search_skills 工具供模型查找其余技能。
     """
     
-    def __init__(self, db_manager: DatabaseManager, agent_name: str):
+    state_schema = SkillState
+    
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        agent_name: str,
+        async_db_manager: Optional[AsyncDatabaseManager] = None,
+        max_skills: int = 0,
+        token_budget: int = 0,
+        section_threshold: Optional[int] = None
+    ):
         """初始化并生成技能提示
         
         Args:
             db_manager: 数据库管理器
             agent_name: 角色名称
+            async_db_manager: 异步数据库管理器（可选），供异步调用（agent.ainvoke/astream）使用
+            max_skills: 系统提示中最多列出的技能数，0 表示不限制
+            token_budget: 技能列表的 token 预算（估算值），0 表示不限制
+            section_threshold: load_skill 按章节加载的内容长度阈值（字符数），见 create_load_skill_tool
         """
         self.db_manager = db_manager
         self.agent_name = agent_name
+        self.async_db_manager = async_db_manager
+        self.max_skills = max_skills
+        self.token_budget = token_budget
+        self.ranking = max_skills > 0 or token_budget > 0
+        self._catalog_columns = RANKING_COLUMNS if self.ranking else CATALOG_COLUMNS
         
-        # 从数据库获取所有技能并构建技能提示
-        skills = self.db_manager.get_all_skills(agent_name)
-        skills_list = []
-        for skill in skills:
-            skills_list.append(
-                f"- **{skill['name']}**: {skill['description']}"
-            )
-        self.skills_prompt = "\n".join(skills_list)
+        # 以下状态都整体替换以保证多线程下一致
+        # (技能目录版本号, 技能目录, 每个技能的提示行, 每行的 token 数, 检索索引)
+        self._catalog = (MISSING, (), (), (), None)
+        # (技能目录, 查询文本, 附加内容块)
+        self._addendum = (None, None, None)
+        # (原系统消息, 附加内容块, 注入后的系统消息)
+        self._system_message_cache = (None, None, None)
         
-        # 创建 load_skill 工具
-        self.load_skill_tool = create_load_skill_tool(db_manager, agent_name)
+        # 从数据库获取技能目录（不加载技能内容）
+        self._refresh_catalog()
+        
+        # 创建工具
+        self.load_skill_tool = create_load_skill_tool(
+            db_manager, agent_name, async_db_manager, section_threshold
+        )
+        self.search_skills_tool = create_search_skills_tool(self) if self.ranking else None
     
     @property
     def tools(self):
         """返回工具列表（作为属性以支持动态加载）"""
+        if self.search_skills_tool is not None:
+            return [self.load_skill_tool, self.search_skills_tool]
         return [self.load_skill_tool]
     
+    @property
+    def skills_prompt(self) -> str:
+        """完整的技能列表提示"""
+        return "\n".join(self._catalog[2])
+    
+    def _set_catalog(self, version, skills) -> None:
+        """保存技能目录，排序模式下同时构建检索索引"""
+        lines = tuple(skill_line(skill) for skill in skills)
+        costs, index = (), None
+        if self.ranking:
+            costs = tuple(estimate_tokens(line) + 1 for line in lines)
+            index = SkillIndex(skill_search_text(skill) for skill in skills)
+        self._catalog = (version, skills, lines, costs, index)
+    
+    def _refresh_catalog(self) -> None:
+        """技能目录版本号变化时重新读取技能目录"""
+        # 先读版本号再读目录：两次读取之间有写入时，下次调用会再重建一次，不会漏掉更新
+        version = self.db_manager.get_catalog_version(self.agent_name)
+        if version != self._catalog[0]:
+            self._set_catalog(
+                version, self.db_manager.get_skill_catalog(self.agent_name, self._catalog_columns)
+            )
+    
+    async def _arefresh_catalog(self) -> None:
+        """_refresh_catalog 的异步版本，使用异步数据库管理器查询"""
+        if self.async_db_manager is None:
+            self._refresh_catalog()
+            return
+        version = await self.async_db_manager.get_catalog_version(self.agent_name)
+        if version != self._catalog[0]:
+            self._set_catalog(
+                version,
+                await self.async_db_manager.get_skill_catalog(self.agent_name, self._catalog_columns)
+            )
+    
+    def _select_skills(self, catalog, query: str) -> List[int]:
+        """排序模式：选出与查询最相关且不超出预算的技能，按技能目录顺序返回编号
+        
+        与查询相关的技能按得分排在前面，其余技能按技能目录顺序（优先级）补足。
+        """
+        _, skills, _, costs, index = catalog
+        matched = [i for i, _ in index.search(query)] if query else []
+        matched_set = set(matched)
+        order = matched + [i for i in range(len(skills)) if i not in matched_set]
+        return sorted(select_within_budget(order, costs, self.max_skills, self.token_budget))
+    
+    def _build_addendum(self, catalog, query: str) -> dict:
+        """构建技能附加内容块"""
+        lines = catalog[2]
+        hint = ""
+        if self.ranking:
+            selected = self._select_skills(catalog, query)
+            skills_prompt = "\n".join(lines[i] for i in selected)
+            if len(selected) < len(lines):
+                hint = (
+                    f"\n\n以上只列出了与当前问题最相关的 {len(selected)} 个技能（共 {len(lines)} 个）。"
+                    "如果都不适用，使用 search_skills 工具按关键词搜索其他技能。"
+                )
+        else:
+            skills_prompt = "\n".join(lines)
+        return {
+            "type": "text",
+            "text": (
+                f"\n\n## 可用技能\n\n{skills_prompt}\n\n"
+                "当你需要处理特定类型的请求时，使用 load_skill 工具加载详细的技能信息。"
+                "这将为你提供该技能领域的全面指导、策略和最佳实践。"
+                f"{hint}"
+            )
+        }
+    
+    def _inject_skills(self, request: ModelRequest) -> ModelRequest:
+        """返回系统提示中追加了技能描述的请求"""
+        # 同一技能目录和同一用户消息（例如一轮对话中的多次模型调用）复用附加内容块
+        catalog = self._catalog
+        query = _latest_user_text(request.messages) if self.ranking else None
+        cached_catalog, cached_query, block = self._addendum
+        if cached_catalog is not catalog or cached_query != query:
+            block = self._build_addendum(catalog, query)
+            self._addendum = (catalog, query, block)
+        
+        base = request.system_message
+        cached_base, cached_block, cached_message = self._system_message_cache
+        if cached_block is block and (cached_base is base or cached_base == base):
+            return request.override(system_message=cached_message)
+        
+        # 追加到系统消息的内容块
+        base_blocks = list(base.content_blocks) if base is not None else []
+        new_system_message = SystemMessage(content=base_blocks + [block])
+        self._system_message_cache = (base, block, new_system_message)
+        return request.override(system_message=new_system_message)
+    
     def wrap_model_call(
         self,
         request: ModelRequest,
         handler: Callable[[ModelRequest], ModelResponse],
     ) -> ModelResponse:
         """同步：将技能描述注入到系统提示中"""
-        # 构建技能附加内容
-        skills_addendum = (
-            f"\n\n## 可用技能\n\n{self.skills_prompt}\n\n"
-            "当你需要处理特定类型的请求时，使用 load_skill 工具加载详细的技能信息。"
-            "这将为你提供该技能领域的全面指导、策略和最佳实践。"
+        with instrumentation.span("SkillMiddleware.wrap_model_call", "skills_middleware_seconds", agent=self.agent_name):
+            self._refresh_catalog()
+            request = self._inject_skills(request)
+        return handler(request)
+    
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """异步：将技能描述注入到系统提示中"""
+        with instrumentation.span("SkillMiddleware.awrap_model_call", "skills_middleware_seconds", agent=self.agent_name):
+            await self._arefresh_catalog()
+            request = self._inject_skills(request)
+        return await handler(request)
+
+
+def _message_text(message) -> str:
+    return message.text if hasattr(message, "text") else str(message.content)
+
+
+def _model_label(model) -> str:
+    """指标中使用的模型名称"""
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or model._llm_type
+
+
+def _message_key(message) -> Dict:
+    """缓存键中使用的消息内容（不包含消息ID等每次调用都不同的字段）"""
+    return {
+        "type": message.type,
+        "content": message.content,
+        "name": getattr(message, "name", None),
+        "tool_calls": [
+            {"name": call["name"], "args": call["args"], "id": call.get("id")}
+            for call in getattr(message, "tool_calls", None) or ()
+        ],
+        "tool_call_id": getattr(message, "tool_call_id", None),
+    }
+
+
+def _tool_definition(tool) -> Dict:
+    """模型看到的工具定义（名称、描述和参数 JSON Schema），用于计算模型响应的缓存键"""
+    if isinstance(tool, dict):
+        # 字典形式的工具（包括模型提供方的内置工具）按原样计入
+        return tool
+    return convert_to_openai_tool(tool)
+
+
+class ModelCacheMiddleware(AgentMiddleware):
+    """按完整输入精确匹配缓存模型响应的中间件（见 model_cache.py）
+    
+    放在 SkillMiddleware 之后，缓存键包含注入技能列表后的系统消息、消息列表、工具定义
+    （名称、描述和参数 JSON Schema）、模型名称、温度参数和角色技能目录的版本；
+    默认只缓存温度为 0 的模型调用。
+    技能目录版本变化时删除该角色在旧版本下缓存的响应。
+    
+    缓存只是优化：读取缓存出错时记录日志并直接调用模型，写入缓存出错时记录日志并照常返回模型的响应。
+    """
+    
+    def __init__(
+        self,
+        cache: ModelResponseCache,
+        db_manager: DatabaseManager,
+        agent_name: str,
+        async_db_manager: Optional[AsyncDatabaseManager] = None,
+        require_zero_temperature: bool = True
+    ):
+        """初始化
+        
+        Args:
+            cache: 模型响应缓存
+            db_manager: 数据库管理器（读取技能目录版本）
+            agent_name: 角色名称
+            async_db_manager: 异步数据库管理器（可选），供异步调用使用
+            require_zero_temperature: 是否只缓存温度为 0 的模型调用，默认为 True
+        """
+        self.cache = cache
+        self.db_manager = db_manager
+        self.agent_name = agent_name
+        self.async_db_manager = async_db_manager
+        self.require_zero_temperature = require_zero_temperature
+        self._catalog_version = None
+    
+    def _key(self, request: ModelRequest, catalog_version: str) -> Optional[str]:
+        """计算缓存键，不可缓存的调用返回 None"""
+        temperature = request.model_settings.get("temperature", getattr(request.model, "temperature", None))
+        if self.require_zero_temperature and temperature != 0:
+            return None
+        if request.response_format is not None:
+            return None
+        system = request.system_message
+        return model_cache_key(
+            _model_label(request.model),
+            temperature,
+            catalog_version,
+            system.content if system is not None else None,
+            [_message_key(m) for m in request.messages],
+            [_tool_definition(t) for t in request.tools],
+            {"tool_choice": request.tool_choice, "model_settings": request.model_settings},
         )
+    
+    @staticmethod
+    def _cached_response(messages: List[Dict]) -> ModelResponse:
+        result = messages_from_dict(messages)
+        for message in result:
+            # 去掉原消息ID，避免在会话状态中与其他消息冲突
+            message.id = None
+        return ModelResponse(result=result)
+    
+    @staticmethod
+    def _cacheable(response: ModelResponse) -> bool:
+        return response.structured_response is None and bool(response.result)
+    
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        """同步：命中缓存时不调用模型"""
+        try:
+            version = catalog_digest(self.db_manager.get_catalog_version(self.agent_name))
+            if version != self._catalog_version:
+                self.cache.invalidate_agent(self.agent_name, version)
+                self._catalog_version = version
+            key = self._key(request, version)
+            messages = self.cache.get(key, self.agent_name, version) if key is not None else None
+            cached = self._cached_response(messages) if messages is not None else None
+        except Exception as e:
+            logger.warning("读取模型响应缓存失败，直接调用模型: %s", e)
+            return handler(request)
+        if cached is not None:
+            return cached
+        response = handler(request)
+        if key is not None and self._cacheable(response):
+            try:
+                self.cache.set(key, self.agent_name, version, _model_label(request.model), messages_to_dict(response.result))
+            except Exception as e:
+                logger.warning("写入模型响应缓存失败: %s", e)
+        return response
+    
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """异步：命中缓存时不调用模型"""
+        try:
+            if self.async_db_manager is not None:
+                version = catalog_digest(await self.async_db_manager.get_catalog_version(self.agent_name))
+            else:
+                version = catalog_digest(self.db_manager.get_catalog_version(self.agent_name))
+            if version != self._catalog_version:
+                await self.cache.ainvalidate_agent(self.agent_name, version)
+                self._catalog_version = version
+            key = self._key(request, version)
+            messages = await self.cache.aget(key, self.agent_name, version) if key is not None else None
+            cached = self._cached_response(messages) if messages is not None else None
+        except Exception as e:
+            logger.warning("读取模型响应缓存失败，直接调用模型: %s", e)
+            return await handler(request)
+        if cached is not None:
+            return cached
+        response = await handler(request)
+        if key is not None and self._cacheable(response):
+            try:
+                await self.cache.aset(key, self.agent_name, version, _model_label(request.model), messages_to_dict(response.result))
+            except Exception as e:
+                logger.warning("写入模型响应缓存失败: %s", e)
+        return response
+
+
+class InstrumentationMiddleware(AgentMiddleware):
+    """记录模型调用和工具调用的耗时、输入 token 数和技能加载次数（见 instrumentation.py）
+    
+    放在 SkillMiddleware 之后，模型调用的耗时和 token 数不包含技能注入本身，
+    但输入 token 数包含注入的技能列表。启用埋点时由 create_skills_agent 添加。
+    """
+    
+    def __init__(self, agent_name: str):
+        """初始化
         
-        # 追加到系统消息的内容块
-        new_content = list(request.system_message.content_blocks) + [
-            {"type": "text", "text": skills_addendum}
-        ]
-        new_system_message = SystemMessage(content=new_content)
-        modified_request = request.override(system_message=new_system_message)
-        return handler(modified_request)
+        Args:
+            agent_name: 角色名称（作为指标的 agent 标签）
+        """
+        self.agent_name = agent_name
+    
+    def _before_model(self, request: ModelRequest) -> Dict:
+        texts = [_message_text(m) for m in request.messages]
+        if request.system_message is not None:
+            texts.append(_message_text(request.system_message))
+        tokens = sum(estimate_tokens(text) for text in texts)
+        labels = {"agent": self.agent_name, "model": _model_label(request.model)}
+        instrumentation.metrics.observe("skills_prompt_tokens", tokens, **labels)
+        return labels
+    
+    def _after_model(self, scope, labels: Dict, response: ModelResponse) -> None:
+        message = response.result[-1] if response.result else None
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            for kind in ("input_tokens", "output_tokens"):
+                if usage.get(kind):
+                    instrumentation.metrics.inc("skills_model_tokens_total", usage[kind], type=kind, **labels)
+            scope.set_attribute("usage", dict(usage))
+    
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        """同步：记录模型调用"""
+        labels = self._before_model(request)
+        with instrumentation.span("model.call", "skills_model_call_seconds", **labels) as scope:
+            response = handler(request)
+            self._after_model(scope, labels, response)
+        return response
+    
+    async def awrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """异步：记录模型调用"""
+        labels = self._before_model(request)
+        with instrumentation.span("model.call", "skills_model_call_seconds", **labels) as scope:
+            response = await handler(request)
+            self._after_model(scope, labels, response)
+        return response
+    
+    def _tool_labels(self, request) -> Dict:
+        tool_call = request.tool_call
+        if tool_call["name"] == "load_skill":
+            instrumentation.metrics.inc(
+                "skills_skill_loads_total",
+                agent=self.agent_name,
+                skill=tool_call.get("args", {}).get("skill_name")
+            )
+        return {"agent": self.agent_name, "tool": tool_call["name"]}
+    
+    @staticmethod
+    def _after_tool(scope, result) -> None:
+        if isinstance(result, ToolMessage) and result.status == "error":
+            scope.set_error(_message_text(result)[:200])
+    
+    def wrap_tool_call(self, request, handler):
+        """同步：记录工具调用"""
+        labels = self._tool_labels(request)
+        with instrumentation.span(f"tool.{labels['tool']}", "skills_tool_call_seconds", **labels) as scope:
+            result = handler(request)
+            self._after_tool(scope, result)
+        return result
+    
+    async def awrap_tool_call(self, request, handler):
+        """异步：记录工具调用"""
+        labels = self._tool_labels(request)
+        with instrumentation.span(f"tool.{labels['tool']}", "skills_tool_call_seconds", **labels) as scope:
+            result = await handler(request)
+            self._after_tool(scope, result)
+        return result
+
+
+def resolve_model_settings(
+    model_name: Optional[str] = None,
+    temperature: Optional[float] = None
+) -> Tuple[str, float]:
+    """确定模型名称和温度参数
+    
+    Args:
+        model_name: 模型名称，如果不提供则从环境变量 MODEL_NAME 读取，默认为 "gpt-4o"
+        temperature: 温度参数，如果不提供则从环境变量 TEMPERATURE 读取，默认为 0.7
+    
+    Returns:
+        (模型名称, 温度参数)
+    """
+    if model_name is None:
+        model_name = os.getenv("MODEL_NAME", "gpt-4o")
+    
+    if temperature is None:
+        temp_str = os.getenv("TEMPERATURE", "0.7")
+        try:
+            temperature = float(temp_str)
+        except ValueError:
+            temperature = 0.7
+    return model_name, temperature
+
+
+def create_chat_model(model_name: str, temperature: float, api_key: Optional[str] = None) -> BaseChatModel:
+    """创建 ChatOpenAI 模型
+    
+    Args:
+        model_name: 模型名称
+        temperature: 温度参数
+        api_key: OpenAI API 密钥，如果不提供则从环境变量 OPENAI_API_KEY 读取
+    
+    Returns:
+        聊天模型
+    """
+    if api_key is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        return ChatOpenAI(model=model_name, temperature=temperature, api_key=api_key)
+    return ChatOpenAI(model=model_name, temperature=temperature)
+
+
+def create_checkpointer(
+    db_manager: DatabaseManager,
+    async_db_manager: Optional[AsyncDatabaseManager] = None,
+    checkpointer_type: Optional[str] = None
+):
+    """创建检查点保存器（用于会话状态持久化）
+    
+    Args:
+        db_manager: 数据库管理器
+        async_db_manager: 异步数据库管理器（可选）
+        checkpointer_type: "memory"（进程内存）或 "database"（技能数据库），
+            如果不提供则从环境变量 CHECKPOINTER 读取，默认为 "memory"
+    
+    Returns:
+        MemorySaver 或 DatabaseCheckpointSaver
+    """
+    if checkpointer_type is None:
+        checkpointer_type = os.getenv("CHECKPOINTER", "memory")
+    if checkpointer_type not in ("memory", "database"):
+        raise ValueError(f"不支持的 checkpointer_type: '{checkpointer_type}'，可选值为 memory、database")
+    
+    if checkpointer_type == "database":
+        ttl = os.getenv("CHECKPOINT_TTL_SECONDS")
+        return DatabaseCheckpointSaver(
+            db_manager,
+            async_db_manager,
+            ttl_seconds=float(ttl) if ttl else None
+        )
+    return MemorySaver()
 
 
 def create_skills_agent(
@@ -116,7 +867,18 @@ def create_skills_agent(
     model_name: Optional[str] = None,
     temperature: Optional[float] = None,
     api_key: Optional[str] = None,
-    db_url: Optional[str] = None
+    db_url: Optional[str] = None,
+    use_async: bool = False,
+    db_manager: Optional[DatabaseManager] = None,
+    max_skills: Optional[int] = None,
+    skill_token_budget: Optional[int] = None,
+    checkpointer_type: Optional[str] = None,
+    api_tools: Optional[bool] = None,
+    llm: Optional[BaseChatModel] = None,
+    checkpointer=None,
+    async_db_manager: Optional[AsyncDatabaseManager] = None,
+    middleware: Sequence[AgentMiddleware] = (),
+    model_cache: Optional[bool] = None
 ):
     """创建带有技能功能的 agent
     
@@ -126,26 +888,44 @@ def create_skills_agent(
         temperature: 模型温度参数，如果不提供则从环境变量 TEMPERATURE 读取，默认为 0.7
         api_key: OpenAI API 密钥，如果不提供则从环境变量 OPENAI_API_KEY 读取
         db_url: 数据库连接 URL，如果不提供则从环境变量 DATABASE_URL 读取
+        use_async: 是否为 agent.ainvoke/astream 启用异步数据库访问（asyncpg），默认为 False
+        db_manager: 已有的数据库管理器（可选），提供时忽略 db_url，多个 agent 可共用同一个管理器及其缓存
+        max_skills: 系统提示中最多列出的技能数，如果不提供则从环境变量 SKILL_TOP_K 读取，默认为 0（不限制）
+        skill_token_budget: 技能列表的 token 预算，如果不提供则从环境变量 SKILL_TOKEN_BUDGET 读取，
+            默认为 0（不限制）；两者任一大于 0 时按用户消息对技能做相关性排序
+        checkpointer_type: 会话状态存储方式，"memory"（进程内存）或 "database"（技能数据库，
+            多个 worker 共享、重启不丢失），如果不提供则从环境变量 CHECKPOINTER 读取，默认为 "memory"
+        api_tools: 是否把角色技能中启用的 API 调用配置作为工具提供给 agent（通过共享连接池执行），
+            如果不提供则从环境变量 SKILL_API_TOOLS 读取，默认为 False
+        llm: 已创建的聊天模型（可选），提供时忽略 model_name、temperature 和 api_key，
+            例如使用其他模型服务，或在基准测试中使用 fake_chat_model.FakeChatModel
+        checkpointer: 已创建的检查点保存器（可选），提供时忽略 checkpointer_type，多个 agent 可共用
+        async_db_manager: 已有的异步数据库管理器（可选），提供时启用异步数据库访问（同 use_async=True）
+        middleware: 额外的中间件，在技能中间件之后、埋点中间件之前执行（例如限流）
+        model_cache: 是否缓存温度为 0 的模型调用的响应（按完整输入精确匹配，技能变化后失效），
+            如果不提供则从环境变量 MODEL_CACHE 读取，默认为 False
     
     Returns:
         配置好的 agent 实例
     """
     # 从环境变量读取配置（如果未提供参数）
-    if model_name is None:
-        model_name = os.getenv("MODEL_NAME", "gpt-4o")
+    model_name, temperature = resolve_model_settings(model_name, temperature)
     
-    if temperature is None:
-        temp_str = os.getenv("TEMPERATURE", "0.7")
-        try:
-            temperature = float(temp_str)
-        except ValueError:
-            temperature = 0.7
+    if max_skills is None:
+        max_skills = int(os.getenv("SKILL_TOP_K", "0"))
     
-    if api_key is None:
-        api_key = os.getenv("OPENAI_API_KEY")
+    if skill_token_budget is None:
+        skill_token_budget = int(os.getenv("SKILL_TOKEN_BUDGET", "0"))
     
-    # 初始化数据库管理器
-    db_manager = DatabaseManager(db_url)
+    if api_tools is None:
+        api_tools = env_bool("SKILL_API_TOOLS", "false")
+    
+    if model_cache is None:
+        model_cache = env_bool("MODEL_CACHE", "false")
+    
+    # 初始化数据库管理器（引擎和连接池按 URL 在进程内共享）
+    if db_manager is None:
+        db_manager = DatabaseManager(db_url)
     
     # 获取角色信息
     agent_info = db_manager.get_agent(agent_name)
@@ -160,23 +940,49 @@ def create_skills_agent(
         "然后基于该技能的指导来完成任务。"
     )
     
-    # 初始化模型
-    if api_key:
-        llm = ChatOpenAI(model=model_name, temperature=temperature, api_key=api_key)
-    else:
-        llm = ChatOpenAI(model=model_name, temperature=temperature)
+    # 初始化模型（未提供已创建的模型时）
+    if llm is None:
+        llm = create_chat_model(model_name, temperature, api_key)
+    
+    # 异步调用时使用 asyncpg 查询技能，避免阻塞事件循环
+    if async_db_manager is None and use_async:
+        async_db_manager = AsyncDatabaseManager(db_manager.db_url)
     
     # 创建检查点保存器（用于状态持久化）
-    checkpointer = MemorySaver()
+    if checkpointer is None:
+        checkpointer = create_checkpointer(db_manager, async_db_manager, checkpointer_type)
     
     # 创建技能中间件
-    skill_middleware = SkillMiddleware(db_manager, agent_name)
+    skill_middleware = SkillMiddleware(
+        db_manager,
+        agent_name,
+        async_db_manager,
+        max_skills=max_skills,
+        token_budget=skill_token_budget
+    )
+    
+    # API 调用工具在创建 agent 时确定，技能的 API 配置变化后需重新创建 agent
+    tools = []
+    if api_tools:
+        executor = get_api_executor(db_manager, async_db_manager)
+        tools = create_api_tools(db_manager.get_agent_api_calls(agent_name), executor)
+    
+    # 启用埋点时记录模型和工具调用（关闭时不添加，没有额外开销）
+    # 模型响应缓存放在技能中间件之后（缓存键包含注入的技能列表），命中时不经过后续中间件
+    cache_middleware = []
+    if model_cache:
+        cache_middleware.append(ModelCacheMiddleware(
+            get_model_cache(db_manager, async_db_manager), db_manager, agent_name, async_db_manager
+        ))
+    middleware = [skill_middleware, *cache_middleware, *middleware]
+    if instrumentation.enabled:
+        middleware.append(InstrumentationMiddleware(agent_name))
     
     # 创建 agent，包含技能中间件
     agent = create_agent(
         model=llm,
-        tools=[],  # 工具由中间件提供
-        middleware=[skill_middleware],
+        tools=tools,  # load_skill 由中间件提供
+        middleware=middleware,
         checkpointer=checkpointer,
         system_prompt=system_prompt,
     )
@@ -0,0 +1,286 @@
+"""
+只读副本路由
+为 DatabaseManager / AsyncDatabaseManager 选择执行只读查询的数据库：在健康且复制延迟不超过上限的副本之间轮询，
+没有可用副本时回退到主库
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import event, exc, text
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+
+from engine_registry import get_async_engine, get_engine
+
+load_dotenv()
+
+
+# 副本的复制延迟（秒）：已回放全部收到的 WAL 时为 0，否则为距最后回放事务的时间；
+# 不处于恢复模式的服务器（例如提升后的副本）视为没有延迟。
+# 副本重启后接收位置从 WAL 段的起点算起，可能小于回放位置，因此用 <= 比较
+REPLICA_LAG_SQL = text(
+    "SELECT CASE "
+    "WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+# 复制延迟查询函数：接收副本的（同步）连接，返回复制延迟（秒）
+LagProbe = Callable[[Connection], float]
+
+
+def replica_lag(connection: Connection) -> float:
+    """默认的复制延迟查询
+    
+    PostgreSQL 副本查询 WAL 回放进度（REPLICA_LAG_SQL）；其他数据库没有通用的复制延迟查询，
+    只检查连通性，延迟视为 0（需要时通过 lag_probe 参数提供该数据库的查询）。
+    
+    Args:
+        connection: 副本的数据库连接
+        
+    Returns:
+        复制延迟（秒）
+    """
+    if connection.dialect.name == "postgresql":
+        return float(connection.execute(REPLICA_LAG_SQL).scalar())
+    connection.execute(text("SELECT 1"))
+    return 0.0
+
+
+# 为真时当前上下文的只读查询都走主库，见 read_your_writes()
+_read_primary: contextvars.ContextVar[bool] = contextvars.ContextVar("read_primary", default=False)
+
+
+def replica_urls_from_env() -> List[str]:
+    """从环境变量 DB_REPLICA_URLS 读取副本连接 URL（逗号分隔）"""
+    return [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+
+
+def reading_from_primary() -> bool:
+    """当前上下文是否在 read_your_writes() 中"""
+    return _read_primary.get()
+
+
+@contextmanager
+def read_your_writes():
+    """在上下文中让只读查询走主库（需要立即读到刚写入的数据时使用）
+
+    使用 contextvars 实现，对当前线程或协程中所有 DatabaseManager 和 AsyncDatabaseManager 生效。
+    """
+    token = _read_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_primary.reset(token)
+
+
+class Replica:
+    """一个只读副本的引擎和健康状态"""
+
+    def __init__(self, url: str, lag_probe: LagProbe = replica_lag):
+        """初始化副本
+
+        Args:
+            url: 副本的数据库连接 URL
+            lag_probe: 复制延迟查询函数，默认为 replica_lag
+        """
+        self.url = url
+        self.lag_probe = lag_probe
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reads = 0
+        # 创建后立即检查一次
+        self.checked_at = float("-inf")
+        self._create_engine()
+
+    def _create_engine(self) -> None:
+        self.engine = get_engine(self.url)
+        self.Session = sessionmaker(bind=self.engine)
+        event.listen(self.engine, "handle_error", self._on_error)
+
+    def _on_error(self, context) -> None:
+        # 连接断开时标记为不健康，下一次检查前不再使用
+        if context.is_disconnect:
+            self.mark_unhealthy(str(context.original_exception))
+
+    def mark_unhealthy(self, error: str) -> None:
+        """标记为不健康（等待下一次检查恢复）"""
+        self.healthy = False
+        self.error = error
+
+    def _record_lag(self, lag: float, max_lag: float) -> None:
+        self.lag = lag
+        self.healthy = lag <= max_lag
+        self.error = None if self.healthy else f"复制延迟 {lag:.3f}s 超过上限 {max_lag}s"
+
+    def _record_error(self, e: Exception) -> None:
+        self.lag = None
+        if isinstance(e, exc.DBAPIError):
+            self.mark_unhealthy(str(e.orig or e))
+        else:
+            self.mark_unhealthy(f"{type(e).__name__}: {e}")
+
+    def check(self, max_lag: float) -> None:
+        """查询复制延迟，更新健康状态
+
+        连接失败、连接池超时或 lag_probe 抛出任何异常时标记为不健康，到下一次检查前不再重试。
+
+        Args:
+            max_lag: 允许的最大复制延迟（秒）
+        """
+        try:
+            with self.engine.connect() as connection:
+                self._record_lag(self.lag_probe(connection), max_lag)
+        except Exception as e:
+            self._record_error(e)
+        finally:
+            self.checked_at = time.monotonic()
+
+    def status(self) -> Dict:
+        """返回副本状态"""
+        return {
+            "url": make_url(self.url).render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "error": self.error,
+            "reads": self.reads,
+        }
+
+
+class AsyncReplica(Replica):
+    """一个只读副本的异步引擎和健康状态（url 为异步驱动的 URL）"""
+
+    def _create_engine(self) -> None:
+        self.engine = get_async_engine(self.url)
+        self.Session = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+        event.listen(self.engine.sync_engine, "handle_error", self._on_error)
+
+    async def check(self, max_lag: float) -> None:
+        """查询复制延迟，更新健康状态（lag_probe 通过 run_sync 在同步连接上执行）
+
+        Args:
+            max_lag: 允许的最大复制延迟（秒）
+        """
+        try:
+            async with self.engine.connect() as connection:
+                self._record_lag(await connection.run_sync(self.lag_probe), max_lag)
+        except Exception as e:
+            self._record_error(e)
+        finally:
+            self.checked_at = time.monotonic()
+
+
+class ReplicaSet:
+    """只读副本集合
+
+    按间隔检查每个副本的连通性和复制延迟（只由一个线程检查，其他线程继续使用上次的结果），
+    延迟超过 max_lag 或连接失败的副本在下一次检查恢复前不参与选择。
+    """
+
+    replica_class = Replica
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        max_lag: float = 5.0,
+        check_interval: float = 5.0,
+        lag_probe: Optional[LagProbe] = None
+    ):
+        """初始化副本集合
+
+        Args:
+            urls: 副本的数据库连接 URL
+            max_lag: 允许的最大复制延迟（秒）
+            check_interval: 检查副本状态的间隔（秒）
+            lag_probe: 复制延迟查询函数，默认为 replica_lag（非 PostgreSQL 数据库只检查连通性）
+        """
+        self.replicas = [self.replica_class(url, lag_probe or replica_lag) for url in urls]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.fallback_reads = 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+    def _due(self) -> List[Replica]:
+        """到了检查时间的副本"""
+        now = time.monotonic()
+        return [replica for replica in self.replicas if now - replica.checked_at >= self.check_interval]
+
+    def _check_due(self) -> None:
+        """检查到期的副本"""
+        due = self._due()
+        if not due or not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            for replica in due:
+                replica.check(self.max_lag)
+        finally:
+            self._check_lock.release()
+
+    def _pick(self) -> Optional[Replica]:
+        """按轮询顺序返回下一个健康的副本，没有时返回 None"""
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.healthy:
+                    replica.reads += 1
+                    return replica
+            self.fallback_reads += 1
+            return None
+
+    def choose(self) -> Optional[Replica]:
+        """轮询选择一个健康的副本
+
+        Returns:
+            副本，没有可用副本时返回 None
+        """
+        self._check_due()
+        return self._pick()
+
+    def status(self) -> Dict:
+        """返回所有副本的状态"""
+        return {
+            "max_lag_seconds": self.max_lag,
+            "fallback_reads": self.fallback_reads,
+            "replicas": [replica.status() for replica in self.replicas],
+        }
+
+
+class AsyncReplicaSet(ReplicaSet):
+    """只读副本集合（异步引擎），检查和选择方式同 ReplicaSet，同一时间只有一个协程检查副本"""
+
+    replica_class = AsyncReplica
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_check_lock = asyncio.Lock()
+
+    async def _check_due(self) -> None:
+        """检查到期的副本"""
+        due = self._due()
+        if not due or self._async_check_lock.locked():
+            return
+        async with self._async_check_lock:
+            for replica in due:
+                await replica.check(self.max_lag)
+
+    async def choose(self) -> Optional[AsyncReplica]:
+        """轮询选择一个健康的副本
+
+        Returns:
+            副本，没有可用副本时返回 None
+        """
+        await self._check_due()
+        return self._pick()
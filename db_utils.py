@@ -1,22 +1,78 @@
 """
 数据库工具类
-用于连接和操作 PostgreSQL 数据库
+用于连接和操作 PostgreSQL 数据库（单机部署也可以使用 SQLite 数据库文件）
 """
 
-from sqlalchemy import create_engine, Column, String, Text, ForeignKey, Integer, Boolean, DateTime
+from sqlalchemy import (
+    Column, String, Text, ForeignKey, Integer, Boolean, DateTime, Index, JSON, LargeBinary, TypeDecorator,
+    select, insert, update, delete, bindparam, exc, or_, inspect, text, tuple_
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, insert as pg_insert
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import func
-from typing import List, Dict, Optional
+from sqlalchemy.sql.functions import now
+from typing import List, Dict, Iterable, NamedTuple, Optional, Sequence, Set, Tuple
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import hashlib
+import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+from skill_cache import SkillCache, MISSING
+from skill_sections import parse_sections
+from skill_deps import build_graph, missing_dependencies, resolve, transitive_closure
+from engine_registry import get_engine, pool_status
+from db_replicas import LagProbe, ReplicaSet, replica_urls_from_env, read_your_writes, reading_from_primary
+from instrumentation import instrument_class, track_cache
+
 load_dotenv()
 
 Base = declarative_base()
 
 
+# ========== 可移植类型（PostgreSQL 和 SQLite） ==========
+# 表结构在 PostgreSQL 上使用 JSONB、数组和带时区的时间戳；在 SQLite 上 JSON 和数组以 JSON 文本保存，
+# 时间戳按 UTC 保存。INSERT ... ON CONFLICT（pg_insert）在 SQLite 上生成相同的语法。
+
+class _SQLiteUTCDateTime(TypeDecorator):
+    """SQLite 上的时间戳：写入时转换为 UTC，读取时补上 UTC 时区（SQLite 不保存时区）"""
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+JSONType = JSONB().with_variant(JSON(), "sqlite")
+StringArray = ARRAY(String).with_variant(JSON(), "sqlite")
+Timestamp = DateTime(timezone=True).with_variant(_SQLiteUTCDateTime(), "sqlite")
+
+
+@compiles(now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    # CURRENT_TIMESTAMP 只精确到秒，同一秒内的多次更新无法通过 updated_at 区分
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def dialect_name(connection) -> str:
+    """返回数据库连接或 Session 的方言名称（"postgresql" 或 "sqlite"）"""
+    bind = connection.get_bind() if hasattr(connection, "get_bind") else connection
+    return bind.dialect.name
+
+
 class Agent(Base):
     """智能体角色表"""
     __tablename__ = 'agents'
@@ -26,11 +82,12 @@ class Agent(Base):
     description = Column(Text, comment='角色描述')
     system_prompt = Column(Text, comment='系统提示词')
     enabled = Column(Boolean, default=True, comment='是否启用')
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment='创建时间')
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment='更新时间')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now(), comment='更新时间')
     
-    # 关联关系：一个角色可以有多个技能
-    skills = relationship("Skill", back_populates="agent", cascade="all, delete-orphan")
+    # 关联关系：一个角色可以有多个技能，一个技能也可以分配给多个角色（通过 agent_skills）
+    skill_links = relationship("AgentSkill", back_populates="agent", cascade="all, delete-orphan")
+    skills = relationship("Skill", secondary="agent_skills", viewonly=True)
 
 
 class Skill(Base):
@@ -44,26 +101,61 @@ class Skill(Base):
     description = Column(Text, nullable=False, comment='详细描述')
     version = Column(String(20), nullable=False, comment='版本号')
     category = Column(String(50), comment='分类')
-    tags = Column(ARRAY(String), comment='标签数组')
+    tags = Column(StringArray, comment='标签数组')
     author = Column(String(100), comment='作者')
     content = Column(Text, nullable=False, comment='技能详细内容（content.md）')
+    content_hash = Column(String(64), comment='技能定义的 SHA-256（内容、示例、元数据、API 调用配置和依赖关系）')
     content_file_path = Column(String(500), comment='Gitee repo中的文件路径')
-    examples = Column(JSONB, comment='使用示例（examples.json）')
-    metadata_json = Column(JSONB, comment='额外元数据（metadata.json）')
+    examples = Column(JSONType, comment='使用示例（examples.json）')
+    metadata_json = Column(JSONType, comment='额外元数据（metadata.json）')
     status = Column(String(20), default='active', comment='状态：active, deprecated, archived')
-    priority = Column(Integer, default=0, comment='优先级')
-    agent_id = Column(Integer, ForeignKey('agents.id'), nullable=False, comment='所属角色ID')
-    enabled = Column(Boolean, default=True, comment='是否启用')
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment='创建时间')
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment='更新时间')
-    last_synced_at = Column(DateTime(timezone=True), comment='最后从Gitee同步的时间')
+    priority = Column(Integer, default=0, comment='默认优先级（可在 agent_skills 中按角色覆盖）')
+    # 已废弃：只记录首次导入该技能的角色（旧版本中技能属于单个角色），不表示技能分配给了哪些角色。
+    # 按角色筛选技能请经 agent_skills 关联（_agent_skills_select），不要使用该列
+    agent_id = Column(Integer, ForeignKey('agents.id'), nullable=False, comment='已废弃：首次导入该技能的角色ID（技能与角色的关联见 agent_skills）')
+    enabled = Column(Boolean, default=True, comment='是否启用（禁用后对所有角色不可见）')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now(), comment='更新时间')
+    last_synced_at = Column(Timestamp, comment='最后从Gitee同步的时间')
     gitee_repo_url = Column(String(500), comment='Gitee repo URL')
     gitee_commit_hash = Column(String(100), comment='对应的commit hash')
     
+    __table_args__ = (
+        Index('ix_skills_name', name),
+        Index('ix_skills_priority', priority),
+        Index('ix_skills_gitee_repo_url', gitee_repo_url),
+    )
+    
     # 关联关系
-    agent = relationship("Agent", back_populates="skills")
+    agent_links = relationship("AgentSkill", back_populates="skill", cascade="all, delete-orphan")
+    agents = relationship("Agent", secondary="agent_skills", viewonly=True)
     api_calls = relationship("SkillApiCall", back_populates="skill", cascade="all, delete-orphan")
     requirements = relationship("SkillRequirement", back_populates="skill", cascade="all, delete-orphan")
+    sections = relationship("SkillSection", back_populates="skill", cascade="all, delete-orphan")
+
+
+class AgentSkill(Base):
+    """角色与技能的关联表（技能只保存一份，按角色覆盖优先级和启用状态）"""
+    __tablename__ = 'agent_skills'
+    
+    agent_id = Column(Integer, ForeignKey('agents.id', ondelete='CASCADE'), primary_key=True, comment='角色ID')
+    skill_id = Column(Integer, ForeignKey('skills.id', ondelete='CASCADE'), primary_key=True, comment='技能ID')
+    priority = Column(Integer, comment='该角色下的优先级，为空时使用技能的默认优先级')
+    enabled = Column(Boolean, nullable=False, default=True, comment='该角色下是否启用')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now(), comment='更新时间')
+    
+    __table_args__ = (
+        # 按技能查找分配了该技能的角色
+        Index('ix_agent_skills_skill_id', skill_id),
+        # 角色的启用技能（技能目录、按名称查找技能的主查询）：按角色和启用状态过滤后直接得到技能ID，
+        # 代替旧版本 skills 表上的 ix_skills_agent_enabled / ix_skills_agent_name
+        Index('ix_agent_skills_agent_enabled', agent_id, enabled, skill_id),
+    )
+    
+    # 关联关系
+    agent = relationship("Agent", back_populates="skill_links")
+    skill = relationship("Skill", back_populates="agent_links")
 
 
 class SkillApiCall(Base):
@@ -76,18 +168,25 @@ class SkillApiCall(Base):
     method = Column(String(10), nullable=False, comment='HTTP方法：GET, POST, PUT, DELETE')
     url = Column(Text, nullable=False, comment='API URL')
     description = Column(Text, comment='API描述')
-    required_params = Column(JSONB, comment='必需参数列表')
-    optional_params = Column(JSONB, comment='可选参数列表')
+    required_params = Column(JSONType, comment='必需参数列表')
+    optional_params = Column(JSONType, comment='可选参数列表')
     auth_type = Column(String(20), comment='认证类型：bearer, api_key, oauth2, none')
-    auth_config = Column(JSONB, comment='认证配置')
-    request_headers = Column(JSONB, comment='请求头配置')
+    auth_config = Column(JSONType, comment='认证配置')
+    request_headers = Column(JSONType, comment='请求头配置')
     request_body_template = Column(Text, comment='请求体模板')
-    response_format = Column(JSONB, comment='响应格式说明')
+    response_format = Column(JSONType, comment='响应格式说明')
     timeout_seconds = Column(Integer, default=30, comment='超时时间（秒）')
     retry_count = Column(Integer, default=0, comment='重试次数')
     enabled = Column(Boolean, default=True, comment='是否启用')
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment='创建时间')
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment='更新时间')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now(), comment='更新时间')
+    
+    __table_args__ = (
+        Index(
+            'ix_skill_api_calls_skill_enabled', skill_id,
+            postgresql_where=(enabled == True), sqlite_where=(enabled == True)
+        ),
+    )
     
     # 关联关系
     skill = relationship("Skill", back_populates="api_calls")
@@ -103,12 +202,53 @@ class SkillRequirement(Base):
     requirement_name = Column(String(200), nullable=False, comment='依赖的技能ID或API密钥名称')
     requirement_value = Column(Text, comment='版本号或其他值')
     is_required = Column(Boolean, default=True, comment='是否必需')
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), comment='创建时间')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    
+    __table_args__ = (
+        Index('ix_skill_requirements_skill_id', skill_id),
+    )
     
     # 关联关系
     skill = relationship("Skill", back_populates="requirements")
 
 
+class SkillDependency(Base):
+    """技能依赖闭包表（每个技能与其直接或间接依赖的技能，包括深度为 0 的自身，见 skill_deps.py）"""
+    __tablename__ = 'skill_dependencies'
+    
+    skill_id = Column(Integer, ForeignKey('skills.id', ondelete='CASCADE'), primary_key=True, comment='技能ID')
+    dependency_id = Column(
+        Integer, ForeignKey('skills.id', ondelete='CASCADE'), primary_key=True, comment='依赖的技能ID'
+    )
+    depth = Column(Integer, nullable=False, comment='依赖深度（0 为自身，1 为直接依赖）')
+    
+    __table_args__ = (
+        Index('ix_skill_dependencies_dependency_id', dependency_id),
+    )
+
+
+class SkillSection(Base):
+    """技能内容章节表（按 Markdown 标题切分，只保存偏移量，章节文本从 skills.content 截取）"""
+    __tablename__ = 'skill_sections'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    skill_id = Column(Integer, ForeignKey('skills.id', ondelete='CASCADE'), nullable=False, comment='技能ID')
+    position = Column(Integer, nullable=False, comment='章节序号（从 1 开始）')
+    level = Column(Integer, nullable=False, comment='标题级别（1-6）')
+    title = Column(Text, nullable=False, comment='标题')
+    anchor = Column(String(200), nullable=False, comment='锚点（技能内唯一）')
+    start_offset = Column(Integer, nullable=False, comment='章节在内容中的起始字符偏移')
+    end_offset = Column(Integer, nullable=False, comment='章节在内容中的结束字符偏移（不含）')
+    token_count = Column(Integer, comment='估算的 token 数')
+    
+    __table_args__ = (
+        Index('ix_skill_sections_skill_position', skill_id, position),
+    )
+    
+    # 关联关系
+    skill = relationship("Skill", back_populates="sections")
+
+
 class SkillSyncLog(Base):
     """技能同步日志表"""
     __tablename__ = 'skill_sync_log'
@@ -119,349 +259,1823 @@ class SkillSyncLog(Base):
     gitee_commit_hash = Column(String(100), comment='Gitee commit hash')
     sync_status = Column(String(20), nullable=False, comment='同步状态：success, failed, partial')
     sync_message = Column(Text, comment='同步消息或错误信息')
-    files_updated = Column(ARRAY(String), comment='更新的文件列表')
+    files_updated = Column(StringArray, comment='更新的文件列表')
     sync_duration_ms = Column(Integer, comment='同步耗时（毫秒）')
-    synced_at = Column(DateTime(timezone=True), server_default=func.now(), comment='同步时间')
+    synced_at = Column(Timestamp, server_default=func.now(), comment='同步时间')
+    
+    __table_args__ = (
+        # 按技能查询同步记录（最后一次成功同步等），删除技能时级联删除日志也使用该索引
+        Index('ix_skill_sync_log_skill_synced_at', skill_id, synced_at),
+        # 按时间范围统计和清理过期日志
+        Index('ix_skill_sync_log_synced_at', synced_at),
+    )
+
+
+class SkillRepoSync(Base):
+    """技能仓库同步位置表（每个仓库、角色最近一次成功同步的 commit，不依赖技能行是否存在）"""
+    __tablename__ = 'skill_repo_syncs'
+    
+    gitee_repo_url = Column(String(500), primary_key=True, comment='Gitee repo URL')
+    agent_name = Column(String(100), primary_key=True, default='', comment='同步到的角色名称，空字符串表示不区分角色')
+    gitee_commit_hash = Column(String(100), nullable=False, comment='最近一次成功同步的 commit hash')
+    synced_at = Column(Timestamp, server_default=func.now(), comment='同步时间')
+
+
+class AgentCheckpoint(Base):
+    """会话检查点表（LangGraph checkpointer，见 checkpointer.py）"""
+    __tablename__ = 'agent_checkpoints'
+    
+    # 主键索引同时用于按 thread_id 读取最新检查点（checkpoint_id 按时间递增）
+    thread_id = Column(String(255), primary_key=True, comment='会话ID')
+    checkpoint_ns = Column(String(255), primary_key=True, default='', comment='检查点命名空间（子图）')
+    checkpoint_id = Column(String(64), primary_key=True, comment='检查点ID')
+    parent_checkpoint_id = Column(String(64), comment='父检查点ID')
+    checkpoint_type = Column(String(32), nullable=False, comment='序列化类型')
+    checkpoint = Column(LargeBinary, nullable=False, comment='序列化后的检查点（不含通道值）')
+    metadata_json = Column(JSONType, comment='检查点元数据')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    
+    __table_args__ = (
+        Index('ix_agent_checkpoints_created_at', created_at),
+    )
+
+
+class AgentCheckpointBlob(Base):
+    """会话检查点通道值表（每个通道的每个版本只保存一次）"""
+    __tablename__ = 'agent_checkpoint_blobs'
+    
+    thread_id = Column(String(255), primary_key=True, comment='会话ID')
+    checkpoint_ns = Column(String(255), primary_key=True, default='', comment='检查点命名空间（子图）')
+    channel = Column(String(255), primary_key=True, comment='通道名称')
+    version = Column(String(64), primary_key=True, comment='通道版本')
+    blob_type = Column(String(32), nullable=False, comment='序列化类型')
+    blob = Column(LargeBinary, comment='序列化后的通道值')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+    
+    __table_args__ = (
+        Index('ix_agent_checkpoint_blobs_created_at', created_at),
+    )
+
+
+class AgentCheckpointWrite(Base):
+    """会话检查点待写入表（节点执行中间结果）"""
+    __tablename__ = 'agent_checkpoint_writes'
+    
+    thread_id = Column(String(255), primary_key=True, comment='会话ID')
+    checkpoint_ns = Column(String(255), primary_key=True, default='', comment='检查点命名空间（子图）')
+    checkpoint_id = Column(String(64), primary_key=True, comment='检查点ID')
+    task_id = Column(String(64), primary_key=True, comment='任务ID')
+    idx = Column(Integer, primary_key=True, comment='写入序号')
+    channel = Column(String(255), nullable=False, comment='通道名称')
+    blob_type = Column(String(32), nullable=False, comment='序列化类型')
+    blob = Column(LargeBinary, comment='序列化后的写入值')
+    task_path = Column(String(500), nullable=False, default='', comment='任务路径')
+
+
+class SkillApiResponse(Base):
+    """API 调用响应缓存表（多个进程共享的缓存层，见 api_cache.py）"""
+    __tablename__ = 'skill_api_responses'
+
+    cache_key = Column(String(64), primary_key=True, comment='缓存键（API、规范化参数和认证范围的 SHA-256）')
+    api_name = Column(String(100), nullable=False, comment='API名称')
+    status_code = Column(Integer, nullable=False, comment='HTTP 状态码')
+    headers = Column(JSONType, comment='响应头（Content-Type 等）')
+    body = Column(LargeBinary, nullable=False, comment='响应内容')
+    expires_at = Column(Timestamp, nullable=False, comment='过期时间')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+
+    __table_args__ = (
+        Index('ix_skill_api_responses_expires_at', expires_at),
+    )
+
+
+class ModelResponseRecord(Base):
+    """模型响应缓存表（多个进程共享的缓存层，见 model_cache.py）"""
+    __tablename__ = 'model_responses'
+
+    cache_key = Column(String(64), primary_key=True, comment='缓存键（模型、温度、系统消息、消息列表和技能目录版本的 SHA-256）')
+    agent_name = Column(String(100), nullable=False, comment='角色名称')
+    model_name = Column(String(200), nullable=False, comment='模型名称')
+    catalog_version = Column(String(64), nullable=False, comment='生成响应时角色技能目录版本的摘要')
+    messages = Column(JSONType, nullable=False, comment='模型返回的消息（LangChain 消息字典）')
+    expires_at = Column(Timestamp, nullable=False, comment='过期时间')
+    created_at = Column(Timestamp, server_default=func.now(), comment='创建时间')
+
+    __table_args__ = (
+        Index('ix_model_responses_agent_name', agent_name, catalog_version),
+        Index('ix_model_responses_expires_at', expires_at),
+    )
+
+
+def build_db_url(driver: str = "postgresql") -> str:
+    """从环境变量构建数据库连接 URL
+    
+    设置了 DB_URL 时直接使用（例如 sqlite:///skills.db），否则由 DB_USER、DB_HOST 等构建 PostgreSQL URL。
+    
+    Args:
+        driver: URL 中的方言和驱动部分，例如 "postgresql" 或 "postgresql+asyncpg"（设置了 DB_URL 时忽略）
+        
+    Returns:
+        数据库连接 URL
+    """
+    db_url = os.getenv("DB_URL")
+    if db_url:
+        return db_url
+    db_user = os.getenv("DB_USER", "postgres")
+    db_password = os.getenv("DB_PASSWORD", "")
+    db_host = os.getenv("DB_HOST", "localhost")
+    db_port = os.getenv("DB_PORT", "5432")
+    db_name = os.getenv("DB_NAME", "skill")
+    return f"{driver}://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+
+
+# ========== skill.json 到数据库行的转换 ==========
+
+def skill_row_from_json(
+    skill_json: Dict,
+    content: str,
+    examples: Optional[Dict] = None,
+    metadata: Optional[Dict] = None,
+    content_file_path: Optional[str] = None,
+    gitee_repo_url: Optional[str] = None,
+    gitee_commit_hash: Optional[str] = None
+) -> Dict:
+    """将 skill.json 转换为 skills 表的列值（不含 agent_id）"""
+    row = {
+        "skill_id": skill_json.get("id"),
+        "name": skill_json.get("name"),
+        "short_description": skill_json.get("short_description"),
+        "description": skill_json.get("description"),
+        "version": skill_json.get("version", "1.0.0"),
+        "category": skill_json.get("category"),
+        "tags": skill_json.get("tags", []),
+        "author": skill_json.get("author"),
+        "content": content,
+        "content_file_path": content_file_path,
+        "examples": examples,
+        "metadata_json": metadata,
+        "status": skill_json.get("status", "active"),
+        "priority": skill_json.get("priority", 0),
+        "enabled": True,
+        "gitee_repo_url": gitee_repo_url,
+        "gitee_commit_hash": gitee_commit_hash
+    }
+    row["content_hash"] = skill_content_hash(row, skill_json)
+    return row
+
+
+# 不计入技能内容 hash 的列（同步状态，变化时不需要重写技能）
+_HASH_EXCLUDED_COLUMNS = ("enabled", "content_file_path", "gitee_repo_url", "gitee_commit_hash")
+
+
+def skill_content_hash(row: Dict, skill_json: Dict) -> str:
+    """计算技能定义的内容 hash
+    
+    覆盖技能行（不含同步状态列）、API 调用配置和依赖关系，任一变化时 hash 随之变化；
+    导入时 hash 未变化的技能不重写技能行及其子表。
+    
+    Args:
+        row: skill_row_from_json 生成的技能行
+        skill_json: skill.json 的内容
+        
+    Returns:
+        SHA-256 十六进制字符串
+    """
+    payload = {
+        "skill": {k: v for k, v in row.items() if k not in _HASH_EXCLUDED_COLUMNS and k != "content_hash"},
+        "api_calls": api_call_rows_from_json(skill_json),
+        "requirements": requirement_rows_from_json(skill_json),
+    }
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def api_call_rows_from_json(skill_json: Dict) -> List[Dict]:
+    """将 skill.json 中的 api_calls 转换为 skill_api_calls 表的列值（不含 skill_id）"""
+    return [
+        {
+            "api_name": api_call_data.get("name"),
+            "method": api_call_data.get("method", "GET"),
+            "url": api_call_data.get("url"),
+            "description": api_call_data.get("description"),
+            "required_params": api_call_data.get("required_params", []),
+            "optional_params": api_call_data.get("optional_params", []),
+            "auth_type": api_call_data.get("auth_type"),
+            "auth_config": api_call_data.get("auth_config"),
+            "request_headers": api_call_data.get("request_headers"),
+            "request_body_template": api_call_data.get("request_body_template"),
+            "response_format": api_call_data.get("response_format"),
+            "timeout_seconds": api_call_data.get("timeout_seconds", 30),
+            "retry_count": api_call_data.get("retry_count", 0),
+            "enabled": True
+        }
+        for api_call_data in skill_json.get("api_calls", [])
+    ]
+
+
+def requirement_rows_from_json(skill_json: Dict) -> List[Dict]:
+    """将 skill.json 中的 requirements 转换为 skill_requirements 表的列值（不含 skill_id）"""
+    requirements = skill_json.get("requirements", {})
+    rows = []
+    for dep in requirements.get("dependencies", []):
+        rows.append({
+            "requirement_type": "dependency",
+            "requirement_name": dep,
+            "is_required": True
+        })
+    for api_key in requirements.get("api_keys", []):
+        rows.append({
+            "requirement_type": "api_key",
+            "requirement_name": api_key,
+            "is_required": True
+        })
+    min_version = requirements.get("min_agent_version")
+    if min_version:
+        rows.append({
+            "requirement_type": "min_version",
+            "requirement_name": "agent_version",
+            "requirement_value": min_version,
+            "is_required": True
+        })
+    return rows
+
+
+class SkillImportResult(NamedTuple):
+    """批量导入中单个技能的结果"""
+    skill_id: Optional[str]
+    name: Optional[str]
+    status: str  # imported, updated, linked（已有技能分配给该角色）, skipped, failed
+    message: str = ""
+
+
+# ========== 预构建的查询语句 ==========
+# 语句在模块加载时构建一次，参数通过 bindparam 传入，
+# SQLAlchemy 会按语句结构缓存编译结果，每次调用只需一次数据库往返
+
+# 技能在角色下的有效优先级（角色未覆盖时使用技能的默认优先级）
+EFFECTIVE_PRIORITY = func.coalesce(AgentSkill.priority, Skill.priority)
+
+
+def _agent_skills_select(*entities):
+    """构建"角色的所有启用技能"查询（经 agent_skills 关联，按优先级、名称和 skill_id 排序，顺序稳定）"""
+    return (
+        select(*entities)
+        .select_from(AgentSkill)
+        .join(Agent, AgentSkill.agent_id == Agent.id)
+        .join(Skill, AgentSkill.skill_id == Skill.id)
+        .where(
+            Agent.name == bindparam("agent_name"),
+            Agent.enabled == True,
+            AgentSkill.enabled == True,
+            Skill.enabled == True
+        )
+        .order_by(EFFECTIVE_PRIORITY.desc(), Skill.name, Skill.skill_id)
+    )
+
+
+def _skill_by_key_select(*entities):
+    """构建"按 skill_id 或 name 查询角色的技能"查询（skill_id 精确匹配优先）"""
+    return (
+        _agent_skills_select(*entities)
+        .where(or_(Skill.skill_id == bindparam("skill_key"), Skill.name == bindparam("skill_key")))
+        .order_by(None)
+        .order_by((Skill.skill_id == bindparam("skill_key")).desc())
+        .limit(1)
+    )
+
+
+# 按 skill_id 或 name 查询角色技能的数据库ID（内容按数据库ID缓存，多个角色共用）
+SKILL_PK_BY_KEY_STMT = _skill_by_key_select(Skill.id)
+
+# 查询角色技能目录的版本（角色、关联和技能的最大 updated_at、启用技能数），
+# 技能新增、修改、禁用、分配或取消分配时都会变化，角色不存在时无结果
+CATALOG_VERSION_STMT = (
+    select(
+        Agent.updated_at,
+        func.max(AgentSkill.updated_at),
+        func.max(Skill.updated_at),
+        func.count(Skill.id).filter(AgentSkill.enabled == True, Skill.enabled == True),
+        func.count(AgentSkill.skill_id)
+    )
+    .select_from(Agent)
+    .outerjoin(AgentSkill, AgentSkill.agent_id == Agent.id)
+    .outerjoin(Skill, AgentSkill.skill_id == Skill.id)
+    .where(Agent.name == bindparam("agent_name"), Agent.enabled == True)
+    .group_by(Agent.id)
+)
+
+# 查询缓存水位线（agents/skills/agent_skills 表的最大 updated_at 和行数）
+WATERMARK_STMT = select(
+    select(func.max(Skill.updated_at)).scalar_subquery(),
+    select(func.count(Skill.id)).scalar_subquery(),
+    select(func.max(Agent.updated_at)).scalar_subquery(),
+    select(func.count(Agent.id)).scalar_subquery(),
+    select(func.max(AgentSkill.updated_at)).scalar_subquery(),
+    select(func.count()).select_from(AgentSkill).scalar_subquery()
+)
+
+
+# ========== 轻量只读记录 ==========
+# 目录构建和 load_skill 只需要少数几列，按需选择列并返回不可变的 namedtuple，
+# 避免加载 content/examples/metadata_json 等大字段，也避免脱离会话的 ORM 实例
+
+# SkillMiddleware 构建技能目录所需的列
+CATALOG_COLUMNS = ("skill_id", "name", "short_description", "description")
+
+# SkillMiddleware 排序模式构建检索索引所需的列
+RANKING_COLUMNS = CATALOG_COLUMNS + ("tags",)
+
+# load_skill 返回技能内容所需的列
+CONTENT_COLUMNS = ("id", "skill_id", "name", "version", "content", "updated_at")
+
+# get_skill / get_skills_by_agent 返回的列（skills 表的全部列，priority 为技能在角色下的有效优先级）
+SKILL_COLUMNS = tuple(column.name for column in Skill.__table__.columns)
+
+# get_all_skills 查询的列
+SUMMARY_COLUMNS = ("name", "skill_id", "short_description", "description", "content")
+
+# get_all_skills 缓存的只读记录（返回时转换为字典）
+SkillSummary = namedtuple("SkillSummary", ("name", "skill_id", "description", "content"))
+
+# get_agent 返回的只读记录（agents 表的全部列）
+AgentRecord = namedtuple("AgentRecord", tuple(column.name for column in Agent.__table__.columns))
+
+# 按名称查询启用的角色
+AGENT_BY_NAME_STMT = (
+    select(*Agent.__table__.columns)
+    .where(Agent.name == bindparam("agent_name"), Agent.enabled == True)
+    .limit(1)
+)
+
+
+@lru_cache(maxsize=None)
+def skill_record_type(columns: Tuple[str, ...]):
+    """返回包含指定列的只读记录类型（namedtuple）
+    
+    Args:
+        columns: skills 表的列名元组
+        
+    Returns:
+        namedtuple 类型
+    """
+    unknown = [c for c in columns if c not in Skill.__table__.columns]
+    if unknown:
+        raise ValueError(f"skills 表中不存在列: {', '.join(unknown)}")
+    return namedtuple("SkillRecord", columns)
+
+
+def _skill_column(column: str):
+    """skills 表的列（priority 为技能在角色下的有效优先级）"""
+    if column == "priority":
+        return EFFECTIVE_PRIORITY.label("priority")
+    return Skill.__table__.c[column]
+
+
+@lru_cache(maxsize=None)
+def skill_catalog_stmt(columns: Tuple[str, ...]):
+    """返回"角色的启用技能（指定列）"查询语句，按列组合缓存"""
+    skill_record_type(columns)
+    return _agent_skills_select(*(_skill_column(c) for c in columns))
+
+
+@lru_cache(maxsize=None)
+def skill_columns_by_key_stmt(columns: Tuple[str, ...]):
+    """返回"按 skill_id 或 name 查询技能（指定列）"查询语句，按列组合缓存"""
+    skill_record_type(columns)
+    return _skill_by_key_select(*(_skill_column(c) for c in columns))
+
+
+@lru_cache(maxsize=None)
+def skill_columns_by_pk_stmt(columns: Tuple[str, ...]):
+    """返回"按数据库ID查询技能（指定列）"查询语句，按列组合缓存"""
+    skill_record_type(columns)
+    return select(*(Skill.__table__.c[c] for c in columns)).where(Skill.id == bindparam("skill_pk"))
+
+
+# 查询所有启用技能的 get_all_skills 所需列
+ENABLED_SKILLS_STMT = select(*(Skill.__table__.c[c] for c in SUMMARY_COLUMNS)).where(Skill.enabled == True)
+
+
+def skill_summaries(skills) -> Tuple:
+    """把技能记录转换为 get_all_skills 缓存的只读记录（没有简短描述时使用详细描述）"""
+    return tuple(
+        SkillSummary(skill.name, skill.skill_id, skill.short_description or skill.description, skill.content)
+        for skill in skills
+    )
+
+
+# ========== API 调用配置 ==========
+# skill_api.py 为角色的每个启用的 API 调用配置创建一个工具
+
+API_CALL_COLUMNS = (
+    "api_name", "method", "url", "description", "required_params", "optional_params",
+    "auth_type", "auth_config", "request_headers", "request_body_template", "response_format",
+    "timeout_seconds", "retry_count"
+)
+
+# API 调用配置记录（附带所属技能的 skill_id 和名称）
+ApiCallRecord = namedtuple("ApiCallRecord", ("skill_id", "skill_name") + API_CALL_COLUMNS)
+
+AGENT_API_CALLS_STMT = (
+    _agent_skills_select(
+        Skill.skill_id, Skill.name,
+        *(SkillApiCall.__table__.c[c] for c in API_CALL_COLUMNS)
+    )
+    .join(SkillApiCall, SkillApiCall.skill_id == Skill.id)
+    .where(SkillApiCall.enabled == True)
+    .order_by(SkillApiCall.id)
+)
+
+
+# ========== 技能章节 ==========
+# load_skill 先读取技能概要（不含内容）和章节目录，再按需截取单个章节的文本
+
+SectionRecord = namedtuple(
+    "SectionRecord",
+    ["position", "level", "title", "anchor", "start_offset", "end_offset", "token_count"]
+)
+
+# 技能概要：技能信息、内容长度（字符数）和章节目录
+SkillOutline = namedtuple(
+    "SkillOutline",
+    ["id", "skill_id", "name", "version", "updated_at", "content_length", "sections"]
+)
+
+OUTLINE_STMT = select(
+    Skill.id, Skill.skill_id, Skill.name, Skill.version, Skill.updated_at,
+    func.length(Skill.content)
+).where(Skill.id == bindparam("skill_pk"))
+
+SECTIONS_STMT = (
+    select(*(SkillSection.__table__.c[f] for f in SectionRecord._fields))
+    .where(SkillSection.skill_id == bindparam("skill_pk"))
+    .order_by(SkillSection.position)
+)
+
+# 在数据库中截取章节文本（substr 的起始位置从 1 开始，按字符计）
+SECTION_TEXT_STMT = select(
+    func.substr(
+        Skill.content,
+        bindparam("start_offset", type_=Integer) + 1,
+        bindparam("length", type_=Integer)
+    )
+).where(Skill.id == bindparam("skill_pk"))
+
+
+def rebuild_sections(connection, skill_pks: List[int]) -> None:
+    """重新生成指定技能的章节（在调用方的事务中执行）
+    
+    Args:
+        connection: 数据库连接或 Session
+        skill_pks: 技能的数据库ID列表
+    """
+    contents = connection.execute(
+        select(Skill.id, Skill.content).where(Skill.id.in_(skill_pks))
+    ).all()
+    connection.execute(delete(SkillSection).where(SkillSection.skill_id.in_(skill_pks)))
+    section_rows = [
+        {"skill_id": pk, **row}
+        for pk, content in contents
+        for row in parse_sections(content or "")
+    ]
+    if section_rows:
+        connection.execute(insert(SkillSection.__table__), section_rows)
+
+
+# ========== 技能依赖 ==========
+# 依赖按 skill_id 引用其他技能；导入技能时在同一事务中重建依赖闭包，出现循环依赖时导入失败
+
+DEPENDENCY_EDGES_STMT = (
+    select(Skill.skill_id, SkillRequirement.requirement_name)
+    .join(SkillRequirement, SkillRequirement.skill_id == Skill.id)
+    .where(SkillRequirement.requirement_type == "dependency", SkillRequirement.is_required == True)
+)
+
+# 重建依赖闭包时持有的事务级咨询锁，多个进程同时导入时依次重建
+DEPENDENCY_LOCK_ID = 0x736B696C6C646570
+
+# 技能及其全部依赖的内容（依赖在前，按深度从深到浅），依赖只包含启用的技能
+DependencyRecord = namedtuple("DependencyRecord", CONTENT_COLUMNS + ("depth",))
+
+DEPENDENCY_CONTENT_STMT = (
+    select(*(Skill.__table__.c[c] for c in CONTENT_COLUMNS), SkillDependency.depth)
+    .join(SkillDependency, SkillDependency.dependency_id == Skill.id)
+    .where(
+        SkillDependency.skill_id == bindparam("skill_pk"),
+        or_(SkillDependency.depth == 0, Skill.enabled == True)
+    )
+    .order_by(SkillDependency.depth.desc(), Skill.name)
+)
+
+
+def load_dependency_graph(connection) -> Tuple[Dict[str, List[str]], Dict[str, int], Set[str]]:
+    """读取所有技能的依赖图
+    
+    Args:
+        connection: 数据库连接或 Session
+        
+    Returns:
+        (依赖图, skill_id 到数据库ID 的映射, 启用的 skill_id 集合) 元组
+    """
+    skills = connection.execute(select(Skill.skill_id, Skill.id, Skill.enabled)).all()
+    pks = {skill_id: pk for skill_id, pk, _ in skills}
+    graph = build_graph(connection.execute(DEPENDENCY_EDGES_STMT).all(), pks)
+    return graph, pks, {skill_id for skill_id, _, enabled in skills if enabled}
+
+
+def _dependency_graph_affected(connection, skill_pks: Sequence[int]) -> bool:
+    """新写入的技能是否可能改变其他技能的依赖闭包
+    
+    技能有依赖、之前有依赖（闭包中有深度大于 0 的行）或被其他技能依赖时才需要重建整个闭包。
+    """
+    requirements = SkillRequirement.__table__
+    closure = SkillDependency.__table__
+    checks = (
+        select(requirements.c.id).where(
+            requirements.c.skill_id.in_(skill_pks), requirements.c.requirement_type == "dependency"
+        ),
+        select(closure.c.skill_id).where(closure.c.skill_id.in_(skill_pks), closure.c.depth > 0),
+        select(requirements.c.id)
+        .join(Skill, Skill.skill_id == requirements.c.requirement_name)
+        .where(Skill.id.in_(skill_pks), requirements.c.requirement_type == "dependency"),
+    )
+    return any(connection.execute(check.limit(1)).first() is not None for check in checks)
+
+
+def rebuild_dependency_closure(
+    connection,
+    strict: bool = True,
+    skill_pks: Optional[Sequence[int]] = None
+) -> Dict[str, List[str]]:
+    """重建技能依赖闭包（在调用方的事务中执行，只写入变化的行）
+    
+    Args:
+        connection: 数据库连接或 Session
+        strict: 存在循环依赖时是否抛出 DependencyError（升级旧数据库时为 False，环上的技能互为依赖）
+        skill_pks: 本次写入的技能（可选）。这些技能既没有依赖、也不被其他技能依赖时，
+            只写入它们自身的闭包行，不读取整个依赖图
+        
+    Returns:
+        技能ID 到其缺失依赖（不存在或已禁用的技能）的映射（只写入自身闭包行时为空）
+    """
+    # SQLite 同一时间只有一个写事务，不需要加锁
+    if dialect_name(connection) == "postgresql":
+        connection.execute(select(func.pg_advisory_xact_lock(DEPENDENCY_LOCK_ID)))
+    if skill_pks is not None and not _dependency_graph_affected(connection, skill_pks):
+        if skill_pks:
+            connection.execute(
+                pg_insert(SkillDependency.__table__).on_conflict_do_nothing(),
+                [{"skill_id": pk, "dependency_id": pk, "depth": 0} for pk in skill_pks]
+            )
+        return {}
+    graph, pks, enabled = load_dependency_graph(connection)
+    closure = resolve(graph) if strict else transitive_closure(graph)
+    
+    table = SkillDependency.__table__
+    current = {
+        (s, d): depth
+        for s, d, depth in connection.execute(select(table.c.skill_id, table.c.dependency_id, table.c.depth))
+    }
+    target = {
+        (pks[skill_id], pks[dependency]): depth
+        for skill_id, depths in closure.items()
+        for dependency, depth in depths.items()
+    }
+    stale = [key for key, depth in current.items() if target.get(key) != depth]
+    if stale:
+        connection.execute(delete(table).where(tuple_(table.c.skill_id, table.c.dependency_id).in_(stale)))
+    added = [
+        {"skill_id": s, "dependency_id": d, "depth": depth}
+        for (s, d), depth in target.items() if current.get((s, d)) != depth
+    ]
+    if added:
+        connection.execute(insert(table), added)
+    return missing_dependencies(graph, enabled)
+
+
+def _agent_skill_pks(agent_name: str):
+    """分配给角色的所有技能的数据库ID（子查询，含已禁用的关联）"""
+    return (
+        select(AgentSkill.skill_id)
+        .join(Agent, AgentSkill.agent_id == Agent.id)
+        .where(Agent.name == agent_name)
+    )
+
+
+# 按名称查询启用角色的数据库ID
+AGENT_ID_STMT = select(Agent.id).where(Agent.name == bindparam("agent_name"), Agent.enabled == True)
+
+
+def agent_id_in_session(session, agent_name: str) -> int:
+    """在调用方的 Session 中查询启用角色的数据库ID
+    
+    写入前的角色查询使用写入的 Session（主库），不经过 get_read_session：
+    复制延迟中的副本可能还看不到刚创建的角色。
+    
+    Args:
+        session: 数据库会话
+        agent_name: 角色名称
+        
+    Returns:
+        角色的数据库ID
+        
+    Raises:
+        ValueError: 角色不存在或未启用
+    """
+    agent_id = session.execute(AGENT_ID_STMT, {"agent_name": agent_name}).scalar()
+    if agent_id is None:
+        raise ValueError(f"角色 '{agent_name}' 不存在")
+    return agent_id
+
+
+def add_skill_in_session(session, agent_name: str, skill_json: Dict, content: str, **kwargs) -> Skill:
+    """在调用方的 Session 中添加技能并分配给角色（不提交事务）
+    
+    技能（按 skill_id）已存在且内容相同时只建立角色与技能的关联，不再保存一份技能。
+    
+    Args:
+        session: 数据库会话（同步 Session，异步调用方通过 AsyncSession.run_sync 使用）
+        agent_name: 角色名称
+        skill_json: skill.json 的内容
+        content: content.md 的内容
+        **kwargs: skill_row_from_json 的其余参数（examples, metadata, content_file_path 等）
+        
+    Returns:
+        技能对象
+    """
+    agent = session.query(Agent).filter(
+        Agent.name == agent_name,
+        Agent.enabled == True
+    ).first()
+    
+    if not agent:
+        raise ValueError(f"角色 '{agent_name}' 不存在")
+    
+    row = skill_row_from_json(skill_json, content, **kwargs)
+    skill = session.query(Skill).filter(Skill.skill_id == row["skill_id"]).first()
+    if skill is None:
+        # 创建技能
+        skill = Skill(agent_id=agent.id, **row)
+        session.add(skill)
+        session.flush()  # 获取 skill.id
+        
+        # 添加 API 调用配置
+        for api_call_row in api_call_rows_from_json(skill_json):
+            session.add(SkillApiCall(skill_id=skill.id, **api_call_row))
+        
+        # 添加依赖关系
+        for requirement_row in requirement_rows_from_json(skill_json):
+            session.add(SkillRequirement(skill_id=skill.id, **requirement_row))
+        
+        # 添加内容章节
+        for section_row in parse_sections(content):
+            session.add(SkillSection(skill_id=skill.id, **section_row))
+        
+        # 更新依赖闭包（形成循环依赖时抛出 DependencyError，事务回滚）
+        session.flush()
+        rebuild_dependency_closure(session, skill_pks=[skill.id])
+    elif skill.content_hash and skill.content_hash != row["content_hash"]:
+        raise ValueError(
+            f"技能 '{row['skill_id']}' 已存在且内容不同，请使用 bulk_import_skills(update_existing=True) 更新"
+        )
+    
+    # 分配给角色
+    if session.get(AgentSkill, (agent.id, skill.id)) is None:
+        session.add(AgentSkill(agent_id=agent.id, skill_id=skill.id))
+    return skill
+
+
+# ========== 同步日志 ==========
+
+SYNC_LOG_OPTIONAL_COLUMNS = ("sync_message", "gitee_commit_hash", "files_updated", "sync_duration_ms")
+
+
+def sync_log_row(entry: Dict) -> Dict:
+    """将同步日志字典转换为 skill_sync_log 行
+    
+    Args:
+        entry: 同步日志字典，键同 DatabaseManager.add_sync_log 的参数（skill_id、sync_type、sync_status 必需）
+        
+    Returns:
+        skill_sync_log 行（缺少的可选字段为 None）
+    """
+    return {
+        "skill_id": entry["skill_id"],
+        "sync_type": entry["sync_type"],
+        "sync_status": entry["sync_status"],
+        **{column: entry.get(column) for column in SYNC_LOG_OPTIONAL_COLUMNS}
+    }
+
+
+def percentile_cont(values: Sequence[float], fraction: float) -> Optional[float]:
+    """计算有序序列的分位数（线性插值，与 PostgreSQL 的 percentile_cont 相同）
+    
+    Args:
+        values: 升序排列的数值
+        fraction: 分位（0-1）
+        
+    Returns:
+        分位数，序列为空时返回 None
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return float(values[lower] + (values[upper] - values[lower]) * (position - lower))
+
+
+# 旧版本创建、已被替代的索引（upgrade_schema 删除）
+_OBSOLETE_INDEXES = ("ix_skills_agent_enabled", "ix_skills_agent_name", "ix_skills_enabled_agent_priority")
+
+
+def upgrade_schema(connection, existing_tables: Set[str]) -> None:
+    """在 create_all 之后补齐旧版本数据库的结构和数据（在调用方的事务中执行）
+    
+    Args:
+        connection: 数据库连接
+        existing_tables: 执行 create_all 之前已存在的表名
+    """
+    # create_all 不会修改已存在的表：补加新增的列（新增列均可为空），再补建新增的索引
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in present:
+                connection.execute(text(
+                    f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} "
+                    f"{column.type.compile(dialect=connection.dialect)}"
+                ))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    # 技能改为经 agent_skills 分配给角色后，skills 表上按 agent_id 的索引不再被查询使用，只增加写入开销
+    for name in _OBSOLETE_INDEXES:
+        connection.execute(text(f"DROP INDEX IF EXISTS {preparer.quote(name)}"))
+    
+    if Skill.__tablename__ not in existing_tables:
+        return
+    # 新建关联表时，把已有技能分配给导入它的角色
+    if AgentSkill.__tablename__ not in existing_tables:
+        connection.execute(
+            insert(AgentSkill.__table__).from_select(
+                ["agent_id", "skill_id"], select(Skill.agent_id, Skill.id)
+            )
+        )
+    # 新建章节表时为已有技能生成章节
+    if SkillSection.__tablename__ not in existing_tables:
+        skill_pks = connection.execute(select(Skill.id)).scalars().all()
+        if skill_pks:
+            rebuild_sections(connection, skill_pks)
+    # 新建依赖闭包表时为已有技能计算闭包（已有数据中的循环依赖不阻止升级）
+    if SkillDependency.__tablename__ not in existing_tables:
+        rebuild_dependency_closure(connection, strict=False)
 
 
 class DatabaseManager:
     """数据库管理器"""
     
-    def __init__(self, db_url: Optional[str] = None):
-        """初始化数据库连接
+    def __init__(
+        self,
+        db_url: Optional[str] = None,
+        cache_size: Optional[int] = None,
+        cache_poll_interval: Optional[float] = None,
+        replica_urls: Optional[Sequence[str]] = None,
+        max_replica_lag: Optional[float] = None,
+        sync_log_retention_days: Optional[float] = None,
+        replica_lag_probe: Optional[LagProbe] = None
+    ):
+        """初始化数据库连接
+        
+        Args:
+            db_url: 主库连接 URL，如果不提供则从环境变量构建
+            cache_size: 技能缓存最大条目数，如果不提供则从环境变量 SKILL_CACHE_SIZE 读取，0 表示禁用
+            cache_poll_interval: 检查其他进程写入的间隔（秒），如果不提供则从环境变量
+                SKILL_CACHE_POLL_SECONDS 读取，小于 0 表示不检查
+            replica_urls: 只读副本连接 URL 列表，如果不提供则从环境变量 DB_REPLICA_URLS 读取（逗号分隔），
+                默认不使用副本
+            max_replica_lag: 副本允许的最大复制延迟（秒），如果不提供则从环境变量
+                DB_REPLICA_MAX_LAG_SECONDS 读取，默认为 5
+            sync_log_retention_days: 同步日志保留天数，如果不提供则从环境变量 SYNC_LOG_RETENTION_DAYS 读取，
+                默认为 0（不清理），由 prune_sync_logs() 或 `python sync_log.py prune` 定期清理
+            replica_lag_probe: 查询副本复制延迟的函数（接收副本连接，返回秒数），默认 PostgreSQL 查询
+                WAL 回放进度，其他数据库只检查连通性
+        """
+        # 如果未提供 URL，则从环境变量读取数据库配置构建
+        self.db_url = db_url or build_db_url()
+        
+        # 获取共享的数据库引擎（同一进程内相同 URL 共用一个连接池）
+        self.engine = get_engine(self.db_url)
+        self.Session = sessionmaker(bind=self.engine)
+        
+        # 技能目录缓存
+        if cache_size is None:
+            cache_size = int(os.getenv("SKILL_CACHE_SIZE", "1024"))
+        if cache_poll_interval is None:
+            cache_poll_interval = float(os.getenv("SKILL_CACHE_POLL_SECONDS", "5"))
+        self.cache = SkillCache(cache_size, cache_poll_interval)
+        self._watermark_lock = threading.Lock()
+        track_cache("skill", self.cache)
+        
+        # 只读副本：只读查询在副本之间轮询，写入和刚写入后的读取走主库
+        if replica_urls is None:
+            replica_urls = replica_urls_from_env()
+        if max_replica_lag is None:
+            max_replica_lag = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+        self.replicas = ReplicaSet(
+            replica_urls,
+            max_replica_lag,
+            float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5")),
+            replica_lag_probe
+        ) if replica_urls else None
+        self._routed_version = self.cache.version
+        self._primary_until = 0.0
+        
+        # 同步日志保留时间：写入日志时不清理，由 prune_sync_logs() 清理
+        if sync_log_retention_days is None:
+            sync_log_retention_days = float(os.getenv("SYNC_LOG_RETENTION_DAYS", "0"))
+        self.sync_log_retention_days = sync_log_retention_days
+    
+    def create_tables(self):
+        """创建数据库表（如果不存在），并升级旧版本数据库的表结构"""
+        with self.engine.begin() as connection:
+            existing_tables = set(inspect(connection).get_table_names())
+            Base.metadata.create_all(connection)
+            upgrade_schema(connection, existing_tables)
+    
+    def rebuild_skill_sections(self, batch_size: int = 500) -> int:
+        """重新生成所有技能的章节（例如修改了章节切分规则，或直接用 SQL 修改了技能内容之后）
+        
+        Args:
+            batch_size: 每个事务处理的技能数
+            
+        Returns:
+            处理的技能数
+        """
+        session = self.get_session()
+        try:
+            skill_pks = session.execute(select(Skill.id).order_by(Skill.id)).scalars().all()
+            for start in range(0, len(skill_pks), batch_size):
+                rebuild_sections(session, skill_pks[start:start + batch_size])
+                session.commit()
+            return len(skill_pks)
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+    
+    def rebuild_skill_dependencies(self) -> Dict[str, List[str]]:
+        """重建技能依赖闭包（直接用 SQL 修改了 skill_requirements 表之后使用）
+        
+        Returns:
+            技能ID 到其缺失依赖的映射
+            
+        Raises:
+            DependencyError: 技能之间存在循环依赖
+        """
+        session = self.get_session()
+        try:
+            missing = rebuild_dependency_closure(session)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        self.invalidate_cache()
+        return missing
+    
+    def check_skill_dependencies(self, agent_name: Optional[str] = None) -> Dict[str, List[str]]:
+        """检查技能的依赖是否都存在且已启用
+        
+        Args:
+            agent_name: 如果指定，则只检查分配给该角色的技能
+            
+        Returns:
+            技能ID 到其缺失依赖（不存在或已禁用的技能）的映射，只包含有缺失依赖的技能
+        """
+        session = self.get_read_session()
+        try:
+            graph, _, enabled = load_dependency_graph(session)
+            if agent_name:
+                assigned = set(session.execute(
+                    select(Skill.skill_id).where(Skill.id.in_(_agent_skill_pks(agent_name)))
+                ).scalars())
+                graph = {skill_id: deps for skill_id, deps in graph.items() if skill_id in assigned}
+            return missing_dependencies(graph, enabled)
+        finally:
+            session.close()
+    
+    def get_session(self):
+        """获取数据库会话"""
+        return self.Session()
+    
+    def get_read_session(self):
+        """获取只读查询的数据库会话
+        
+        配置了副本时轮询选择一个健康且延迟不超过上限的副本；以下情况使用主库：
+        没有可用副本、在 read_your_writes() 上下文中、本进程写入（或发现其他进程写入）后
+        的 max_replica_lag 秒内。
+        """
+        if self.replicas is None or reading_from_primary() or self._recently_written():
+            return self.get_session()
+        replica = self.replicas.choose()
+        if replica is None:
+            return self.get_session()
+        session = replica.Session()
+        try:
+            # 提前借出连接，副本不可用时改用主库
+            session.connection()
+        except exc.DBAPIError as e:
+            session.close()
+            replica.mark_unhealthy(str(e.orig or e))
+            return self.get_session()
+        return session
+    
+    def _recently_written(self) -> bool:
+        """缓存版本号变化（发生写入）后的 max_replica_lag 秒内返回 True"""
+        version = self.cache.version
+        if version != self._routed_version:
+            self._routed_version = version
+            self._primary_until = time.monotonic() + self.replicas.max_lag
+        return time.monotonic() < self._primary_until
+    
+    def read_your_writes(self):
+        """返回让只读查询走主库的上下文管理器，见 db_replicas.read_your_writes()"""
+        return read_your_writes()
+    
+    def get_replica_status(self) -> Optional[Dict]:
+        """获取副本的健康状态和复制延迟，未配置副本时返回 None"""
+        return self.replicas.status() if self.replicas is not None else None
+    
+    def get_pool_stats(self) -> Dict:
+        """获取连接池状态和借出/等待统计"""
+        return pool_status(self.engine)
+    
+    # ========== 缓存相关方法 ==========
+    
+    def invalidate_cache(self):
+        """使本进程的技能缓存失效（写入数据后调用）"""
+        self.cache.invalidate()
+    
+    def _read_watermark(self):
+        """读取 agents/skills 表的水位线（最大 updated_at 和行数）"""
+        session = self.get_session()
+        try:
+            return session.execute(WATERMARK_STMT).one()
+        finally:
+            session.close()
+    
+    def _check_watermark(self):
+        """按间隔轮询水位线，发现其他进程写入时使缓存失效"""
+        if not self.cache.watermark_due():
+            return
+        # 只让一个线程去查询水位线，其他线程继续使用当前缓存
+        if not self._watermark_lock.acquire(blocking=False):
+            return
+        try:
+            if self.cache.watermark_due():
+                self.cache.update_watermark(tuple(self._read_watermark()))
+        finally:
+            self._watermark_lock.release()
+    
+    def _cached(self, key, loader):
+        """从缓存读取，未命中时调用 loader 查询数据库并写回缓存
+        
+        Args:
+            key: 缓存键
+            loader: 无参查询函数
+        
+        Returns:
+            缓存或查询得到的结果
+        """
+        self._check_watermark()
+        value = self.cache.get(key)
+        if value is not MISSING:
+            return value
+        version = self.cache.version
+        value = loader()
+        self.cache.set(key, value, version)
+        return value
+    
+    # ========== Agent 相关方法 ==========
+    
+    def add_agent(self, name: str, description: str = "", system_prompt: str = "") -> Agent:
+        """添加新角色
+        
+        Args:
+            name: 角色名称
+            description: 角色描述
+            system_prompt: 系统提示词
+            
+        Returns:
+            创建的 Agent 对象
+        """
+        session = self.get_session()
+        try:
+            agent = Agent(
+                name=name,
+                description=description,
+                system_prompt=system_prompt,
+                enabled=True
+            )
+            session.add(agent)
+            session.commit()
+            session.refresh(agent)
+            self.invalidate_cache()
+            return agent
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+    
+    def get_agent(self, agent_name: str) -> Optional[AgentRecord]:
+        """获取角色
+        
+        Args:
+            agent_name: 角色名称
+            
+        Returns:
+            角色的只读记录（AgentRecord，所有调用方共享同一缓存），如果不存在则返回 None
+        """
+        return self._cached(("agent", agent_name), lambda: self._query_agent(agent_name))
+    
+    def _query_agent(self, agent_name: str) -> Optional[AgentRecord]:
+        """从数据库查询角色"""
+        session = self.get_read_session()
+        try:
+            row = session.execute(AGENT_BY_NAME_STMT, {"agent_name": agent_name}).first()
+            return AgentRecord._make(row) if row else None
+        finally:
+            session.close()
+    
+    def get_all_agents(self) -> List[Agent]:
+        """获取所有启用的角色"""
+        session = self.get_read_session()
+        try:
+            return session.query(Agent).filter(Agent.enabled == True).all()
+        finally:
+            session.close()
+    
+    # ========== Skill 相关方法 ==========
+    
+    def add_skill_from_json(
+        self,
+        agent_name: str,
+        skill_json: Dict,
+        content: str,
+        examples: Optional[Dict] = None,
+        metadata: Optional[Dict] = None,
+        content_file_path: Optional[str] = None,
+        gitee_repo_url: Optional[str] = None,
+        gitee_commit_hash: Optional[str] = None
+    ) -> Skill:
+        """从 JSON 定义添加技能到指定角色
+        
+        技能（按 skill_id）已存在且内容相同时只把它分配给该角色；内容不同时抛出 ValueError。
+        
+        Args:
+            agent_name: 角色名称
+            skill_json: skill.json 的内容
+            content: content.md 的内容
+            examples: examples.json 的内容（可选）
+            metadata: metadata.json 的内容（可选）
+            content_file_path: Gitee repo 中的文件路径（可选）
+            gitee_repo_url: Gitee repo URL（可选）
+            gitee_commit_hash: Gitee commit hash（可选）
+            
+        Returns:
+            创建的 Skill 对象
+        """
+        session = self.get_session()
+        try:
+            skill = add_skill_in_session(
+                session, agent_name, skill_json, content,
+                examples=examples, metadata=metadata, content_file_path=content_file_path,
+                gitee_repo_url=gitee_repo_url, gitee_commit_hash=gitee_commit_hash
+            )
+            session.commit()
+            session.refresh(skill)
+            self.invalidate_cache()
+            return skill
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+    
+    def add_skill(self, agent_name: str, name: str, description: str, content: str) -> Skill:
+        """添加技能到指定角色（便捷方法，推荐使用 add_skill_from_json）
+        
+        注意：此方法仅用于快速测试，生产环境请使用 add_skill_from_json 方法
+        从 skill-example 目录加载技能文件。
+        
+        Args:
+            agent_name: 角色名称
+            name: 技能名称
+            description: 技能描述
+            content: 技能详细内容
+            
+        Returns:
+            创建的 Skill 对象
+        """
+        # 使用简化的 JSON 格式（自动生成 skill_id 和版本）
+        skill_json = {
+            "id": name.lower().replace(" ", "_"),
+            "name": name,
+            "description": description,
+            "short_description": description[:100] if len(description) > 100 else description,
+            "version": "1.0.0",
+            "status": "active",
+            "priority": 0
+        }
+        return self.add_skill_from_json(agent_name, skill_json, content)
+    
+    def bulk_import_skills(
+        self,
+        agent_name: str,
+        skills: Iterable[Dict],
+        batch_size: int = 500,
+        update_existing: bool = False
+    ) -> List[SkillImportResult]:
+        """批量导入技能（幂等）
+        
+        每批技能在一个事务中完成：技能行通过 INSERT ... ON CONFLICT (skill_id) 一次性写入，
+        API 调用配置和依赖关系按批整体替换，再把技能分配给该角色。技能在所有角色之间只保存一份，
+        已存在的技能只建立关联；更新时内容 hash 未变化的技能不会重写。
+        某一批失败时，该批会逐个技能重试，以便定位失败的技能而不影响同批的其他技能。
+        
+        Args:
+            agent_name: 角色名称
+            skills: 技能数据，每项为 add_skill_from_json 的参数字典
+                （skill_json, content, examples, metadata, content_file_path,
+                gitee_repo_url, gitee_commit_hash），可以是生成器
+            batch_size: 每个事务导入的技能数
+            update_existing: 已存在的技能（按 skill_id）内容变化时是否更新，默认不更新
+            
+        Returns:
+            每个技能的导入结果，顺序与输入一致
+        """
+        # 角色不存在时在读取技能数据之前失败；每批写入时在同一事务中再次查询角色
+        session = self.get_session()
+        try:
+            agent_id_in_session(session, agent_name)
+        finally:
+            session.close()
+        
+        results = []
+        batch = []
+        for item in skills:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                results.extend(self._import_batch(agent_name, batch, update_existing))
+                batch = []
+        if batch:
+            results.extend(self._import_batch(agent_name, batch, update_existing))
+        
+        if any(r.status in ("imported", "updated", "linked") for r in results):
+            self.invalidate_cache()
+            # 缺失的依赖可能在之后的批次中导入，全部导入完成后再检查
+            missing = self.check_skill_dependencies()
+            results = [
+                r._replace(message=f"缺少依赖: {', '.join(missing[r.skill_id])}")
+                if r.status in ("imported", "updated") and r.skill_id in missing else r
+                for r in results
+            ]
+        return results
+    
+    def _import_batch(self, agent_name: str, batch: List[Dict], update_existing: bool) -> List[SkillImportResult]:
+        """在一个事务中导入一批技能，失败时逐个重试"""
+        try:
+            return self._write_skill_batch(agent_name, batch, update_existing)
+        except Exception as e:
+            if len(batch) == 1:
+                skill_json = batch[0].get("skill_json") or {}
+                # 数据库错误只保留驱动返回的原始信息，不包含 SQL 和参数
+                message = str(getattr(e, "orig", None) or e).strip()
+                return [SkillImportResult(skill_json.get("id"), skill_json.get("name"), "failed", message)]
+        results = []
+        for item in batch:
+            results.extend(self._import_batch(agent_name, [item], update_existing))
+        return results
+    
+    def _write_skill_batch(self, agent_name: str, batch: List[Dict], update_existing: bool) -> List[SkillImportResult]:
+        """写入一批技能及其 API 调用配置、依赖关系和角色关联（单个事务）"""
+        results: List[Optional[SkillImportResult]] = [None] * len(batch)
+        rows = {}  # skill_id -> (批内序号, 技能行)
+        for i, item in enumerate(batch):
+            skill_json = item.get("skill_json") or {}
+            skill_id = skill_json.get("id")
+            if not skill_id:
+                results[i] = SkillImportResult(None, skill_json.get("name"), "failed", "skill.json 缺少 id")
+                continue
+            if skill_id in rows:
+                # 同一批中重复的 skill_id 以最后一次出现为准
+                prev = rows[skill_id][0]
+                results[prev] = SkillImportResult(skill_id, batch[prev]["skill_json"].get("name"), "skipped", "批内重复")
+            rows[skill_id] = (i, skill_row_from_json(**item))
+        
+        if rows:
+            session = self.get_session()
+            try:
+                agent_id = agent_id_in_session(session, agent_name)
+                for _, row in rows.values():
+                    row["agent_id"] = agent_id
+                existing = dict(session.execute(
+                    select(Skill.skill_id, Skill.id).where(Skill.skill_id.in_(list(rows)))
+                ).all())
+                
+                table = Skill.__table__
+                stmt = pg_insert(table)
+                if update_existing:
+                    # 只重写内容 hash 变化（或已被禁用）的技能，未变化的技能不产生写入
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[table.c.skill_id],
+                        set_={
+                            **{
+                                c: stmt.excluded[c] for c in next(iter(rows.values()))[1]
+                                if c not in ("skill_id", "agent_id")
+                            },
+                            "updated_at": func.now()
+                        },
+                        where=or_(
+                            table.c.content_hash.is_distinct_from(stmt.excluded.content_hash),
+                            table.c.enabled == False
+                        )
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.skill_id])
+                written = dict(session.execute(
+                    stmt.returning(table.c.skill_id, table.c.id),
+                    [row for _, row in rows.values()]
+                ).all())
+                
+                # 未写入的技能（已存在且未变化，或在查询之后由其他进程写入）补查数据库ID
+                pks = {**existing, **written}
+                missing = [sid for sid in rows if sid not in pks]
+                if missing:
+                    pks.update(session.execute(
+                        select(Skill.skill_id, Skill.id).where(Skill.skill_id.in_(missing))
+                    ).all())
+                
+                # 整体替换被写入技能的 API 调用配置、依赖关系和内容章节
+                updated_ids = [written[sid] for sid in written if sid in existing]
+                if updated_ids:
+                    session.execute(delete(SkillApiCall).where(SkillApiCall.skill_id.in_(updated_ids)))
+                    session.execute(delete(SkillRequirement).where(SkillRequirement.skill_id.in_(updated_ids)))
+                    session.execute(delete(SkillSection).where(SkillSection.skill_id.in_(updated_ids)))
+                
+                api_call_rows = []
+                requirement_rows = []
+                section_rows = []
+                for skill_id, pk in written.items():
+                    item = batch[rows[skill_id][0]]
+                    skill_json = item["skill_json"]
+                    api_call_rows.extend({"skill_id": pk, **row} for row in api_call_rows_from_json(skill_json))
+                    requirement_rows.extend({"skill_id": pk, **row} for row in requirement_rows_from_json(skill_json))
+                    section_rows.extend({"skill_id": pk, **row} for row in parse_sections(item["content"]))
+                if api_call_rows:
+                    session.execute(insert(SkillApiCall.__table__), api_call_rows)
+                if requirement_rows:
+                    session.execute(insert(SkillRequirement.__table__), requirement_rows)
+                if section_rows:
+                    session.execute(insert(SkillSection.__table__), section_rows)
+                
+                # 依赖关系变化后重建依赖闭包（形成循环依赖时整批失败，再逐个重试定位）
+                if written:
+                    rebuild_dependency_closure(session, skill_pks=list(written.values()))
+                
+                # 分配给角色（已分配的保持角色覆盖的优先级和启用状态不变）
+                link_stmt = pg_insert(AgentSkill.__table__).on_conflict_do_nothing()
+                linked = set(session.execute(
+                    link_stmt.returning(AgentSkill.__table__.c.skill_id),
+                    [{"agent_id": agent_id, "skill_id": pk} for pk in pks.values()]
+                ).scalars())
+                
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                raise e
+            finally:
+                session.close()
+            
+            for skill_id, (i, row) in rows.items():
+                if results[i] is not None:
+                    continue
+                if skill_id in written:
+                    status = "updated" if skill_id in existing else "imported"
+                elif pks.get(skill_id) in linked:
+                    status = "linked"
+                else:
+                    status = "skipped"
+                results[i] = SkillImportResult(skill_id, row["name"], status)
+        
+        return results
+    
+    def get_skill(self, agent_name: str, skill_name: str):
+        """获取指定角色的技能（支持按 name 或 skill_id 查询）
+        
+        Args:
+            agent_name: 角色名称
+            skill_name: 技能名称或技能ID
+            
+        Returns:
+            技能的只读记录（包含 SKILL_COLUMNS 的 namedtuple，所有调用方共享同一缓存），
+            如果不存在则返回 None
+        """
+        return self._cached(
+            ("skill", agent_name, skill_name),
+            lambda: self._query_skill(agent_name, skill_name)
+        )
+    
+    def _query_skill(self, agent_name: str, skill_name: str):
+        """从数据库查询技能（skill_id 匹配优先于 name 匹配）"""
+        session = self.get_read_session()
+        try:
+            row = session.execute(
+                skill_columns_by_key_stmt(SKILL_COLUMNS),
+                {"agent_name": agent_name, "skill_key": skill_name}
+            ).first()
+            return skill_record_type(SKILL_COLUMNS)._make(row) if row else None
+        finally:
+            session.close()
+    
+    def get_skills_by_agent(self, agent_name: str) -> List:
+        """获取指定角色的所有技能
+        
+        Args:
+            agent_name: 角色名称
+            
+        Returns:
+            技能的只读记录列表（包含 SKILL_COLUMNS），按优先级和名称排序
+        """
+        return list(self.get_skill_catalog(agent_name, SKILL_COLUMNS))
+    
+    def get_skill_catalog(
+        self,
+        agent_name: str,
+        columns: Sequence[str] = CATALOG_COLUMNS
+    ) -> Tuple:
+        """获取角色的技能目录（只读取指定列，不加载技能内容）
+        
+        Args:
+            agent_name: 角色名称
+            columns: 需要的 skills 表列名，默认为构建技能目录所需的列
+            
+        Returns:
+            只读记录（namedtuple）组成的元组，按优先级和名称排序
+        """
+        columns = tuple(columns)
+        return self._cached(
+            ("catalog", agent_name, columns),
+            lambda: self._query_skill_catalog(agent_name, columns)
+        )
+    
+    def _query_skill_catalog(self, agent_name: str, columns: Tuple[str, ...]) -> Tuple:
+        """从数据库查询角色技能目录的指定列"""
+        record_type = skill_record_type(columns)
+        session = self.get_read_session()
+        try:
+            rows = session.execute(skill_catalog_stmt(columns), {"agent_name": agent_name})
+            return tuple(record_type._make(row) for row in rows)
+        finally:
+            session.close()
+    
+    def get_catalog_version(self, agent_name: str) -> Optional[Tuple]:
+        """获取角色技能目录的版本号（带缓存，用于判断技能目录是否需要重建）
+        
+        Args:
+            agent_name: 角色名称
+            
+        Returns:
+            版本号元组，技能目录变化时版本号随之变化；角色不存在时返回 None
+        """
+        return self._cached(
+            ("catalog_version", agent_name),
+            lambda: self._query_catalog_version(agent_name)
+        )
+    
+    def _query_catalog_version(self, agent_name: str) -> Optional[Tuple]:
+        """从数据库查询角色技能目录的版本号"""
+        session = self.get_read_session()
+        try:
+            row = session.execute(CATALOG_VERSION_STMT, {"agent_name": agent_name}).first()
+            return tuple(row) if row else None
+        finally:
+            session.close()
+    
+    def get_skill_pk(self, agent_name: str, skill_name: str) -> Optional[int]:
+        """获取角色技能的数据库ID（支持按 name 或 skill_id 查询）
+        
+        技能内容等大字段按数据库ID缓存，同一技能分配给多个角色时只缓存一份。
+        
+        Args:
+            agent_name: 角色名称
+            skill_name: 技能名称或技能ID
+            
+        Returns:
+            技能的数据库ID，如果该角色没有此技能则返回 None
+        """
+        return self._cached(
+            ("skill_pk", agent_name, skill_name),
+            lambda: self._query_skill_pk(agent_name, skill_name)
+        )
+    
+    def _query_skill_pk(self, agent_name: str, skill_name: str) -> Optional[int]:
+        """从数据库查询角色技能的数据库ID"""
+        session = self.get_read_session()
+        try:
+            return session.execute(
+                SKILL_PK_BY_KEY_STMT,
+                {"agent_name": agent_name, "skill_key": skill_name}
+            ).scalar()
+        finally:
+            session.close()
+    
+    def get_skill_content(self, agent_name: str, skill_name: str):
+        """获取技能内容（供 load_skill 使用，支持按 name 或 skill_id 查询）
+        
+        Args:
+            agent_name: 角色名称
+            skill_name: 技能名称或技能ID
+            
+        Returns:
+            包含 CONTENT_COLUMNS 各列的只读记录，如果不存在则返回 None
+        """
+        skill_pk = self.get_skill_pk(agent_name, skill_name)
+        if skill_pk is None:
+            return None
+        return self._cached(("content", skill_pk), lambda: self._query_skill_content(skill_pk))
+    
+    def _query_skill_content(self, skill_pk: int):
+        """从数据库查询技能内容"""
+        record_type = skill_record_type(CONTENT_COLUMNS)
+        session = self.get_read_session()
+        try:
+            row = session.execute(
+                skill_columns_by_pk_stmt(CONTENT_COLUMNS),
+                {"skill_pk": skill_pk}
+            ).first()
+            return record_type._make(row) if row else None
+        finally:
+            session.close()
+    
+    def get_skill_outline(self, agent_name: str, skill_name: str) -> Optional[SkillOutline]:
+        """获取技能概要和章节目录（不读取技能内容，支持按 name 或 skill_id 查询）
+        
+        Args:
+            agent_name: 角色名称
+            skill_name: 技能名称或技能ID
+            
+        Returns:
+            SkillOutline 记录，如果不存在则返回 None
+        """
+        skill_pk = self.get_skill_pk(agent_name, skill_name)
+        if skill_pk is None:
+            return None
+        return self._cached(("outline", skill_pk), lambda: self._query_skill_outline(skill_pk))
+    
+    def _query_skill_outline(self, skill_pk: int) -> Optional[SkillOutline]:
+        """从数据库查询技能概要和章节目录"""
+        session = self.get_read_session()
+        try:
+            row = session.execute(OUTLINE_STMT, {"skill_pk": skill_pk}).first()
+            if not row:
+                return None
+            sections = session.execute(SECTIONS_STMT, {"skill_pk": skill_pk})
+            return SkillOutline(*row, tuple(SectionRecord._make(s) for s in sections))
+        finally:
+            session.close()
+    
+    def get_skill_with_dependencies(self, agent_name: str, skill_name: str) -> Tuple:
+        """获取技能及其全部依赖的内容（一次查询，支持按 name 或 skill_id 查询）
         
         Args:
-            db_url: 数据库连接 URL，如果不提供则从环境变量构建
-        """
-        if db_url:
-            self.db_url = db_url
-        else:
-            # 从环境变量读取数据库配置
-            db_user = os.getenv("DB_USER", "postgres")
-            db_password = os.getenv("DB_PASSWORD", "")
-            db_host = os.getenv("DB_HOST", "localhost")
-            db_port = os.getenv("DB_PORT", "5432")
-            db_name = os.getenv("DB_NAME", "skill")
+            agent_name: 角色名称
+            skill_name: 技能名称或技能ID
             
-            # 构建数据库连接 URL
-            self.db_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+        Returns:
+            DependencyRecord 组成的元组，依赖在前（按深度从深到浅），技能本身（depth 为 0）在最后；
+            技能不存在或尚未计算依赖闭包时返回空元组
+        """
+        skill_pk = self.get_skill_pk(agent_name, skill_name)
+        if skill_pk is None:
+            return ()
+        return self._cached(("dependencies", skill_pk), lambda: self._query_skill_with_dependencies(skill_pk))
+    
+    def _query_skill_with_dependencies(self, skill_pk: int) -> Tuple:
+        """从数据库查询技能及其依赖的内容"""
+        session = self.get_read_session()
+        try:
+            rows = session.execute(DEPENDENCY_CONTENT_STMT, {"skill_pk": skill_pk})
+            return tuple(DependencyRecord._make(row) for row in rows)
+        finally:
+            session.close()
+    
+    def get_section_text(self, skill_pk: int, section: SectionRecord) -> Optional[str]:
+        """获取技能单个章节的文本（在数据库中截取，不读取整个技能内容）
         
-        # 创建数据库引擎
-        self.engine = create_engine(self.db_url, echo=False)
-        self.Session = sessionmaker(bind=self.engine)
+        Args:
+            skill_pk: 技能的数据库ID（SkillOutline.id）
+            section: 章节记录（SkillOutline.sections 中的元素）
+            
+        Returns:
+            章节文本，如果技能不存在则返回 None
+        """
+        return self._cached(
+            ("section_text", skill_pk, section.start_offset, section.end_offset),
+            lambda: self._query_section_text(skill_pk, section)
+        )
     
-    def create_tables(self):
-        """创建数据库表（如果不存在）"""
-        Base.metadata.create_all(self.engine)
+    def _query_section_text(self, skill_pk: int, section: SectionRecord) -> Optional[str]:
+        """从数据库截取章节文本"""
+        session = self.get_read_session()
+        try:
+            return session.execute(SECTION_TEXT_STMT, {
+                "skill_pk": skill_pk,
+                "start_offset": section.start_offset,
+                "length": section.end_offset - section.start_offset
+            }).scalar()
+        finally:
+            session.close()
     
-    def get_session(self):
-        """获取数据库会话"""
-        return self.Session()
+    def get_all_skills(self, agent_name: Optional[str] = None) -> List[Dict[str, str]]:
+        """获取所有技能（转换为字典格式）
+        
+        Args:
+            agent_name: 如果指定，则只返回该角色的技能
+            
+        Returns:
+            技能字典列表，每个包含 name, skill_id, description, content（每次调用返回新的字典）
+        """
+        return [
+            skill._asdict()
+            for skill in self._cached(("all_skills", agent_name), lambda: self._query_all_skills(agent_name))
+        ]
     
-    # ========== Agent 相关方法 ==========
+    def _query_all_skills(self, agent_name: Optional[str]) -> Tuple:
+        """从数据库查询技能，返回 SkillSummary 元组"""
+        if agent_name:
+            return skill_summaries(self._query_skill_catalog(agent_name, SUMMARY_COLUMNS))
+        session = self.get_read_session()
+        try:
+            return skill_summaries(session.execute(ENABLED_SKILLS_STMT))
+        finally:
+            session.close()
     
-    def add_agent(self, name: str, description: str = "", system_prompt: str = "") -> Agent:
-        """添加新角色
+    def assign_skills(
+        self,
+        agent_name: str,
+        skill_ids: Sequence[str],
+        priority: Optional[int] = None,
+        enabled: bool = True
+    ) -> int:
+        """把已有技能分配给角色，或修改已分配技能在该角色下的优先级和启用状态
+        
+        技能只保存一份，分配给多个角色不会复制技能内容、API 调用配置和依赖关系。
         
         Args:
-            name: 角色名称
-            description: 角色描述
-            system_prompt: 系统提示词
+            agent_name: 角色名称
+            skill_ids: 技能ID（skill.json 中的 id）列表
+            priority: 该角色下的优先级，None 表示使用技能的默认优先级
+            enabled: 该角色下是否启用
             
         Returns:
-            创建的 Agent 对象
+            分配或修改的技能数（不存在的技能被忽略）
         """
+        table = AgentSkill.__table__
+        stmt = pg_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.agent_id, table.c.skill_id],
+            set_={"priority": stmt.excluded.priority, "enabled": stmt.excluded.enabled, "updated_at": func.now()}
+        )
         session = self.get_session()
         try:
-            agent = Agent(
-                name=name,
-                description=description,
-                system_prompt=system_prompt,
-                enabled=True
-            )
-            session.add(agent)
+            agent_id = agent_id_in_session(session, agent_name)
+            skill_pks = session.execute(
+                select(Skill.id).where(Skill.skill_id.in_(list(skill_ids)))
+            ).scalars().all() if skill_ids else []
+            if not skill_pks:
+                return 0
+            session.execute(stmt, [
+                {"agent_id": agent_id, "skill_id": pk, "priority": priority, "enabled": enabled}
+                for pk in skill_pks
+            ])
             session.commit()
-            session.refresh(agent)
-            return agent
         except Exception as e:
             session.rollback()
             raise e
         finally:
             session.close()
+        self.invalidate_cache()
+        return len(skill_pks)
     
-    def get_agent(self, agent_name: str) -> Optional[Agent]:
-        """获取角色
+    def unassign_skills(self, agent_name: str, skill_ids: Sequence[str]) -> int:
+        """取消角色的技能分配（技能本身及其分配给其他角色的关联不受影响）
         
         Args:
             agent_name: 角色名称
+            skill_ids: 技能ID（skill.json 中的 id）列表
             
         Returns:
-            Agent 对象，如果不存在则返回 None
+            取消分配的技能数
         """
+        if not skill_ids:
+            return 0
         session = self.get_session()
         try:
-            return session.query(Agent).filter(
-                Agent.name == agent_name,
-                Agent.enabled == True
-            ).first()
-        finally:
-            session.close()
-    
-    def get_all_agents(self) -> List[Agent]:
-        """获取所有启用的角色"""
-        session = self.get_session()
-        try:
-            return session.query(Agent).filter(Agent.enabled == True).all()
+            result = session.execute(
+                delete(AgentSkill)
+                .where(
+                    AgentSkill.agent_id == select(Agent.id).where(Agent.name == agent_name).scalar_subquery(),
+                    AgentSkill.skill_id.in_(select(Skill.id).where(Skill.skill_id.in_(list(skill_ids))))
+                )
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
         finally:
             session.close()
+        if result.rowcount:
+            self.invalidate_cache()
+        return result.rowcount
     
-    # ========== Skill 相关方法 ==========
-    
-    def add_skill_from_json(
-        self,
-        agent_name: str,
-        skill_json: Dict,
-        content: str,
-        examples: Optional[Dict] = None,
-        metadata: Optional[Dict] = None,
-        content_file_path: Optional[str] = None,
-        gitee_repo_url: Optional[str] = None,
-        gitee_commit_hash: Optional[str] = None
-    ) -> Skill:
-        """从 JSON 定义添加技能到指定角色
+    def disable_skills(self, skill_ids: Sequence[str], gitee_repo_url: Optional[str] = None) -> Dict[str, int]:
+        """禁用技能（例如技能目录已从仓库中删除）
         
         Args:
-            agent_name: 角色名称
-            skill_json: skill.json 的内容
-            content: content.md 的内容
-            examples: examples.json 的内容（可选）
-            metadata: metadata.json 的内容（可选）
-            content_file_path: Gitee repo 中的文件路径（可选）
-            gitee_repo_url: Gitee repo URL（可选）
-            gitee_commit_hash: Gitee commit hash（可选）
+            skill_ids: 技能ID（skill.json 中的 id）列表
+            gitee_repo_url: 如果指定，则只禁用来自该仓库的技能
             
         Returns:
-            创建的 Skill 对象
+            被禁用技能的 skill_id 到数据库ID 的映射
         """
+        if not skill_ids:
+            return {}
+        stmt = update(Skill).where(Skill.skill_id.in_(list(skill_ids)), Skill.enabled == True)
+        if gitee_repo_url:
+            stmt = stmt.where(Skill.gitee_repo_url == gitee_repo_url)
         session = self.get_session()
         try:
-            # 在同一个 session 中查询 agent
-            agent = session.query(Agent).filter(
-                Agent.name == agent_name,
-                Agent.enabled == True
-            ).first()
-            
-            if not agent:
-                raise ValueError(f"角色 '{agent_name}' 不存在")
-            
-            # 创建技能
-            skill = Skill(
-                skill_id=skill_json.get("id"),
-                name=skill_json.get("name"),
-                short_description=skill_json.get("short_description"),
-                description=skill_json.get("description"),
-                version=skill_json.get("version", "1.0.0"),
-                category=skill_json.get("category"),
-                tags=skill_json.get("tags", []),
-                author=skill_json.get("author"),
-                content=content,
-                content_file_path=content_file_path,
-                examples=examples,
-                metadata_json=metadata,
-                status=skill_json.get("status", "active"),
-                priority=skill_json.get("priority", 0),
-                agent_id=agent.id,
-                enabled=True,
-                gitee_repo_url=gitee_repo_url,
-                gitee_commit_hash=gitee_commit_hash
-            )
-            session.add(skill)
-            session.flush()  # 获取 skill.id
-            
-            # 添加 API 调用配置
-            api_calls = skill_json.get("api_calls", [])
-            for api_call_data in api_calls:
-                api_call = SkillApiCall(
-                    skill_id=skill.id,
-                    api_name=api_call_data.get("name"),
-                    method=api_call_data.get("method", "GET"),
-                    url=api_call_data.get("url"),
-                    description=api_call_data.get("description"),
-                    required_params=api_call_data.get("required_params", []),
-                    optional_params=api_call_data.get("optional_params", []),
-                    auth_type=api_call_data.get("auth_type"),
-                    auth_config=api_call_data.get("auth_config"),
-                    request_headers=api_call_data.get("request_headers"),
-                    request_body_template=api_call_data.get("request_body_template"),
-                    response_format=api_call_data.get("response_format"),
-                    timeout_seconds=api_call_data.get("timeout_seconds", 30),
-                    retry_count=api_call_data.get("retry_count", 0),
-                    enabled=True
-                )
-                session.add(api_call)
-            
-            # 添加依赖关系
-            requirements = skill_json.get("requirements", {})
-            dependencies = requirements.get("dependencies", [])
-            for dep in dependencies:
-                req = SkillRequirement(
-                    skill_id=skill.id,
-                    requirement_type="dependency",
-                    requirement_name=dep,
-                    is_required=True
-                )
-                session.add(req)
-            
-            api_keys = requirements.get("api_keys", [])
-            for api_key in api_keys:
-                req = SkillRequirement(
-                    skill_id=skill.id,
-                    requirement_type="api_key",
-                    requirement_name=api_key,
-                    is_required=True
-                )
-                session.add(req)
-            
-            min_version = requirements.get("min_agent_version")
-            if min_version:
-                req = SkillRequirement(
-                    skill_id=skill.id,
-                    requirement_type="min_version",
-                    requirement_name="agent_version",
-                    requirement_value=min_version,
-                    is_required=True
-                )
-                session.add(req)
-            
+            disabled = dict(session.execute(
+                stmt.values(enabled=False, updated_at=func.now()).returning(Skill.skill_id, Skill.id)
+            ).all())
             session.commit()
-            session.refresh(skill)
-            return skill
         except Exception as e:
             session.rollback()
             raise e
         finally:
             session.close()
+        if disabled:
+            self.invalidate_cache()
+        return disabled
     
-    def add_skill(self, agent_name: str, name: str, description: str, content: str) -> Skill:
-        """添加技能到指定角色（便捷方法，推荐使用 add_skill_from_json）
-        
-        注意：此方法仅用于快速测试，生产环境请使用 add_skill_from_json 方法
-        从 skill-example 目录加载技能文件。
+    def get_skill_pks(self, skill_ids: Sequence[str]) -> Dict[str, int]:
+        """按 skill_id 批量查询技能的数据库ID
         
         Args:
-            agent_name: 角色名称
-            name: 技能名称
-            description: 技能描述
-            content: 技能详细内容
+            skill_ids: 技能ID（skill.json 中的 id）列表
             
         Returns:
-            创建的 Skill 对象
+            skill_id 到数据库ID 的映射（不存在的技能不包含在内）
         """
-        # 使用简化的 JSON 格式（自动生成 skill_id 和版本）
-        skill_json = {
-            "id": name.lower().replace(" ", "_"),
-            "name": name,
-            "description": description,
-            "short_description": description[:100] if len(description) > 100 else description,
-            "version": "1.0.0",
-            "status": "active",
-            "priority": 0
-        }
-        return self.add_skill_from_json(agent_name, skill_json, content)
+        if not skill_ids:
+            return {}
+        session = self.get_session()
+        try:
+            return dict(session.execute(
+                select(Skill.skill_id, Skill.id).where(Skill.skill_id.in_(list(skill_ids)))
+            ).all())
+        finally:
+            session.close()
     
-    def get_skill(self, agent_name: str, skill_name: str) -> Optional[Skill]:
-        """获取指定角色的技能（支持按 name 或 skill_id 查询）
+    # ========== 同步状态相关方法 ==========
+    
+    def get_skill_pks_by_dir(self, gitee_repo_url: str, skill_dirs: Sequence[str]) -> Dict[str, int]:
+        """按技能目录查询来自指定仓库的技能的数据库ID（按 content_file_path 所在目录匹配）
         
         Args:
-            agent_name: 角色名称
-            skill_name: 技能名称或技能ID
+            gitee_repo_url: 仓库 URL
+            skill_dirs: 仓库内的技能目录路径列表
             
         Returns:
-            Skill 对象，如果不存在则返回 None
+            技能目录到数据库ID 的映射（没有从该目录导入过技能的目录不包含在内）
         """
+        if not skill_dirs:
+            return {}
         session = self.get_session()
         try:
-            # 在同一个 session 中查询 agent
-            agent = session.query(Agent).filter(
-                Agent.name == agent_name,
-                Agent.enabled == True
-            ).first()
-            
-            if not agent:
-                return None
-            
-            # 先按 skill_id 查询，如果不存在则按 name 查询
-            skill = session.query(Skill).filter(
-                Skill.skill_id == skill_name,
-                Skill.agent_id == agent.id,
-                Skill.enabled == True
-            ).first()
-            
-            if not skill:
-                skill = session.query(Skill).filter(
-                    Skill.name == skill_name,
-                    Skill.agent_id == agent.id,
-                    Skill.enabled == True
-                ).first()
-            
-            return skill
+            rows = session.execute(
+                select(Skill.content_file_path, Skill.id).where(
+                    Skill.gitee_repo_url == gitee_repo_url,
+                    or_(*(Skill.content_file_path.startswith(f"{d}/", autoescape=True) for d in skill_dirs))
+                )
+            ).all()
         finally:
             session.close()
+        return {d: pk for path, pk in rows for d in skill_dirs if path.startswith(f"{d}/")}
     
-    def get_skills_by_agent(self, agent_name: str) -> List[Skill]:
-        """获取指定角色的所有技能
+    def get_repo_skill_ids(self, gitee_repo_url: str) -> List[str]:
+        """获取来自指定仓库的所有启用技能的 skill_id
         
         Args:
-            agent_name: 角色名称
+            gitee_repo_url: 仓库 URL
             
         Returns:
-            技能列表
+            skill_id 列表
         """
         session = self.get_session()
         try:
-            # 在同一个 session 中查询 agent
-            agent = session.query(Agent).filter(
-                Agent.name == agent_name,
-                Agent.enabled == True
-            ).first()
-            
-            if not agent:
-                return []
-            
-            return session.query(Skill).filter(
-                Skill.agent_id == agent.id,
-                Skill.enabled == True
-            ).order_by(Skill.priority.desc(), Skill.name).all()
+            return list(session.execute(
+                select(Skill.skill_id).where(Skill.gitee_repo_url == gitee_repo_url, Skill.enabled == True)
+            ).scalars())
         finally:
             session.close()
     
-    def get_all_skills(self, agent_name: Optional[str] = None) -> List[Dict[str, str]]:
-        """获取所有技能（转换为字典格式）
+    def get_last_synced_commit(self, gitee_repo_url: str, agent_name: Optional[str] = None) -> Optional[str]:
+        """获取仓库最近一次成功同步的 commit hash
+        
+        从 skill_repo_syncs 表读取；没有记录时（该表创建之前同步的仓库）从技能行的同步状态读取。
         
         Args:
-            agent_name: 如果指定，则只返回该角色的技能
+            gitee_repo_url: 仓库 URL
+            agent_name: 如果指定，则只看同步到该角色的记录
             
         Returns:
-            技能字典列表，每个包含 name, description, content
+            commit hash，如果该仓库从未同步过则返回 None
         """
+        legacy = (
+            select(Skill.gitee_commit_hash)
+            .where(Skill.gitee_repo_url == gitee_repo_url, Skill.last_synced_at.isnot(None))
+            .order_by(Skill.last_synced_at.desc())
+            .limit(1)
+        )
         if agent_name:
-            skills = self.get_skills_by_agent(agent_name)
-        else:
-            session = self.get_session()
-            try:
-                skills = session.query(Skill).filter(Skill.enabled == 'true').all()
-            finally:
-                session.close()
+            legacy = legacy.where(Skill.id.in_(_agent_skill_pks(agent_name)))
+        session = self.get_session()
+        try:
+            commit = session.execute(
+                select(SkillRepoSync.gitee_commit_hash).where(
+                    SkillRepoSync.gitee_repo_url == gitee_repo_url,
+                    SkillRepoSync.agent_name == (agent_name or "")
+                )
+            ).scalar()
+            return commit or session.execute(legacy).scalar()
+        finally:
+            session.close()
+    
+    def mark_repo_synced(self, gitee_repo_url: str, gitee_commit_hash: str, agent_name: Optional[str] = None) -> int:
+        """记录仓库已同步到指定 commit，并将仓库的所有技能标记为已同步
         
-        return [
-            {
-                "name": skill.name,
-                "skill_id": skill.skill_id,
-                "description": skill.short_description or skill.description,
-                "content": skill.content
-            }
-            for skill in skills
-        ]
+        同步位置保存在 skill_repo_syncs 表中（仓库中没有技能时也会记录）。
+        
+        Args:
+            gitee_repo_url: 仓库 URL
+            gitee_commit_hash: 同步到的 commit hash
+            agent_name: 如果指定，则记录为同步到该角色，并只标记该角色的技能
+            
+        Returns:
+            更新的技能数
+        """
+        table = SkillRepoSync.__table__
+        upsert = pg_insert(table).values(
+            gitee_repo_url=gitee_repo_url,
+            agent_name=agent_name or "",
+            gitee_commit_hash=gitee_commit_hash
+        )
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[table.c.gitee_repo_url, table.c.agent_name],
+            set_={"gitee_commit_hash": upsert.excluded.gitee_commit_hash, "synced_at": func.now()}
+        )
+        stmt = update(Skill).where(Skill.gitee_repo_url == gitee_repo_url)
+        if agent_name:
+            stmt = stmt.where(Skill.id.in_(_agent_skill_pks(agent_name)))
+        session = self.get_session()
+        try:
+            session.execute(upsert)
+            # 只记录同步状态，保持 updated_at 不变（否则会触发各进程的技能缓存失效）
+            result = session.execute(
+                stmt.values(
+                    gitee_commit_hash=gitee_commit_hash,
+                    last_synced_at=func.now(),
+                    updated_at=Skill.updated_at
+                )
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
     
     # ========== API Call 相关方法 ==========
     
@@ -474,7 +2088,7 @@ class DatabaseManager:
         Returns:
             API 调用配置列表
         """
-        session = self.get_session()
+        session = self.get_read_session()
         try:
             return session.query(SkillApiCall).filter(
                 SkillApiCall.skill_id == skill_id,
@@ -483,6 +2097,29 @@ class DatabaseManager:
         finally:
             session.close()
     
+    def get_agent_api_calls(self, agent_name: str) -> Tuple:
+        """获取角色所有启用技能的启用 API 调用配置（供 skill_api.create_api_tools 使用）
+        
+        Args:
+            agent_name: 角色名称
+            
+        Returns:
+            ApiCallRecord 组成的元组，按技能顺序排列
+        """
+        return self._cached(
+            ("api_calls", agent_name),
+            lambda: self._query_agent_api_calls(agent_name)
+        )
+    
+    def _query_agent_api_calls(self, agent_name: str) -> Tuple:
+        """从数据库查询角色的 API 调用配置"""
+        session = self.get_read_session()
+        try:
+            rows = session.execute(AGENT_API_CALLS_STMT, {"agent_name": agent_name})
+            return tuple(ApiCallRecord._make(row) for row in rows)
+        finally:
+            session.close()
+    
     # ========== Sync Log 相关方法 ==========
     
     def add_sync_log(
@@ -523,10 +2160,163 @@ class DatabaseManager:
             session.add(sync_log)
             session.commit()
             session.refresh(sync_log)
-            return sync_log
         except Exception as e:
             session.rollback()
             raise e
         finally:
             session.close()
+        return sync_log
+    
+    def add_sync_logs(self, entries: Iterable[Dict]) -> int:
+        """批量添加同步日志（单个事务，大量写入时使用 sync_log.SyncLogBuffer 缓冲）
+        
+        Args:
+            entries: 同步日志字典，键同 add_sync_log 的参数
+            
+        Returns:
+            写入的日志条数
+        """
+        rows = [sync_log_row(entry) for entry in entries]
+        if not rows:
+            return 0
+        session = self.get_session()
+        try:
+            session.execute(insert(SkillSyncLog.__table__), rows)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        return len(rows)
+    
+    def prune_sync_logs(self, retention_days: Optional[float] = None, batch_size: int = 10000) -> int:
+        """删除早于保留时间的同步日志
+        
+        按 synced_at 索引分批删除，每批一个事务，避免长时间持有锁和产生过大的事务。
+        写入日志时不会自动清理，需要由定时任务调用（见 `python sync_log.py prune`）。
+        
+        Args:
+            retention_days: 保留天数，默认使用初始化时的 sync_log_retention_days，小于等于 0 表示不清理
+            batch_size: 每个事务删除的最大行数
+            
+        Returns:
+            删除的日志条数
+        """
+        if retention_days is None:
+            retention_days = self.sync_log_retention_days
+        if retention_days <= 0:
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        table = SkillSyncLog.__table__
+        expired = select(table.c.id).where(table.c.synced_at < cutoff).limit(batch_size)
+        removed = 0
+        while True:
+            session = self.get_session()
+            try:
+                count = session.execute(delete(table).where(table.c.id.in_(expired))).rowcount
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                raise e
+            finally:
+                session.close()
+            removed += count
+            if count < batch_size:
+                return removed
+    
+    def get_last_successful_syncs(self, skill_ids: Optional[Sequence[str]] = None) -> Dict[str, datetime]:
+        """获取每个技能最后一次成功同步的时间（保留期内的日志）
+        
+        Args:
+            skill_ids: 技能ID列表（可选），不提供则返回所有技能
+            
+        Returns:
+            技能ID 到最后一次成功同步时间的映射（保留期内没有成功同步的技能不在其中）
+        """
+        stmt = (
+            select(Skill.skill_id, func.max(SkillSyncLog.synced_at))
+            .join(Skill, Skill.id == SkillSyncLog.skill_id)
+            .where(SkillSyncLog.sync_status == "success")
+            .group_by(Skill.skill_id)
+        )
+        if skill_ids is not None:
+            stmt = stmt.where(Skill.skill_id.in_(list(skill_ids)))
+        session = self.get_read_session()
+        try:
+            return dict(session.execute(stmt).all())
+        finally:
+            session.close()
+    
+    def get_sync_failure_rates(self, since: Optional[datetime] = None, min_runs: int = 1) -> Dict[str, Dict]:
+        """按技能统计同步失败率（失败次数多的在前）
+        
+        Args:
+            since: 只统计该时间之后的日志（可选），不提供则统计保留期内的所有日志
+            min_runs: 同步次数少于该值的技能不返回
+            
+        Returns:
+            技能ID 到 {"runs": 同步次数, "failed": 失败次数, "failure_rate": 失败率} 的映射
+        """
+        runs = func.count(SkillSyncLog.id)
+        failed = func.count(SkillSyncLog.id).filter(SkillSyncLog.sync_status == "failed")
+        stmt = (
+            select(Skill.skill_id, runs, failed)
+            .join(Skill, Skill.id == SkillSyncLog.skill_id)
+            .group_by(Skill.skill_id)
+            .having(runs >= min_runs)
+            .order_by(failed.desc(), Skill.skill_id)
+        )
+        if since is not None:
+            stmt = stmt.where(SkillSyncLog.synced_at >= since)
+        session = self.get_read_session()
+        try:
+            rows = session.execute(stmt).all()
+        finally:
+            session.close()
+        return {
+            skill_id: {"runs": total, "failed": failures, "failure_rate": failures / total}
+            for skill_id, total, failures in rows
+        }
+    
+    def get_sync_duration_percentiles(
+        self,
+        since: Optional[datetime] = None,
+        sync_type: Optional[str] = None,
+        percentiles: Sequence[float] = (0.5, 0.9, 0.99)
+    ) -> Dict[float, Optional[float]]:
+        """统计同步耗时（毫秒）的分位数
+        
+        只统计记录了耗时的日志。SkillSyncEngine 每次同步只在第一条日志上记录整次同步的耗时，
+        因此统计的是每次同步的耗时分布。PostgreSQL 上在数据库中计算（percentile_cont），
+        SQLite 上读取耗时后在本地计算。
+        
+        Args:
+            since: 只统计该时间之后的日志（可选），不提供则统计保留期内的所有日志
+            sync_type: 只统计该同步类型（full, incremental）的日志（可选）
+            percentiles: 分位（0-1）
+            
+        Returns:
+            分位到耗时（毫秒）的映射，没有日志时值为 None
+        """
+        duration = SkillSyncLog.sync_duration_ms
+        conditions = [duration.isnot(None)]
+        if since is not None:
+            conditions.append(SkillSyncLog.synced_at >= since)
+        if sync_type is not None:
+            conditions.append(SkillSyncLog.sync_type == sync_type)
+        session = self.get_read_session()
+        try:
+            if dialect_name(session) == "postgresql":
+                row = session.execute(
+                    select(*(func.percentile_cont(p).within_group(duration) for p in percentiles)).where(*conditions)
+                ).one()
+                return {p: (float(value) if value is not None else None) for p, value in zip(percentiles, row)}
+            durations = session.execute(select(duration).where(*conditions).order_by(duration)).scalars().all()
+        finally:
+            session.close()
+        return {p: percentile_cont(durations, p) for p in percentiles}
+
 
+# 公开方法的耗时记录到 skills_db_call_seconds（见 instrumentation.py，默认关闭）
+instrument_class(DatabaseManager, "DatabaseManager", exclude=("get_session", "get_read_session", "read_your_writes"))
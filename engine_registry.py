@@ -0,0 +1,289 @@
+"""
+数据库引擎注册表
+进程内按 URL 共享 SQLAlchemy 引擎和连接池，连接池参数从环境变量读取，
+并统计连接池的借出次数和等待时间；SQLite 引擎的连接使用 WAL 模式
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class PoolStats:
+    """连接池统计信息"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkins = 0
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, wait_ms: float, timed_out: bool = False) -> None:
+        """记录一次借出连接（含等待和建立连接的耗时）"""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            if wait_ms > self.max_wait_ms:
+                self.max_wait_ms = wait_ms
+
+    def record_checkin(self) -> None:
+        """记录一次归还连接"""
+        with self._lock:
+            self.checkins += 1
+
+    def as_dict(self) -> Dict[str, float]:
+        """返回统计信息字典"""
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "timeouts": self.timeouts,
+                "total_wait_ms": round(self.total_wait_ms, 3),
+                "avg_wait_ms": round(self.total_wait_ms / attempts, 3) if attempts else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+
+class _InstrumentedPoolMixin:
+    """在借出和归还连接时记录统计信息的连接池"""
+
+    stats: Optional[PoolStats] = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.record_checkout((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        if self.stats is not None:
+            self.stats.record_checkout((time.perf_counter() - start) * 1000)
+        return connection
+
+    def _do_return_conn(self, record):
+        if self.stats is not None:
+            self.stats.record_checkin()
+        super()._do_return_conn(record)
+
+    def recreate(self):
+        # engine.dispose() 会重建连接池，统计信息随之保留
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    """带统计信息的 QueuePool"""
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """带统计信息的 AsyncAdaptedQueuePool"""
+
+
+_engines: Dict[str, Engine] = {}
+_async_engines: Dict[str, AsyncEngine] = {}
+_lock = threading.Lock()
+
+
+def env_bool(name: str, default: str) -> bool:
+    """读取布尔型环境变量（1、true、yes、on 为真，不区分大小写）
+
+    Args:
+        name: 环境变量名
+        default: 未设置时使用的值
+
+    Returns:
+        布尔值
+    """
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+def pool_options_from_env() -> Dict:
+    """从环境变量读取连接池配置
+
+    Returns:
+        连接池配置字典（pool_size, max_overflow, pool_timeout, pool_recycle,
+        pool_pre_ping, statement_timeout_ms）
+    """
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "-1")),
+        "pool_pre_ping": env_bool("DB_POOL_PRE_PING", "false"),
+        "statement_timeout_ms": int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0")),
+    }
+
+
+def sqlite_pragmas_from_env() -> Dict[str, str]:
+    """从环境变量读取 SQLite 每个新连接执行的 PRAGMA
+
+    Returns:
+        PRAGMA 名称到值的映射（journal_mode, synchronous, busy_timeout, foreign_keys）
+    """
+    return {
+        "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+        # SQLite 默认不检查外键，ON DELETE CASCADE 依赖外键约束
+        "foreign_keys": "ON",
+    }
+
+
+def _set_sqlite_pragmas(engine: Engine) -> None:
+    """新建 SQLite 连接时执行 PRAGMA（WAL 模式下读写互不阻塞，写入等待锁而不是立即失败）"""
+    pragmas = sqlite_pragmas_from_env()
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def _engine_kwargs(db_url: str, options: Dict) -> Dict:
+    """将连接池配置转换为 create_engine 的参数"""
+    options = dict(options)
+    statement_timeout_ms = options.pop("statement_timeout_ms", 0)
+    kwargs = {"echo": False, **options}
+
+    url = make_url(db_url)
+    # 语句超时只对 PostgreSQL 生效
+    if statement_timeout_ms and url.get_backend_name() == "postgresql":
+        if url.get_driver_name() == "asyncpg":
+            kwargs["connect_args"] = {
+                "server_settings": {"statement_timeout": str(statement_timeout_ms)}
+            }
+        else:
+            kwargs["connect_args"] = {"options": f"-c statement_timeout={statement_timeout_ms}"}
+    return kwargs
+
+
+def _stats_key(db_url: str) -> str:
+    """统计信息中使用的 URL（隐藏密码）"""
+    return make_url(db_url).render_as_string(hide_password=True)
+
+
+def get_engine(db_url: str, **options) -> Engine:
+    """获取（或创建）指定 URL 的共享引擎
+
+    同一进程内相同 URL 的所有 DatabaseManager 共用一个引擎和连接池。
+    连接池参数只在第一次创建引擎时生效。
+
+    Args:
+        db_url: 数据库连接 URL
+        **options: 覆盖环境变量的连接池配置，键同 pool_options_from_env()
+
+    Returns:
+        SQLAlchemy 引擎
+    """
+    engine = _engines.get(db_url)
+    if engine is not None:
+        return engine
+    with _lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            pool_options = {**pool_options_from_env(), **options}
+            engine = create_engine(
+                db_url,
+                poolclass=InstrumentedQueuePool,
+                **_engine_kwargs(db_url, pool_options)
+            )
+            engine.pool.stats = PoolStats()
+            if engine.dialect.name == "sqlite":
+                _set_sqlite_pragmas(engine)
+            _engines[db_url] = engine
+    return engine
+
+
+def get_async_engine(db_url: str, **options) -> AsyncEngine:
+    """获取（或创建）指定 URL 的共享异步引擎
+
+    asyncpg 连接绑定在创建它的事件循环上，共享的异步引擎应在同一个事件循环中使用。
+
+    Args:
+        db_url: 异步驱动的数据库连接 URL
+        **options: 覆盖环境变量的连接池配置，键同 pool_options_from_env()
+
+    Returns:
+        SQLAlchemy 异步引擎
+    """
+    engine = _async_engines.get(db_url)
+    if engine is not None:
+        return engine
+    with _lock:
+        engine = _async_engines.get(db_url)
+        if engine is None:
+            pool_options = {**pool_options_from_env(), **options}
+            engine = create_async_engine(
+                db_url,
+                poolclass=InstrumentedAsyncQueuePool,
+                **_engine_kwargs(db_url, pool_options)
+            )
+            engine.sync_engine.pool.stats = PoolStats()
+            if engine.dialect.name == "sqlite":
+                _set_sqlite_pragmas(engine.sync_engine)
+            _async_engines[db_url] = engine
+    return engine
+
+
+def pool_status(engine) -> Dict:
+    """返回引擎连接池的当前状态和累计统计
+
+    Args:
+        engine: Engine 或 AsyncEngine
+
+    Returns:
+        包含 size, checked_out, overflow, checked_in 以及 PoolStats 字段的字典
+    """
+    pool = engine.sync_engine.pool if isinstance(engine, AsyncEngine) else engine.pool
+    status = {}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin(),
+        })
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update(stats.as_dict())
+    return status
+
+
+def get_pool_stats() -> Dict[str, Dict]:
+    """返回本进程所有共享引擎的连接池统计，键为隐藏密码后的 URL"""
+    with _lock:
+        engines = list(_engines.items()) + list(_async_engines.items())
+    return {_stats_key(url): pool_status(engine) for url, engine in engines}
+
+
+def dispose_engines() -> None:
+    """关闭并移除所有共享的同步引擎（用于进程 fork 后或测试清理）
+
+    异步引擎需要在事件循环中调用 AsyncEngine.dispose() 关闭。
+    """
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
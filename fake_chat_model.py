@@ -0,0 +1,85 @@
+"""
+离线聊天模型
+不访问网络的确定性聊天模型，用于基准测试（benchmark.py）和本地调试 agent 的技能加载流程
+"""
+
+import asyncio
+import re
+import time
+from itertools import count
+from typing import Any, Callable, List, Optional, Sequence
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+# 系统提示中技能列表的行格式（见 create_agent.skill_line）
+_SKILL_LINE_RE = re.compile(r"^- \*\*(.+?)\*\*", re.MULTILINE)
+
+
+def _text(message: BaseMessage) -> str:
+    return message.text if hasattr(message, "text") else str(message.content)
+
+
+def pick_listed_skill(messages: Sequence[BaseMessage]) -> Optional[str]:
+    """选择系统提示中列出的技能：名称出现在用户消息中的技能优先，否则取第一个"""
+    system = next((m for m in messages if isinstance(m, SystemMessage)), None)
+    names = _SKILL_LINE_RE.findall(_text(system)) if system is not None else []
+    if not names:
+        return None
+    question = next((_text(m) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+    return next((name for name in names if name in question), names[0])
+
+
+class FakeChatModel(BaseChatModel):
+    """按固定流程响应的聊天模型
+
+    每轮对话先调用一次 load_skill（技能由 skill_picker 从消息中选出），收到工具结果后给出最终回答；
+    没有可加载的技能时直接回答。可以设置 latency 模拟模型服务的响应时间；
+    输出与温度参数无关，temperature 只用于模拟模型配置（例如模型响应缓存只缓存温度为 0 的调用）。
+    """
+
+    skill_picker: Callable[[Sequence[BaseMessage]], Optional[str]] = pick_listed_skill
+    latency: float = 0.0
+    temperature: float = 0.0
+    answer: str = "已根据技能内容完成回答。"
+
+    _call_ids: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-skills-chat-model"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """工具调用由 _generate 按固定流程生成，这里只需返回模型本身"""
+        return self
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        if self._call_ids is None:
+            self._call_ids = count(1)
+        last = messages[-1] if messages else None
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"{self.answer}（工具结果 {len(_text(last))} 个字符）")
+        skill_name = self.skill_picker(messages)
+        if skill_name is None:
+            return AIMessage(content=self.answer)
+        return AIMessage(
+            content="",
+            tool_calls=[{
+                "name": "load_skill",
+                "args": {"skill_name": skill_name},
+                "id": f"call_{next(self._call_ids)}",
+                "type": "tool_call",
+            }],
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
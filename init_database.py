@@ -5,8 +5,9 @@
 
 import os
 from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
 from db_utils import DatabaseManager, Agent, Skill
-from load_skill_from_file import load_all_skills_from_example_dir
+from load_skill_from_file import iter_skills_from_dir, SkillManifest
 
 load_dotenv()
 
@@ -14,12 +15,13 @@ load_dotenv()
 def init_database():
     """初始化数据库：创建表并导入初始数据"""
     
-    # 检查数据库配置
+    # 检查数据库配置（设置了 DB_URL 时直接使用，例如 sqlite:///skills.db）
+    db_url = os.getenv("DB_URL")
     db_user = os.getenv("DB_USER")
     db_password = os.getenv("DB_PASSWORD")
     db_name = os.getenv("DB_NAME")
     
-    if not db_user or not db_password or not db_name:
+    if not db_url and (not db_user or not db_password or not db_name):
         print("错误: 未设置完整的数据库配置")
         print("请在 .env 文件中添加以下配置:")
         print("  DB_USER=postgres")
@@ -27,14 +29,18 @@ def init_database():
         print("  DB_HOST=localhost (可选，默认 localhost)")
         print("  DB_PORT=5432 (可选，默认 5432)")
         print("  DB_NAME=skill (可选，默认 skill)")
+        print("或者直接设置数据库 URL，例如使用 SQLite 数据库文件:")
+        print("  DB_URL=sqlite:///skills.db")
         return
     
-    db_host = os.getenv("DB_HOST", "localhost")
-    db_port = os.getenv("DB_PORT", "5432")
-    
     print(f"正在连接到数据库...")
-    print(f"数据库: {db_name} @ {db_host}:{db_port}")
-    print(f"用户: {db_user}")
+    if db_url:
+        print(f"数据库: {make_url(db_url).render_as_string(hide_password=True)}")
+    else:
+        db_host = os.getenv("DB_HOST", "localhost")
+        db_port = os.getenv("DB_PORT", "5432")
+        print(f"数据库: {db_name} @ {db_host}:{db_port}")
+        print(f"用户: {db_user}")
     
     try:
         # 创建数据库管理器（自动从环境变量构建 URL）
@@ -69,41 +75,62 @@ def init_database():
         
         # 导入技能（从 skill-example 目录加载）
         print("\n正在导入技能到数据库...")
-        imported_count = 0
-        skipped_count = 0
-        error_count = 0
         
-        # 从 skill-example 目录加载技能
-        example_skills = load_all_skills_from_example_dir("skill-example")
+        # 从 skill-example 目录并行加载技能，边加载边批量导入（按 skill_id 幂等，已存在的技能跳过）
+        # 设置 SKILL_MANIFEST_PATH 时，自上次导入以来未变化的技能目录不会被重新读取
+        manifest_path = os.getenv("SKILL_MANIFEST_PATH")
+        manifest = SkillManifest(manifest_path) if manifest_path else None
+        batch_size = int(os.getenv("SKILL_IMPORT_BATCH_SIZE", "500"))
+        skill_dir_names = []
+        
+        def skill_items():
+            for skill_dir_name, (skill_json, content, examples, metadata) in iter_skills_from_dir(
+                "skill-example", manifest=manifest
+            ):
+                skill_dir_names.append(skill_dir_name)
+                yield {
+                    "skill_json": skill_json,
+                    "content": content,
+                    "examples": examples,
+                    "metadata": metadata,
+                    "content_file_path": f"skill-example/{skill_dir_name}/content.md"
+                }
+        
+        results = db.bulk_import_skills(default_agent_name, skill_items(), batch_size=batch_size)
         
-        if not example_skills:
-            print("  警告: skill-example 目录中没有找到技能文件")
-            print("  提示: 请在 skill-example 目录下创建技能文件夹，包含 skill.json 和 content.md 文件")
-            print("  参考: skill-example/data_analysis/ 目录结构")
+        if not results:
+            if manifest is not None and manifest.entries:
+                print("  技能目录自上次导入以来没有变化")
+            else:
+                print("  警告: skill-example 目录中没有找到技能文件")
+                print("  提示: 请在 skill-example 目录下创建技能文件夹，包含 skill.json 和 content.md 文件")
+                print("  参考: skill-example/data_analysis/ 目录结构")
         else:
-            print(f"  从 skill-example 目录找到 {len(example_skills)} 个技能")
-            for skill_dir_name, (skill_json, content, examples, metadata) in example_skills.items():
-                skill_id = skill_json.get("id", skill_dir_name)
-                try:
-                    # 检查技能是否已存在（按 skill_id 或 name）
-                    existing_skill = db.get_skill(default_agent_name, skill_id)
-                    if existing_skill:
-                        print(f"  跳过: {skill_json.get('name')} (已存在)")
-                        skipped_count += 1
-                    else:
-                        db.add_skill_from_json(
-                            agent_name=default_agent_name,
-                            skill_json=skill_json,
-                            content=content,
-                            examples=examples,
-                            metadata=metadata,
-                            content_file_path=f"skill-example/{skill_dir_name}/content.md"
-                        )
-                        print(f"  ✓ 导入: {skill_json.get('name')} (v{skill_json.get('version')})")
-                        imported_count += 1
-                except Exception as e:
-                    print(f"  ✗ 导入失败 {skill_json.get('name')}: {str(e)}")
-                    error_count += 1
+            print(f"  从 skill-example 目录加载 {len(results)} 个技能")
+        
+        # 只有导入成功的技能计入清单，导入失败的技能下次重新加载
+        if manifest is not None:
+            for skill_dir_name, result in zip(skill_dir_names, results):
+                if result.status != "failed":
+                    manifest.confirm(skill_dir_name)
+            manifest.save()
+        
+        imported_count = skipped_count = error_count = 0
+        for result in results:
+            if result.status == "imported":
+                print(f"  ✓ 导入: {result.name}")
+                if result.message:
+                    print(f"    警告: {result.message}")
+                imported_count += 1
+            elif result.status == "linked":
+                print(f"  ✓ 分配已有技能: {result.name}")
+                imported_count += 1
+            elif result.status == "skipped":
+                print(f"  跳过: {result.name} (已存在)")
+                skipped_count += 1
+            else:
+                print(f"  ✗ 导入失败 {result.name}: {result.message}")
+                error_count += 1
         
         print(f"\n导入完成:")
         print(f"  - 成功导入: {imported_count} 个技能")
@@ -0,0 +1,620 @@
+"""
+性能埋点
+记录数据库管理器方法、工具调用和模型调用的耗时和计数，导出为 Prometheus 文本格式
+和 OpenTelemetry 风格的 span（可选转发给 opentelemetry SDK）
+
+默认关闭（环境变量 INSTRUMENTATION_ENABLED），关闭时埋点处只有一次属性检查，
+agent 也不会添加 InstrumentationMiddleware（见 create_agent.py）。
+"""
+
+import functools
+import inspect
+import json
+import os
+import secrets
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from engine_registry import env_bool
+
+load_dotenv()
+
+
+# 耗时直方图的桶（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# token 数直方图的桶
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+# 指标定义：名称 -> (类型, 说明, 直方图的桶)
+METRICS = {
+    "skills_db_call_seconds": ("histogram", "数据库管理器方法耗时（秒）", LATENCY_BUCKETS),
+    "skills_tool_call_seconds": ("histogram", "agent 工具调用耗时（秒）", LATENCY_BUCKETS),
+    "skills_model_call_seconds": ("histogram", "模型调用耗时（秒）", LATENCY_BUCKETS),
+    "skills_middleware_seconds": ("histogram", "SkillMiddleware 注入技能提示的耗时（秒）", LATENCY_BUCKETS),
+    "skills_prompt_tokens": ("histogram", "模型调用的输入 token 数（估算）", TOKEN_BUCKETS),
+    "skills_model_tokens_total": ("counter", "模型服务返回的 token 用量", None),
+    "skills_skill_loads_total": ("counter", "load_skill 按技能的调用次数", None),
+    "skills_span_export_errors_total": ("counter", "span 导出失败次数", None),
+    # 以下指标在导出时从缓存和连接池读取（本进程存活的实例）
+    "skills_cache_hits_total": ("counter", "缓存命中次数", None),
+    "skills_cache_misses_total": ("counter", "缓存未命中次数", None),
+    "skills_cache_entries": ("gauge", "缓存条目数", None),
+    "skills_db_pool_checkouts_total": ("counter", "连接池借出连接次数", None),
+    "skills_db_pool_timeouts_total": ("counter", "连接池等待超时次数", None),
+    "skills_db_pool_wait_seconds_total": ("counter", "借出连接的累计等待时间（秒）", None),
+    "skills_db_pool_max_wait_seconds": ("gauge", "借出连接的最长等待时间（秒）", None),
+    "skills_db_pool_checked_out": ("gauge", "当前借出的连接数", None),
+}
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{_escape_label(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Histogram:
+    """直方图（各桶计数为非累计值，导出时累加）"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """指标注册表（计数器、仪表和直方图），线程安全"""
+
+    def __init__(self):
+        self._values: Dict[str, Dict[Tuple, object]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict, float]]]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: Dict) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((key, "" if value is None else str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, amount: float = 1.0, **labels) -> None:
+        """计数器增加 amount"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """设置仪表的值"""
+        key = self._key(labels)
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """向直方图记录一个值"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(METRICS[name][2] or LATENCY_BUCKETS)
+            histogram.observe(value)
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict, float]]]) -> None:
+        """注册导出时调用的收集函数，返回 (指标名, 标签, 值) 序列"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def reset(self) -> None:
+        """清空已记录的指标（收集函数保留）"""
+        with self._lock:
+            self._values.clear()
+
+    def _collect(self) -> Dict[str, Dict[Tuple, object]]:
+        with self._lock:
+            values = {
+                name: {
+                    key: (_copy_histogram(value) if isinstance(value, _Histogram) else value)
+                    for key, value in series.items()
+                }
+                for name, series in self._values.items()
+            }
+            collectors = list(self._collectors)
+        for collector in collectors:
+            for name, labels, value in collector():
+                series = values.setdefault(name, {})
+                key = self._key(labels)
+                series[key] = series.get(key, 0.0) + value
+        return values
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """返回所有指标的当前值
+
+        Returns:
+            指标名 -> {标签字符串: 值}，直方图的值为 {"count", "sum", "buckets"}
+        """
+        result = {}
+        for name, series in self._collect().items():
+            result[name] = {}
+            for key, value in series.items():
+                if isinstance(value, _Histogram):
+                    value = {
+                        "count": value.count,
+                        "sum": value.sum,
+                        "buckets": dict(zip([*value.buckets, float("inf")], _cumulative(value.counts))),
+                    }
+                result[name][_format_labels(key)] = value
+        return result
+
+    def render(self) -> str:
+        """导出为 Prometheus 文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        for name, series in sorted(self._collect().items()):
+            metric_type, help_text, _ = METRICS.get(name, ("untyped", "", None))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(series.items()):
+                if isinstance(value, _Histogram):
+                    bounds = [*value.buckets, float("inf")]
+                    for bound, count in zip(bounds, _cumulative(value.counts)):
+                        le = 'le="%s"' % _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key, le)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(value.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {value.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _copy_histogram(histogram: _Histogram) -> _Histogram:
+    copy = _Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    total, result = 0, []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+class Span:
+    """一次操作的耗时记录（字段与 OpenTelemetry span 对应）"""
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_span_id", "start_time_unix_nano",
+        "end_time_unix_nano", "attributes", "status", "error"
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.start_time_unix_nano = time.time_ns()
+        self.end_time_unix_nano = None
+        self.attributes = attributes
+        self.status = "ok"
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        """设置属性"""
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        """标记为失败"""
+        self.status = "error"
+        self.error = message
+
+    @property
+    def duration_seconds(self) -> Optional[float]:
+        """耗时（秒），未结束时为 None"""
+        if self.end_time_unix_nano is None:
+            return None
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e9
+
+    def to_dict(self) -> Dict:
+        """转换为 OTLP JSON 风格的字典"""
+        return {
+            "name": self.name,
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "startTimeUnixNano": self.start_time_unix_nano,
+            "endTimeUnixNano": self.end_time_unix_nano,
+            "attributes": dict(self.attributes),
+            "status": {"code": "ERROR" if self.status == "error" else "OK", "message": self.error or ""},
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _NoopScope:
+    """埋点关闭时的 span（不做任何事）"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+
+_NOOP_SCOPE = _NoopScope()
+
+
+class _SpanScope:
+    """span 的上下文管理器：结束时记录耗时指标并导出 span"""
+
+    __slots__ = ("_instrumentation", "_name", "_metric", "_labels", "_span", "_token", "_start")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str, metric: Optional[str], labels: Dict):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._metric = metric
+        self._labels = labels
+
+    def __enter__(self) -> Span:
+        self._span = Span(self._name, _current_span.get(), dict(self._labels))
+        self._token = _current_span.set(self._span)
+        self._start = time.perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        span = self._span
+        span.end_time_unix_nano = span.start_time_unix_nano + int(duration * 1e9)
+        if exc is not None:
+            span.set_error(f"{exc_type.__name__}: {exc}")
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # 在其他上下文中结束（例如跨任务），恢复父 span 即可
+            pass
+        self._instrumentation._finish(span, self._metric, self._labels, duration)
+        return False
+
+
+class Instrumentation:
+    """埋点状态：开关、指标注册表和 span 导出器"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.metrics = MetricsRegistry()
+        self.exporters: List[Callable[[Span], None]] = []
+
+    def span(self, name: str, metric: Optional[str] = None, **labels):
+        """记录一个 span，用作上下文管理器
+
+        Args:
+            name: span 名称
+            metric: 同时记录耗时的直方图指标名（可选），标签为 labels 加上 status（ok/error）
+            **labels: span 属性（同时作为指标标签）
+
+        Returns:
+            上下文管理器，进入时返回 Span（埋点关闭时返回不做任何事的对象）
+        """
+        if not self.enabled:
+            return _NOOP_SCOPE
+        return _SpanScope(self, name, metric, labels)
+
+    def _finish(self, span: Span, metric: Optional[str], labels: Dict, duration: float) -> None:
+        if metric is not None:
+            self.metrics.observe(metric, duration, status=span.status, **labels)
+        for exporter in self.exporters:
+            try:
+                exporter(span)
+            except Exception:
+                # 导出失败不影响业务调用
+                self.metrics.inc("skills_span_export_errors_total", exporter=type(exporter).__name__)
+
+
+# 本进程的埋点状态
+instrumentation = Instrumentation()
+
+
+def span(name: str, metric: Optional[str] = None, **labels):
+    """在本进程的埋点状态上记录 span，见 Instrumentation.span"""
+    return instrumentation.span(name, metric, **labels)
+
+
+def enable(exporters: Optional[Iterable[Callable[[Span], None]]] = None) -> Instrumentation:
+    """启用埋点
+
+    Args:
+        exporters: span 导出器（接收结束的 Span 的可调用对象），提供时替换已有的导出器
+
+    Returns:
+        本进程的埋点状态
+    """
+    if exporters is not None:
+        instrumentation.exporters = list(exporters)
+    instrumentation.enabled = True
+    return instrumentation
+
+
+def disable() -> None:
+    """关闭埋点（已记录的指标保留）"""
+    instrumentation.enabled = False
+
+
+def instrument_class(cls, component: str, metric: str = "skills_db_call_seconds", exclude: Iterable[str] = ()):
+    """为类的公开方法（同步和协程）添加埋点：每次调用记录一个 span 和耗时指标
+
+    埋点关闭时包装函数只检查一次开关后直接调用原方法。
+
+    Args:
+        cls: 要添加埋点的类
+        component: 组件名称，作为 span 名称前缀和指标的 component 标签
+        metric: 耗时直方图指标名
+        exclude: 不添加埋点的方法名
+
+    Returns:
+        cls（可用作类装饰器）
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or name in exclude or not inspect.isfunction(func):
+            continue
+        if not getattr(func, "__instrumented__", False):
+            setattr(cls, name, _instrument_function(func, f"{component}.{name}", metric, component, name))
+    return cls
+
+
+def _instrument_function(func, span_name: str, metric: str, component: str, method: str):
+    """返回记录 span 和耗时指标的包装函数"""
+    state = instrumentation
+    labels = {"component": component, "method": method}
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not state.enabled:
+                return await func(*args, **kwargs)
+            with _SpanScope(state, span_name, metric, labels):
+                return await func(*args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not state.enabled:
+                return func(*args, **kwargs)
+            with _SpanScope(state, span_name, metric, labels):
+                return func(*args, **kwargs)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+# ========== 缓存和连接池指标 ==========
+
+_tracked_caches: List[Tuple[str, weakref.ref]] = []
+_tracked_lock = threading.Lock()
+
+
+def track_cache(kind: str, cache) -> None:
+    """登记缓存，导出指标时读取其 stats()（hits, misses, size）
+
+    Args:
+        kind: 缓存类型，作为 cache 标签（同类缓存的统计相加）
+        cache: 有 stats() 方法的缓存对象（弱引用，缓存被回收后不再统计）
+    """
+    with _tracked_lock:
+        _tracked_caches[:] = [(k, ref) for k, ref in _tracked_caches if ref() is not None]
+        _tracked_caches.append((kind, weakref.ref(cache)))
+
+
+def _collect_caches():
+    with _tracked_lock:
+        caches = [(kind, ref()) for kind, ref in _tracked_caches]
+    for kind, cache in caches:
+        if cache is None:
+            continue
+        stats = cache.stats()
+        yield "skills_cache_hits_total", {"cache": kind}, stats.get("hits", 0) + stats.get("shared_hits", 0)
+        yield "skills_cache_misses_total", {"cache": kind}, stats.get("misses", 0)
+        yield "skills_cache_entries", {"cache": kind}, stats.get("size", 0)
+
+
+def _collect_pools():
+    from engine_registry import get_pool_stats
+
+    for url, stats in get_pool_stats().items():
+        labels = {"database": url}
+        yield "skills_db_pool_checkouts_total", labels, stats.get("checkouts", 0)
+        yield "skills_db_pool_timeouts_total", labels, stats.get("timeouts", 0)
+        yield "skills_db_pool_wait_seconds_total", labels, stats.get("total_wait_ms", 0.0) / 1000
+        yield "skills_db_pool_max_wait_seconds", labels, stats.get("max_wait_ms", 0.0) / 1000
+        if "checked_out" in stats:
+            yield "skills_db_pool_checked_out", labels, stats["checked_out"]
+
+
+instrumentation.metrics.add_collector(_collect_caches)
+instrumentation.metrics.add_collector(_collect_pools)
+
+
+def render_prometheus() -> str:
+    """导出本进程的指标（Prometheus 文本格式）"""
+    return instrumentation.metrics.render()
+
+
+# ========== span 导出器 ==========
+
+class SpanBuffer:
+    """在内存中保留最近的 span（用于调试和测试）"""
+
+    def __init__(self, max_spans: int = 1000):
+        self.max_spans = max_spans
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+            if len(self._spans) > self.max_spans:
+                del self._spans[:len(self._spans) - self.max_spans]
+
+    def spans(self) -> List[Span]:
+        """返回保留的 span（按结束顺序）"""
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+
+class JsonLinesSpanExporter:
+    """把 span 以 OTLP JSON 风格逐行追加到文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetrySpanExporter:
+    """把 span 转发给 opentelemetry SDK（需要安装 opentelemetry-api，并由应用配置 TracerProvider）
+
+    span 在结束时才转发，父子关系通过属性 skills.trace_id / skills.span_id / skills.parent_span_id 记录。
+    """
+
+    def __init__(self, tracer_name: str = "db-driven-llm-skills"):
+        try:
+            from opentelemetry import trace
+            from opentelemetry.trace import Status, StatusCode
+        except ImportError as e:
+            raise ImportError("OpenTelemetrySpanExporter 需要安装 opentelemetry-api: pip install opentelemetry-api") from e
+        self._tracer = trace.get_tracer(tracer_name)
+        self._error_status = lambda message: Status(StatusCode.ERROR, message)
+
+    def __call__(self, span: Span) -> None:
+        attributes = {
+            key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in span.attributes.items()
+        }
+        attributes.update({
+            "skills.trace_id": span.trace_id,
+            "skills.span_id": span.span_id,
+            "skills.parent_span_id": span.parent_span_id or "",
+        })
+        otel_span = self._tracer.start_span(
+            span.name, start_time=span.start_time_unix_nano, attributes=attributes
+        )
+        if span.status == "error":
+            otel_span.set_status(self._error_status(span.error or ""))
+        otel_span.end(end_time=span.end_time_unix_nano)
+
+
+def exporters_from_env() -> List[Callable[[Span], None]]:
+    """按环境变量 TRACE_EXPORTER 创建 span 导出器
+
+    TRACE_EXPORTER 取值：none（默认）、memory（SpanBuffer）、jsonl（写入 TRACE_FILE，默认为 spans.jsonl）、
+    otel（OpenTelemetrySpanExporter），多个用逗号分隔。
+    """
+    exporters = []
+    for name in os.getenv("TRACE_EXPORTER", "none").split(","):
+        name = name.strip().lower()
+        if name == "memory":
+            exporters.append(SpanBuffer())
+        elif name == "jsonl":
+            exporters.append(JsonLinesSpanExporter(os.getenv("TRACE_FILE", "spans.jsonl")))
+        elif name == "otel":
+            exporters.append(OpenTelemetrySpanExporter())
+        elif name not in ("", "none"):
+            raise ValueError(f"不支持的 TRACE_EXPORTER: {name}")
+    return exporters
+
+
+def configure_from_env() -> Instrumentation:
+    """按环境变量 INSTRUMENTATION_ENABLED 和 TRACE_EXPORTER 配置埋点（模块导入时调用一次）"""
+    if env_bool("INSTRUMENTATION_ENABLED", "false"):
+        enable(exporters_from_env())
+    return instrumentation
+
+
+# ========== 指标服务 ==========
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> ThreadingHTTPServer:
+    """在后台线程启动 HTTP 服务，在 /metrics 提供 Prometheus 指标
+
+    Args:
+        port: 端口，如果不提供则从环境变量 METRICS_PORT 读取，默认为 9464
+        host: 监听地址，如果不提供则从环境变量 METRICS_HOST 读取，默认为 "127.0.0.1"
+
+    Returns:
+        HTTP 服务（调用 shutdown() 停止）
+    """
+    if port is None:
+        port = int(os.getenv("METRICS_PORT", "9464"))
+    if host is None:
+        host = os.getenv("METRICS_HOST", "127.0.0.1")
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+configure_from_env()
@@ -2,82 +2,242 @@
 从 skill-example 文件夹加载技能的工具函数
 """
 
+import hashlib
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 
-def load_skill_from_directory(skill_dir: str) -> Tuple[Dict, str, Optional[Dict], Optional[Dict]]:
-    """从技能目录加载技能文件
-    
+SkillData = Tuple[Dict, str, Optional[Dict], Optional[Dict]]
+
+
+def parse_skill_files(read: Callable[[str], Optional[str]], location: str) -> SkillData:
+    """解析技能目录中的文件
+
     Args:
-        skill_dir: 技能目录路径（例如：skill-example/data_analysis）
-        
+        read: 读取函数，参数为目录内的文件名，返回文件文本，文件不存在时返回 None
+        location: 技能目录路径（用于错误信息）
+
     Returns:
         (skill_json, content, examples, metadata) 元组
     """
-    skill_path = Path(skill_dir)
-    
     # 加载 skill.json
-    skill_json_path = skill_path / "skill.json"
-    if not skill_json_path.exists():
-        raise FileNotFoundError(f"skill.json 不存在: {skill_json_path}")
-    
-    with open(skill_json_path, 'r', encoding='utf-8') as f:
-        skill_json = json.load(f)
-    
+    skill_json_text = read("skill.json")
+    if skill_json_text is None:
+        raise FileNotFoundError(f"skill.json 不存在: {location}/skill.json")
+    skill_json = json.loads(skill_json_text)
+
     # 加载 content.md
     content_file = skill_json.get("content_file", "content.md")
-    content_path = skill_path / content_file
-    if not content_path.exists():
-        raise FileNotFoundError(f"内容文件不存在: {content_path}")
-    
-    with open(content_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
+    content = read(content_file)
+    if content is None:
+        raise FileNotFoundError(f"内容文件不存在: {location}/{content_file}")
+
     # 加载 examples.json（可选）
     examples = None
     examples_file = skill_json.get("examples_file")
     if examples_file:
-        examples_path = skill_path / examples_file
-        if examples_path.exists():
-            with open(examples_path, 'r', encoding='utf-8') as f:
-                examples = json.load(f)
-    
+        examples_text = read(examples_file)
+        if examples_text is not None:
+            examples = json.loads(examples_text)
+
     # 加载 metadata.json（可选）
     metadata = None
-    metadata_path = skill_path / "metadata.json"
-    if metadata_path.exists():
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-    
+    metadata_text = read("metadata.json")
+    if metadata_text is not None:
+        metadata = json.loads(metadata_text)
+
     return skill_json, content, examples, metadata
 
 
-def load_all_skills_from_example_dir(example_dir: str = "skill-example") -> Dict[str, Tuple[Dict, str, Optional[Dict], Optional[Dict]]]:
-    """从 skill-example 目录加载所有技能
-    
+def decode_text(data: bytes) -> str:
+    """将文件内容解码为文本（UTF-8，换行符统一为 \\n，与文本模式读取一致）"""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _file_reader(skill_path: Path, hasher=None) -> Callable[[str], Optional[str]]:
+    """返回读取技能目录中文件的函数，可同时把读到的内容计入 hash"""
+    def read(name: str) -> Optional[str]:
+        try:
+            with open(skill_path / name, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if hasher is not None:
+            hasher.update(name.encode('utf-8') + b'\0' + data + b'\0')
+        return decode_text(data)
+    return read
+
+
+def load_skill_from_directory(skill_dir: str) -> SkillData:
+    """从技能目录加载技能文件
+
     Args:
-        example_dir: skill-example 目录路径
-        
+        skill_dir: 技能目录路径（例如：skill-example/data_analysis）
+
     Returns:
-        字典，key 为技能目录名，value 为 (skill_json, content, examples, metadata) 元组
+        (skill_json, content, examples, metadata) 元组
+    """
+    skill_path = Path(skill_dir)
+    return parse_skill_files(_file_reader(skill_path), str(skill_path))
+
+
+class SkillManifest:
+    """技能目录清单
+
+    记录每个技能目录中文件的 mtime/size 和内容 hash，保存为 JSON 文件。
+    文件的 mtime/size 未变化时直接跳过该目录；变化了但内容 hash 相同时也跳过。
+
+    新加载的目录先暂存（stage），调用方确认导入成功后调用 confirm() 才计入清单，
+    未确认的目录（导入失败或中途停止）下次会重新加载。
+    """
+
+    def __init__(self, path: str):
+        """加载清单文件（不存在时为空清单）
+
+        Args:
+            path: 清单文件路径
+        """
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self.staged: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"警告: 读取技能清单 {path} 失败，将重新加载所有技能: {str(e)}")
+
+    def get(self, name: str) -> Optional[Dict]:
+        """获取技能目录的清单记录"""
+        return self.entries.get(name)
+
+    def record(self, name: str, files: List, content_hash: str) -> None:
+        """记录技能目录的文件状态和内容 hash"""
+        self.entries[name] = {"files": files, "hash": content_hash}
+
+    def stage(self, name: str, files: List, content_hash: str) -> None:
+        """暂存新加载的技能目录的文件状态和内容 hash（confirm() 后才计入清单）"""
+        self.staged[name] = {"files": files, "hash": content_hash}
+
+    def confirm(self, name: str) -> None:
+        """确认技能目录已成功导入，把暂存的记录计入清单"""
+        entry = self.staged.pop(name, None)
+        if entry is not None:
+            self.entries[name] = entry
+
+    def forget(self, name: str) -> None:
+        """删除技能目录的记录（例如加载失败，下次需要重新加载）"""
+        self.entries.pop(name, None)
+        self.staged.pop(name, None)
+
+    def save(self) -> None:
+        """写入清单文件（先写临时文件再替换，避免中断时损坏）"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def _stat_files(skill_path: str) -> List:
+    """返回技能目录中各文件的 [文件名, mtime_ns, size]，按文件名排序"""
+    files = []
+    with os.scandir(skill_path) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append([entry.name, stat.st_mtime_ns, stat.st_size])
+    files.sort()
+    return files
+
+
+def _load_skill_job(skill_path: str, previous: Optional[Dict]):
+    """线程池任务：加载单个技能目录
+
+    Returns:
+        (技能数据, 文件状态, 内容 hash)，未变化时技能数据为 None
     """
-    skills = {}
-    example_path = Path(example_dir)
-    
-    if not example_path.exists():
-        return skills
-    
-    # 遍历所有子目录
-    for skill_dir in example_path.iterdir():
-        if skill_dir.is_dir() and (skill_dir / "skill.json").exists():
+    files = _stat_files(skill_path)
+    if previous and previous.get("files") == files:
+        return None, files, previous["hash"]
+
+    hasher = hashlib.sha256()
+    skill_data = parse_skill_files(_file_reader(Path(skill_path), hasher), skill_path)
+    content_hash = hasher.hexdigest()
+    if previous and previous.get("hash") == content_hash:
+        return None, files, content_hash
+    return skill_data, files, content_hash
+
+
+def iter_skills_from_dir(
+    example_dir: str = "skill-example",
+    max_workers: int = 8,
+    manifest: Optional[SkillManifest] = None
+) -> Iterator[Tuple[str, SkillData]]:
+    """并行加载目录下的所有技能，按完成顺序逐个返回
+
+    技能目录在线程池中读取，同时在途的目录数受限，内存占用不随技能总数增长。
+    提供 manifest 时跳过自上次加载以来未变化的技能目录；返回的技能只在清单中暂存，
+    调用方导入成功后应调用 manifest.confirm(技能目录名)，全部处理完后调用 manifest.save()。
+
+    Args:
+        example_dir: skill-example 目录路径
+        max_workers: 读取技能目录的线程数
+        manifest: 技能目录清单（可选）
+
+    Yields:
+        (技能目录名, (skill_json, content, examples, metadata))
+    """
+    if not os.path.isdir(example_dir):
+        return
+
+    max_in_flight = max_workers * 4
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            name = pending.pop(future)
             try:
-                skill_data = load_skill_from_directory(str(skill_dir))
-                skills[skill_dir.name] = skill_data
+                skill_data, files, content_hash = future.result()
             except Exception as e:
-                print(f"警告: 加载技能 {skill_dir.name} 失败: {str(e)}")
-    
-    return skills
+                print(f"警告: 加载技能 {name} 失败: {str(e)}")
+                if manifest is not None:
+                    manifest.forget(name)
+                continue
+            if skill_data is None:
+                # 内容与清单中已导入的版本相同，只更新文件状态
+                if manifest is not None:
+                    manifest.record(name, files, content_hash)
+                continue
+            # 由调用方确认导入成功后才计入清单
+            if manifest is not None:
+                manifest.stage(name, files, content_hash)
+            yield name, skill_data
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with os.scandir(example_dir) as it:
+            for entry in it:
+                if not entry.is_dir() or not os.path.exists(os.path.join(entry.path, "skill.json")):
+                    continue
+                previous = manifest.get(entry.name) if manifest is not None else None
+                pending[executor.submit(_load_skill_job, entry.path, previous)] = entry.name
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from collect(done)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from collect(done)
+
 
+def load_all_skills_from_example_dir(example_dir: str = "skill-example") -> Dict[str, SkillData]:
+    """从 skill-example 目录加载所有技能
+
+    Args:
+        example_dir: skill-example 目录路径
+
+    Returns:
+        字典，key 为技能目录名，value 为 (skill_json, content, examples, metadata) 元组
+    """
+    return dict(iter_skills_from_dir(example_dir))
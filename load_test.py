@@ -0,0 +1,460 @@
+"""
+并发批量运行和压力测试
+把 JSONL 格式的请求负载并发地发送给 agent（线程或 asyncio），可对模型调用限流，
+统计吞吐量和延迟分位数，并把每个请求的耗时拆分为数据库、中间件、工具、模型和限流等待时间
+
+负载文件每行一个请求：
+    {"query": "帮我分析一下这份销售数据"}
+    {"query": "继续", "thread_id": "user-1", "agent": "default_agent"}
+
+- query: 用户消息（必需）
+- agent: 角色名称（可选，默认为 --agent）
+- thread_id: 会话ID（可选），同一会话的请求按文件顺序依次发送；不提供时每个请求是独立的会话
+
+用法:
+    python load_test.py --workload workload.example.jsonl --fake --concurrency 16
+    python load_test.py --workload workload.jsonl --mode asyncio --concurrency 32 --rate 5 --burst 10
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+
+import instrumentation
+from db_utils import DatabaseManager
+from async_db_utils import AsyncDatabaseManager
+from create_agent import create_checkpointer, create_skills_agent
+from fake_chat_model import FakeChatModel
+from benchmark import environment_info, summarize
+
+load_dotenv()
+
+
+# 耗时拆分的类别（other 为请求总耗时减去其他类别，主要是 LangGraph 调度和检查点读写）
+BREAKDOWN_CATEGORIES = ("db", "middleware", "tool", "model", "rate_limit_wait", "other")
+
+
+class TokenBucket:
+    """令牌桶限流（线程安全）
+
+    每次请求预约一个令牌并返回需要等待的时间，令牌不足时按预约顺序排队，
+    同步调用方 sleep、异步调用方 await asyncio.sleep 即可。
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """初始化
+
+        Args:
+            rate: 每秒补充的令牌数（请求数/秒）
+            burst: 桶容量（允许的突发请求数），默认为 max(1, rate)
+        """
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """预约一个令牌
+
+        Returns:
+            获得令牌前需要等待的秒数（0 表示立即可用）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+
+class RateLimitMiddleware(AgentMiddleware):
+    """每次模型调用前从令牌桶获取令牌（等待时间记录为 rate_limit.wait span）"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+
+    def wrap_model_call(
+        self,
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        """同步：限流后调用模型"""
+        wait = self.bucket.reserve()
+        if wait > 0:
+            with instrumentation.span("rate_limit.wait"):
+                time.sleep(wait)
+        return handler(request)
+
+    async def awrap_model_call(self, request: ModelRequest, handler) -> ModelResponse:
+        """异步：限流后调用模型"""
+        wait = self.bucket.reserve()
+        if wait > 0:
+            with instrumentation.span("rate_limit.wait"):
+                await asyncio.sleep(wait)
+        return await handler(request)
+
+
+def load_workload(path: str, default_agent: str) -> List[Dict]:
+    """读取 JSONL 负载文件（空行和 # 开头的行会被忽略）
+
+    Args:
+        path: 文件路径
+        default_agent: 未指定 agent 的请求使用的角色名称
+
+    Returns:
+        请求列表，每项包含 index, agent, query, thread_id
+    """
+    workload = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = json.loads(line)
+            if not record.get("query"):
+                raise ValueError(f"{path} 第 {line_no} 行缺少 query")
+            workload.append({
+                "index": len(workload),
+                "agent": record.get("agent") or default_agent,
+                "query": record["query"],
+                "thread_id": record.get("thread_id"),
+            })
+    return workload
+
+
+def group_conversations(workload: Sequence[Dict], run_id: str) -> List[List[Dict]]:
+    """按会话分组：同一 thread_id 的请求在同一组内按顺序执行，其余请求各自一组
+
+    thread_id 加上本次运行的ID，不同次运行和不同角色之间的会话互不影响。
+    """
+    groups: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+    for record in workload:
+        if record["thread_id"] is None:
+            key = ("request", record["index"])
+            thread_id = f"{run_id}-{record['index']}"
+        else:
+            key = ("thread", record["agent"], record["thread_id"])
+            thread_id = f"{run_id}-{record['agent']}-{record['thread_id']}"
+        groups.setdefault(key, []).append({**record, "thread_id": thread_id})
+    return list(groups.values())
+
+
+class SpanCollector:
+    """按 trace 收集 span，请求结束后计算耗时拆分"""
+
+    def __init__(self):
+        self._traces: Dict[str, List[instrumentation.Span]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, span: instrumentation.Span) -> None:
+        with self._lock:
+            self._traces.setdefault(span.trace_id, []).append(span)
+
+    def pop(self, trace_id: str) -> List[instrumentation.Span]:
+        with self._lock:
+            return self._traces.pop(trace_id, [])
+
+
+def _category(span: instrumentation.Span) -> Optional[str]:
+    name = span.name
+    if name.startswith(("DatabaseManager.", "AsyncDatabaseManager.")):
+        return "db"
+    if name.startswith("SkillMiddleware."):
+        return "middleware"
+    if name.startswith("tool."):
+        return "tool"
+    if name == "model.call":
+        return "model"
+    if name == "rate_limit.wait":
+        return "rate_limit_wait"
+    return None
+
+
+def breakdown(spans: Iterable[instrumentation.Span], total: float) -> Dict[str, float]:
+    """把一个请求的耗时拆分到各类别（秒）
+
+    每个类别只计自身时间：嵌套在中间件或工具中的数据库调用计入 db，
+    嵌套在数据库方法中的数据库方法不重复计算。
+
+    Args:
+        spans: 请求的所有 span
+        total: 请求总耗时（秒）
+
+    Returns:
+        类别 -> 秒数（类别见 BREAKDOWN_CATEGORIES）
+    """
+    spans = list(spans)
+    by_id = {span.span_id: span for span in spans}
+    result = dict.fromkeys(BREAKDOWN_CATEGORIES, 0.0)
+    for span in spans:
+        category = _category(span)
+        if category is None:
+            continue
+        # 找到最近的已分类祖先
+        parent = by_id.get(span.parent_span_id)
+        while parent is not None and _category(parent) is None:
+            parent = by_id.get(parent.parent_span_id)
+        parent_category = _category(parent) if parent is not None else None
+        if parent_category == category:
+            continue
+        duration = span.duration_seconds or 0.0
+        result[category] += duration
+        if parent_category is not None:
+            result[parent_category] -= duration
+    result["other"] = max(0.0, total - sum(result[c] for c in BREAKDOWN_CATEGORIES if c != "other"))
+    return result
+
+
+class LoadTestRunner:
+    """把请求负载并发地发送给 agent"""
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        mode: str = "threads",
+        concurrency: int = 8,
+        rate: float = 0.0,
+        burst: Optional[int] = None,
+        llm_factory: Optional[Callable[[], object]] = None,
+        model_name: Optional[str] = None,
+        timeout: Optional[float] = None
+    ):
+        """初始化
+
+        Args:
+            db_manager: 数据库管理器（所有 agent 共用）
+            mode: 并发方式，"threads"（线程池 + agent.invoke）或 "asyncio"（协程 + agent.ainvoke）
+            concurrency: 同时进行的会话数
+            rate: 模型调用限流（每秒请求数），0 表示不限流
+            burst: 限流令牌桶容量，默认为 max(1, rate)
+            llm_factory: 创建聊天模型的无参函数（可选），不提供时按环境变量创建 ChatOpenAI
+            model_name: 模型名称（不使用 llm_factory 时有效），见 create_skills_agent
+            timeout: 单个请求的超时时间（秒，仅 asyncio 模式），不提供则不限制
+        """
+        if mode not in ("threads", "asyncio"):
+            raise ValueError(f"不支持的 mode: '{mode}'，可选值为 threads、asyncio")
+        self.db_manager = db_manager
+        self.mode = mode
+        self.concurrency = concurrency
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.llm_factory = llm_factory
+        self.model_name = model_name
+        self.timeout = timeout
+        self.async_db_manager = AsyncDatabaseManager(db_manager.db_url) if mode == "asyncio" else None
+        self.checkpointer = create_checkpointer(db_manager, self.async_db_manager)
+        self.collector = SpanCollector()
+        self._agents: Dict[str, object] = {}
+
+    def _agent(self, agent_name: str):
+        agent = self._agents.get(agent_name)
+        if agent is None:
+            agent = self._agents[agent_name] = create_skills_agent(
+                agent_name,
+                model_name=self.model_name,
+                db_manager=self.db_manager,
+                llm=self.llm_factory() if self.llm_factory else None,
+                checkpointer=self.checkpointer,
+                async_db_manager=self.async_db_manager,
+                middleware=[RateLimitMiddleware(self.bucket)] if self.bucket else ()
+            )
+        return agent
+
+    def _result(self, record: Dict, root, total: float, error: Optional[BaseException]) -> Dict:
+        return {
+            "index": record["index"],
+            "agent": record["agent"],
+            "seconds": total,
+            "error": f"{type(error).__name__}: {error}" if error else None,
+            "breakdown": breakdown(self.collector.pop(root.trace_id), total),
+        }
+
+    def _run_sync(self, record: Dict) -> Dict:
+        agent = self._agent(record["agent"])
+        config = {"configurable": {"thread_id": record["thread_id"]}}
+        error = None
+        with instrumentation.span("loadtest.request", agent=record["agent"]) as root:
+            start = time.perf_counter()
+            try:
+                agent.invoke({"messages": [{"role": "user", "content": record["query"]}]}, config)
+            except Exception as e:
+                error = e
+            total = time.perf_counter() - start
+        return self._result(record, root, total, error)
+
+    async def _run_async(self, record: Dict) -> Dict:
+        agent = self._agent(record["agent"])
+        config = {"configurable": {"thread_id": record["thread_id"]}}
+        error = None
+        with instrumentation.span("loadtest.request", agent=record["agent"]) as root:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(
+                    agent.ainvoke({"messages": [{"role": "user", "content": record["query"]}]}, config),
+                    self.timeout
+                )
+            except Exception as e:
+                error = e
+            total = time.perf_counter() - start
+        return self._result(record, root, total, error)
+
+    def _run_threads(self, groups: List[List[Dict]]) -> List[Dict]:
+        def run_group(group):
+            return [self._run_sync(record) for record in group]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load-test") as pool:
+            return [result for results in pool.map(run_group, groups) for result in results]
+
+    async def _run_asyncio(self, groups: List[List[Dict]]) -> List[Dict]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for group in groups:
+            queue.put_nowait(group)
+        results = []
+
+        async def worker():
+            while not queue.empty():
+                for record in queue.get_nowait():
+                    results.append(await self._run_async(record))
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(groups)) or 1)))
+        finally:
+            await self.async_db_manager.dispose()
+        return results
+
+    def run(self, workload: Sequence[Dict]) -> Dict:
+        """运行负载
+
+        Args:
+            workload: load_workload() 返回的请求列表
+
+        Returns:
+            报告字典：请求数、失败数、总耗时、吞吐量、延迟分位数和耗时拆分
+        """
+        # 耗时拆分依赖埋点，创建 agent 之前启用（agent 创建时才会添加埋点中间件）
+        was_enabled = instrumentation.instrumentation.enabled
+        instrumentation.instrumentation.exporters.append(self.collector)
+        instrumentation.enable()
+        try:
+            groups = group_conversations(workload, uuid.uuid4().hex[:8])
+            # 先创建所有 agent，创建耗时不计入请求
+            for name in {record["agent"] for record in workload}:
+                self._agent(name)
+            start = time.perf_counter()
+            if self.mode == "asyncio":
+                results = asyncio.run(self._run_asyncio(groups))
+            else:
+                results = self._run_threads(groups)
+            elapsed = time.perf_counter() - start
+        finally:
+            instrumentation.instrumentation.exporters.remove(self.collector)
+            if not was_enabled:
+                instrumentation.disable()
+        return self.report(results, elapsed)
+
+    def report(self, results: List[Dict], elapsed: float) -> Dict:
+        """汇总请求结果"""
+        succeeded = [r for r in results if r["error"] is None]
+        report = {
+            "config": {
+                "mode": self.mode,
+                "concurrency": self.concurrency,
+                "rate": self.rate or None,
+                "burst": self.bucket.capacity if self.bucket else None,
+            },
+            "requests": len(results),
+            "errors": len(results) - len(succeeded),
+            "error_samples": [r["error"] for r in results if r["error"]][:10],
+            "seconds": elapsed,
+            "throughput_rps": len(succeeded) / elapsed if elapsed > 0 else None,
+            "latency": summarize([r["seconds"] for r in succeeded]) if succeeded else None,
+            "breakdown": {},
+        }
+        if succeeded:
+            total_time = sum(r["seconds"] for r in succeeded)
+            for category in BREAKDOWN_CATEGORIES:
+                samples = [r["breakdown"][category] for r in succeeded]
+                report["breakdown"][category] = {
+                    **summarize(samples),
+                    "share": sum(samples) / total_time if total_time > 0 else 0.0,
+                }
+        return report
+
+
+def _print_report(report: Dict) -> None:
+    print(f"\n请求数 {report['requests']}，失败 {report['errors']}，用时 {report['seconds']:.2f} 秒，"
+          f"吞吐量 {report['throughput_rps'] or 0:.2f} 请求/秒")
+    for sample in report["error_samples"]:
+        print(f"  失败: {sample}")
+    if report["latency"] is None:
+        return
+    latency = report["latency"]
+    print(f"延迟（毫秒）: p50 {latency['p50_ms']:.1f}  p95 {latency['p95_ms']:.1f}  p99 {latency['p99_ms']:.1f}")
+    print("\n耗时拆分".ljust(20) + "p50(ms)".rjust(10) + "p95(ms)".rjust(10) + "p99(ms)".rjust(10) + "占比".rjust(8))
+    for category, stats in report["breakdown"].items():
+        print(category.ljust(20) + f"{stats['p50_ms']:10.1f}{stats['p95_ms']:10.1f}{stats['p99_ms']:10.1f}"
+              f"{stats['share'] * 100:7.1f}%")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="把 JSONL 请求负载并发地发送给 agent，统计吞吐量和延迟")
+    parser.add_argument("--workload", required=True, help="JSONL 负载文件")
+    parser.add_argument("--agent", default="default_agent", help="未指定 agent 的请求使用的角色，默认 default_agent")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads", help="并发方式，默认 threads")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的会话数，默认 8")
+    parser.add_argument("--rate", type=float, default=0.0, help="模型调用限流（每秒请求数），默认 0 不限流")
+    parser.add_argument("--burst", type=int, default=None, help="限流令牌桶容量，默认为 max(1, rate)")
+    parser.add_argument("--repeat", type=int, default=1, help="负载重复次数，默认 1")
+    parser.add_argument("--timeout", type=float, default=None, help="单个请求的超时时间（秒，仅 asyncio 模式）")
+    parser.add_argument("--model", default=None, help="模型名称，默认从环境变量 MODEL_NAME 读取")
+    parser.add_argument("--fake", action="store_true", help="使用离线的 FakeChatModel（不访问模型服务）")
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="FakeChatModel 每次调用的模拟延迟（秒），默认 0.05")
+    parser.add_argument("--db-url", default=None, help="数据库连接 URL，默认从环境变量构建")
+    parser.add_argument("--output", default=None, help="报告 JSON 文件路径（可选）")
+    args = parser.parse_args(argv)
+
+    workload = load_workload(args.workload, args.agent)
+    if args.repeat > 1:
+        workload = [
+            {**record, "index": i * len(workload) + record["index"],
+             "thread_id": f"{record['thread_id']}-{i}" if record["thread_id"] else None}
+            for i in range(args.repeat) for record in workload
+        ]
+    if not workload:
+        raise SystemExit(f"{args.workload} 中没有请求")
+
+    db = DatabaseManager(args.db_url)
+    runner = LoadTestRunner(
+        db,
+        mode=args.mode,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        burst=args.burst,
+        llm_factory=(lambda: FakeChatModel(latency=args.fake_latency)) if args.fake else None,
+        model_name=args.model,
+        timeout=args.timeout
+    )
+    report = runner.run(workload)
+    report["config"].update({"workload": args.workload, "fake": args.fake, "repeat": args.repeat})
+    report["environment"] = environment_info(db.db_url)
+    _print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+模型响应缓存
+为确定性的模型调用（温度为 0）按完整输入精确匹配缓存模型返回的消息：进程内的 LRU 缓存层，
+可选的数据库共享层（model_responses 表）；缓存键包含角色技能目录的版本，技能变化后自动失效
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import select, delete, func, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from db_utils import DatabaseManager, ModelResponseRecord
+from async_db_utils import AsyncDatabaseManager
+from engine_registry import env_bool
+from instrumentation import track_cache
+
+
+RESPONSES = ModelResponseRecord.__table__
+
+GET_RESPONSE_STMT = (
+    select(RESPONSES.c.messages, RESPONSES.c.expires_at)
+    .where(RESPONSES.c.cache_key == bindparam("cache_key"), RESPONSES.c.expires_at > func.now())
+)
+
+_upsert_response = pg_insert(RESPONSES)
+UPSERT_RESPONSE_STMT = _upsert_response.on_conflict_do_update(
+    index_elements=[RESPONSES.c.cache_key],
+    set_={
+        "messages": _upsert_response.excluded.messages,
+        "expires_at": _upsert_response.excluded.expires_at,
+        "created_at": func.now(),
+    }
+)
+
+DELETE_EXPIRED_STMT = delete(RESPONSES).where(RESPONSES.c.expires_at <= func.now())
+
+# 删除角色在其他技能目录版本下缓存的响应
+DELETE_STALE_STMT = delete(RESPONSES).where(
+    RESPONSES.c.agent_name == bindparam("agent_name"),
+    RESPONSES.c.catalog_version != bindparam("catalog_version")
+)
+
+
+class CachedMessages(NamedTuple):
+    """缓存的模型响应（expires_at 为 Unix 时间戳）"""
+    agent_name: str
+    catalog_version: str
+    messages: List[Dict]
+    expires_at: float
+
+
+def catalog_digest(version: Optional[Sequence]) -> str:
+    """技能目录版本号（见 DatabaseManager.get_catalog_version）的摘要"""
+    return hashlib.sha256(json.dumps(list(version or ()), default=str).encode("utf-8")).hexdigest()
+
+
+def tool_digest(tool: Any) -> str:
+    """工具定义（名称、描述和参数 JSON Schema）的摘要，工具的任何定义变化时摘要随之变化"""
+    return hashlib.sha256(
+        json.dumps(tool, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def model_cache_key(
+    model_name: str,
+    temperature: Optional[float],
+    catalog_version: str,
+    system_message: Any,
+    messages: Sequence[Dict],
+    tools: Sequence[Dict] = (),
+    extra: Optional[Dict] = None
+) -> str:
+    """计算缓存键
+
+    Args:
+        model_name: 模型名称
+        temperature: 温度参数
+        catalog_version: 技能目录版本的摘要（见 catalog_digest()）
+        system_message: 系统消息内容（包括注入的技能列表）
+        messages: 消息列表，每项为消息的类型、内容、工具调用等（不包含消息ID）
+        tools: 提供给模型的工具定义（名称、描述和参数 JSON Schema，例如 OpenAI 工具格式），
+            按每个工具的摘要计入缓存键
+        extra: 其他影响模型输出的参数（tool_choice、模型参数等）
+
+    Returns:
+        SHA-256 十六进制字符串
+    """
+    payload = {
+        "model": model_name,
+        "temperature": temperature,
+        "catalog": catalog_version,
+        "system": system_message,
+        "messages": list(messages),
+        "tools": sorted(tool_digest(tool) for tool in tools),
+        "extra": extra or {},
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class ModelResponseCache:
+    """模型响应缓存
+
+    读取顺序为进程内 LRU 缓存、数据库共享层（设置了 db_manager 时）。
+    角色的技能目录版本变化后，invalidate_agent() 删除该角色在旧版本下缓存的响应。
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+        db_manager: Optional[DatabaseManager] = None,
+        async_db_manager: Optional[AsyncDatabaseManager] = None,
+        prune_interval: float = 300.0
+    ):
+        """初始化缓存
+
+        Args:
+            max_size: 进程内缓存的最大条目数，如果不提供则从环境变量 MODEL_CACHE_SIZE 读取，
+                默认为 1024，0 表示不使用进程内缓存
+            ttl: 缓存时间（秒），如果不提供则从环境变量 MODEL_CACHE_TTL_SECONDS 读取，默认为 86400
+            db_manager: 数据库管理器（可选），提供时使用 model_responses 表作为多个进程共享的缓存层
+            async_db_manager: 异步数据库管理器（可选），提供时异步调用不会阻塞事件循环，
+                否则在线程池中访问共享缓存层
+            prune_interval: 清理数据库中过期响应的最小间隔（秒）
+        """
+        if max_size is None:
+            max_size = int(os.getenv("MODEL_CACHE_SIZE", "1024"))
+        if ttl is None:
+            ttl = float(os.getenv("MODEL_CACHE_TTL_SECONDS", "86400"))
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_manager = db_manager
+        self.async_db_manager = async_db_manager
+        self.prune_interval = prune_interval
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedMessages]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pruned_at = time.monotonic()
+        track_cache("model_response", self)
+
+    def set_database(
+        self,
+        db_manager: DatabaseManager,
+        async_db_manager: Optional[AsyncDatabaseManager] = None
+    ) -> None:
+        """设置数据库共享层（已设置时不变）"""
+        with self._lock:
+            if self.db_manager is None:
+                self.db_manager = db_manager
+                self.async_db_manager = async_db_manager
+
+    # ========== 进程内缓存层 ==========
+
+    def _get_local(self, key: str) -> Optional[CachedMessages]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _set_local(self, key: str, entry: CachedMessages) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _drop_local(self, agent_name: str, catalog_version: str) -> None:
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.agent_name == agent_name and entry.catalog_version != catalog_version:
+                    del self._entries[key]
+
+    def _entry(self, agent_name: str, catalog_version: str, messages: List[Dict]) -> CachedMessages:
+        return CachedMessages(agent_name, catalog_version, messages, time.time() + self.ttl)
+
+    # ========== 数据库共享层 ==========
+
+    def _shared_row(self, key: str, model_name: str, entry: CachedMessages) -> Dict[str, Any]:
+        return {
+            "cache_key": key,
+            "agent_name": entry.agent_name,
+            "model_name": model_name,
+            "catalog_version": entry.catalog_version,
+            "messages": entry.messages,
+            "expires_at": datetime.fromtimestamp(entry.expires_at, timezone.utc),
+        }
+
+    def _prune_due(self) -> bool:
+        return time.monotonic() - self._pruned_at >= self.prune_interval
+
+    # ========== 读取和写入 ==========
+
+    def _get_shared_row(self, key: str):
+        session = self.db_manager.get_session()
+        try:
+            return session.execute(GET_RESPONSE_STMT, {"cache_key": key}).first()
+        finally:
+            session.close()
+
+    def _shared_result(self, key: str, agent_name: str, catalog_version: str, row) -> Optional[List[Dict]]:
+        """处理共享缓存层的查询结果：命中时写入进程内缓存"""
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("shared_hits")
+        self._set_local(key, CachedMessages(agent_name, catalog_version, row.messages, row.expires_at.timestamp()))
+        return row.messages
+
+    def get(self, key: str, agent_name: str, catalog_version: str) -> Optional[List[Dict]]:
+        """读取缓存的响应
+
+        Args:
+            key: 缓存键（见 model_cache_key()）
+            agent_name: 角色名称
+            catalog_version: 技能目录版本的摘要
+
+        Returns:
+            缓存的消息字典列表，未命中时返回 None
+        """
+        entry = self._get_local(key)
+        if entry is not None:
+            self._count("hits")
+            return entry.messages
+        if self.db_manager is None:
+            self._count("misses")
+            return None
+        return self._shared_result(key, agent_name, catalog_version, self._get_shared_row(key))
+
+    async def aget(self, key: str, agent_name: str, catalog_version: str) -> Optional[List[Dict]]:
+        """get() 的异步版本"""
+        entry = self._get_local(key)
+        if entry is not None:
+            self._count("hits")
+            return entry.messages
+        if self.db_manager is None:
+            self._count("misses")
+            return None
+        if self.async_db_manager is None:
+            row = await asyncio.to_thread(self._get_shared_row, key)
+        else:
+            async with self.async_db_manager.get_session() as session:
+                row = (await session.execute(GET_RESPONSE_STMT, {"cache_key": key})).first()
+        return self._shared_result(key, agent_name, catalog_version, row)
+
+    def set(self, key: str, agent_name: str, catalog_version: str, model_name: str, messages: List[Dict]) -> None:
+        """缓存模型响应
+
+        Args:
+            key: 缓存键
+            agent_name: 角色名称
+            catalog_version: 技能目录版本的摘要
+            model_name: 模型名称
+            messages: 模型返回的消息字典列表
+        """
+        entry = self._entry(agent_name, catalog_version, messages)
+        self._set_local(key, entry)
+        if self.db_manager is None:
+            return
+        prune = self._prune_due()
+        if prune:
+            self._pruned_at = time.monotonic()
+        session = self.db_manager.get_session()
+        try:
+            session.execute(UPSERT_RESPONSE_STMT, self._shared_row(key, model_name, entry))
+            if prune:
+                session.execute(DELETE_EXPIRED_STMT)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    async def aset(self, key: str, agent_name: str, catalog_version: str, model_name: str, messages: List[Dict]) -> None:
+        """set() 的异步版本"""
+        if self.db_manager is not None and self.async_db_manager is None:
+            return await asyncio.to_thread(self.set, key, agent_name, catalog_version, model_name, messages)
+        entry = self._entry(agent_name, catalog_version, messages)
+        self._set_local(key, entry)
+        if self.db_manager is None:
+            return
+        prune = self._prune_due()
+        if prune:
+            self._pruned_at = time.monotonic()
+        async with self.async_db_manager.get_session() as session:
+            try:
+                await session.execute(UPSERT_RESPONSE_STMT, self._shared_row(key, model_name, entry))
+                if prune:
+                    await session.execute(DELETE_EXPIRED_STMT)
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+
+    def invalidate_agent(self, agent_name: str, catalog_version: str) -> int:
+        """删除角色在其他技能目录版本下缓存的响应（技能目录变化后调用）
+
+        Args:
+            agent_name: 角色名称
+            catalog_version: 当前技能目录版本的摘要（保留该版本的响应）
+
+        Returns:
+            数据库共享层中删除的响应数
+        """
+        self._drop_local(agent_name, catalog_version)
+        if self.db_manager is None:
+            return 0
+        session = self.db_manager.get_session()
+        try:
+            result = session.execute(DELETE_STALE_STMT, {"agent_name": agent_name, "catalog_version": catalog_version})
+            session.commit()
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    async def ainvalidate_agent(self, agent_name: str, catalog_version: str) -> int:
+        """invalidate_agent() 的异步版本"""
+        if self.db_manager is not None and self.async_db_manager is None:
+            return await asyncio.to_thread(self.invalidate_agent, agent_name, catalog_version)
+        self._drop_local(agent_name, catalog_version)
+        if self.db_manager is None:
+            return 0
+        async with self.async_db_manager.get_session() as session:
+            try:
+                result = await session.execute(
+                    DELETE_STALE_STMT, {"agent_name": agent_name, "catalog_version": catalog_version}
+                )
+                await session.commit()
+                return result.rowcount
+            except Exception as e:
+                await session.rollback()
+                raise e
+
+    def prune_expired(self) -> int:
+        """删除数据库共享层中过期的响应
+
+        Returns:
+            删除的响应数
+        """
+        if self.db_manager is None:
+            return 0
+        self._pruned_at = time.monotonic()
+        session = self.db_manager.get_session()
+        try:
+            result = session.execute(DELETE_EXPIRED_STMT)
+            session.commit()
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+    def clear(self) -> None:
+        """清空进程内缓存（不影响数据库共享层）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+            }
+
+
+_default_cache: Optional[ModelResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_model_cache(
+    db_manager: Optional[DatabaseManager] = None,
+    async_db_manager: Optional[AsyncDatabaseManager] = None
+) -> ModelResponseCache:
+    """获取本进程共享的模型响应缓存（配置从环境变量读取）
+
+    环境变量 MODEL_CACHE_SHARED 为 true（默认）且提供了 db_manager 时，
+    同时使用该数据库作为多个进程共享的缓存层（只在第一次设置）。
+
+    Args:
+        db_manager: 数据库管理器（可选）
+        async_db_manager: 异步数据库管理器（可选）
+
+    Returns:
+        模型响应缓存
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = ModelResponseCache()
+    if db_manager is not None and env_bool("MODEL_CACHE_SHARED", "true"):
+        _default_cache.set_database(db_manager, async_db_manager)
+    return _default_cache
@@ -0,0 +1,593 @@
+"""
+技能 API 调用
+把技能中启用的 API 调用配置（skill_api_calls）转换为 agent 工具，
+通过进程内共享的 HTTP 连接池（httpx，同步和异步）执行，支持按主机限制并发、超时、
+带抖动的指数退避重试和按端点熔断
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import random
+import re
+import string
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, urlsplit
+
+import httpx
+from langchain_core.tools import StructuredTool
+from dotenv import load_dotenv
+
+from api_cache import ApiResponseCache, cache_key, cache_ttl
+from engine_registry import env_bool
+
+load_dotenv()
+
+
+# 暂时性故障，可以重试的状态码
+RETRY_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# 不带请求体的 HTTP 方法（参数放在查询字符串中）
+QUERY_METHODS = frozenset({"GET", "DELETE", "HEAD", "OPTIONS"})
+
+# 工具返回给模型的响应内容最大字符数
+MAX_RESPONSE_CHARS = 8000
+
+_PATH_PARAM_RE = re.compile(r"\{(\w+)\}")
+
+
+class ApiCallError(Exception):
+    """API 调用失败（配置错误、熔断或重试后仍无法连接）"""
+
+
+class CircuitBreaker:
+    """单个 API 端点的熔断器
+
+    连续失败 failure_threshold 次后打开，reset_timeout 秒内的调用直接失败；
+    之后放行一个探测调用（半开状态），成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """初始化熔断器
+
+        Args:
+            failure_threshold: 打开熔断器的连续失败次数
+            reset_timeout: 熔断器打开后到放行探测调用的时间（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """熔断器状态：closed, open, half_open"""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def allow(self) -> bool:
+        """是否允许本次调用（半开状态下只放行一个探测调用）"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        """记录一次成功调用"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        """记录一次失败调用（连接失败、超时、5xx，或请求过程中抛出的其他异常）"""
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def _param_specs(params) -> List[Dict]:
+    """统一参数定义格式：字符串或 {"name", "type", "description"} 字典"""
+    specs = []
+    for param in params or []:
+        if isinstance(param, dict):
+            if param.get("name"):
+                specs.append(param)
+        else:
+            specs.append({"name": str(param)})
+    return specs
+
+
+def _check_url(url: str, allow_insecure: bool) -> None:
+    """检查 API URL（必须是 HTTPS，不允许 localhost 或内网 IP）"""
+    if allow_insecure:
+        return
+    parts = urlsplit(url)
+    if parts.scheme != "https":
+        raise ApiCallError(f"API URL 必须是 HTTPS: {url}")
+    host = (parts.hostname or "").lower()
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ApiCallError(f"不允许访问 localhost: {url}")
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return
+    if address.is_private or address.is_loopback or address.is_link_local or address.is_reserved:
+        raise ApiCallError(f"不允许访问内网地址: {url}")
+
+
+def _apply_auth(spec, headers: Dict[str, str], query: Dict[str, Any]):
+    """按 auth_type 和 auth_config 添加认证信息（密钥从环境变量读取），返回 httpx 的 auth 参数"""
+    auth_type = (spec.auth_type or "none").lower()
+    config = spec.auth_config or {}
+    if auth_type == "none":
+        return None
+
+    def secret(key: str, default_env: Optional[str] = None) -> str:
+        env_name = config.get(key) or default_env
+        value = os.getenv(env_name) if env_name else None
+        if not value:
+            raise ApiCallError(f"API {spec.api_name} 的认证信息未配置（环境变量 {env_name or key}）")
+        return value
+
+    if auth_type in ("bearer", "oauth2"):
+        # oauth2 使用预先获取的访问令牌
+        prefix = config.get("prefix", "Bearer ")
+        headers[config.get("header_name", "Authorization")] = f"{prefix}{secret('token_env')}"
+    elif auth_type == "api_key":
+        key = secret("key_env") if config.get("key_env") else secret("token_env")
+        if config.get("query_param"):
+            query[config["query_param"]] = key
+        else:
+            headers[config.get("header_name", "X-API-Key")] = key
+    elif auth_type == "basic":
+        return (secret("username_env"), secret("password_env"))
+    else:
+        raise ApiCallError(f"不支持的认证类型: {spec.auth_type}")
+    return None
+
+
+def build_request(spec, params: Dict[str, Any], allow_insecure: bool = False) -> Tuple[str, str, Dict]:
+    """根据 API 调用配置和参数构建请求
+
+    URL 中的 {name} 占位符由同名参数替换；GET/DELETE 等方法的其余参数放在查询字符串中，
+    其他方法使用 request_body_template（${name} 占位符替换为参数的 JSON 值，
+    未提供的可选参数为 null），没有模板时把参数作为 JSON 请求体。
+
+    Args:
+        spec: API 调用配置（ApiCallRecord 或 SkillApiCall）
+        params: 调用参数
+        allow_insecure: 是否允许 HTTP、localhost 和内网地址（仅用于测试）
+
+    Returns:
+        (method, url, httpx 请求参数) 元组
+    """
+    params = {k: v for k, v in params.items() if v is not None}
+    missing = [p["name"] for p in _param_specs(spec.required_params) if p["name"] not in params]
+    if missing:
+        raise ApiCallError(f"缺少必需参数: {', '.join(missing)}")
+
+    def path_param(match):
+        name = match.group(1)
+        if name not in params:
+            raise ApiCallError(f"缺少 URL 参数: {name}")
+        return quote(str(params.pop(name)), safe="")
+
+    url = _PATH_PARAM_RE.sub(path_param, spec.url)
+    _check_url(url, allow_insecure)
+
+    method = (spec.method or "GET").upper()
+    headers = {str(k): str(v) for k, v in (spec.request_headers or {}).items()}
+    query: Dict[str, Any] = {}
+    auth = _apply_auth(spec, headers, query)
+    kwargs: Dict[str, Any] = {"headers": headers}
+    if auth is not None:
+        kwargs["auth"] = auth
+
+    if method in QUERY_METHODS:
+        query.update(params)
+    elif spec.request_body_template:
+        names = [p["name"] for p in _param_specs(spec.required_params) + _param_specs(spec.optional_params)]
+        values = {name: "null" for name in names}
+        values.update({k: json.dumps(v, ensure_ascii=False) for k, v in params.items()})
+        kwargs["content"] = string.Template(spec.request_body_template).safe_substitute(values).encode("utf-8")
+        if not any(k.lower() == "content-type" for k in headers):
+            headers["Content-Type"] = "application/json"
+    else:
+        kwargs["json"] = params
+    if query:
+        kwargs["params"] = query
+    return method, url, kwargs
+
+
+def format_response(response: httpx.Response, max_chars: int = MAX_RESPONSE_CHARS) -> str:
+    """把响应转换为返回给模型的文本（状态码和响应内容，超长时截断）"""
+    text = response.text
+    if len(text) > max_chars:
+        text = f"{text[:max_chars]}\n...（响应已截断，共 {len(text)} 个字符）"
+    return f"HTTP {response.status_code}\n{text}"
+
+
+class ApiExecutor:
+    """API 调用执行器
+
+    同步和异步调用各使用一个共享的 httpx 客户端（连接保持复用），
+    每个主机的并发请求数受 per_host_limit 限制，每个端点（方法 + URL 模板）一个熔断器。
+    超时和重试次数取自 API 调用配置的 timeout_seconds 和 retry_count。
+    设置了响应缓存时，声明了 cache_ttl_seconds 的 API 先读取缓存（相同请求并发时只发出一次）。
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: float = 30.0,
+        per_host_limit: Optional[int] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        backoff_base: float = 0.2,
+        backoff_max: float = 5.0,
+        allow_insecure: Optional[bool] = None,
+        transport: Optional[httpx.BaseTransport] = None,
+        async_transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache: Optional[ApiResponseCache] = None
+    ):
+        """初始化执行器（HTTP 客户端在第一次调用时创建）
+
+        Args:
+            max_connections: 连接池最大连接数，如果不提供则从环境变量 SKILL_API_MAX_CONNECTIONS 读取，默认为 100
+            max_keepalive_connections: 保持的空闲连接数，如果不提供则从环境变量
+                SKILL_API_MAX_KEEPALIVE 读取，默认为 20
+            keepalive_expiry: 空闲连接的保持时间（秒）
+            per_host_limit: 每个主机的最大并发请求数，如果不提供则从环境变量 SKILL_API_PER_HOST_LIMIT 读取，
+                默认为 10，0 表示不限制
+            failure_threshold: 熔断器打开的连续失败次数
+            reset_timeout: 熔断器打开后到放行探测调用的时间（秒）
+            backoff_base: 重试退避的基础时间（秒），第 n 次重试最多等待 backoff_base * 2^n 秒
+            backoff_max: 重试退避的最长时间（秒）
+            allow_insecure: 是否允许 HTTP、localhost 和内网地址，如果不提供则从环境变量
+                SKILL_API_ALLOW_INSECURE 读取，默认为 false（仅用于本地测试）
+            transport: 同步客户端的 httpx 传输层（可选，用于测试）
+            async_transport: 异步客户端的 httpx 传输层（可选，用于测试）
+            cache: 响应缓存（可选），只缓存 response_format 中声明了 cache_ttl_seconds 的 API
+        """
+        if max_connections is None:
+            max_connections = int(os.getenv("SKILL_API_MAX_CONNECTIONS", "100"))
+        if max_keepalive_connections is None:
+            max_keepalive_connections = int(os.getenv("SKILL_API_MAX_KEEPALIVE", "20"))
+        if per_host_limit is None:
+            per_host_limit = int(os.getenv("SKILL_API_PER_HOST_LIMIT", "10"))
+        if allow_insecure is None:
+            allow_insecure = env_bool("SKILL_API_ALLOW_INSECURE", "false")
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.per_host_limit = per_host_limit
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.allow_insecure = allow_insecure
+        self._transport = transport
+        self._async_transport = async_transport
+        self.cache = cache
+
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._async_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    # ========== 共享资源 ==========
+
+    @property
+    def client(self) -> httpx.Client:
+        """共享的同步 HTTP 客户端"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(limits=self.limits, transport=self._transport)
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """共享的异步 HTTP 客户端（连接绑定在事件循环上，应在同一个事件循环中使用）"""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = httpx.AsyncClient(limits=self.limits, transport=self._async_transport)
+        return self._async_client
+
+    def breaker(self, spec) -> CircuitBreaker:
+        """返回 API 端点（方法 + URL 模板）的熔断器"""
+        key = ((spec.method or "GET").upper(), spec.url)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    key, CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                )
+        return breaker
+
+    def _host_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._host_semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host_limit))
+        return semaphore
+
+    def _async_host_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._async_host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._async_host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        return semaphore
+
+    def close(self) -> None:
+        """关闭同步 HTTP 客户端"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        """关闭异步 HTTP 客户端"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    # ========== 调用 ==========
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """第 attempt 次失败后的等待时间（全抖动指数退避，服务端给出 Retry-After 时不少于该值）"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("Retry-After", "")))
+            except ValueError:
+                pass
+        return min(delay, self.backoff_max)
+
+    def _prepare(self, spec, params: Dict[str, Any]):
+        method, url, kwargs = build_request(spec, params, self.allow_insecure)
+        parts = urlsplit(url)
+        host = f"{parts.hostname}:{parts.port or (443 if parts.scheme == 'https' else 80)}"
+        timeout = httpx.Timeout(float(spec.timeout_seconds or 30))
+        attempts = 1 + max(int(spec.retry_count or 0), 0)
+        return method, url, kwargs, host, timeout, attempts
+
+    def _record(self, breaker: CircuitBreaker, response: httpx.Response) -> bool:
+        """记录响应结果，返回是否需要重试"""
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response.status_code in RETRY_STATUS_CODES
+
+    def call(self, spec, params: Dict[str, Any]) -> httpx.Response:
+        """执行一次 API 调用（同步）
+
+        Args:
+            spec: API 调用配置（ApiCallRecord 或 SkillApiCall）
+            params: 调用参数
+
+        Returns:
+            最后一次请求的响应（重试后仍为可重试状态码时也返回该响应）
+
+        Raises:
+            ApiCallError: 配置错误、熔断器打开，或重试后仍无法完成请求
+        """
+        prepared = self._prepare(spec, params)
+        ttl = cache_ttl(spec)
+        if self.cache is None or ttl <= 0:
+            return self._send(spec, *prepared)
+        method, url, kwargs = prepared[:3]
+        return self.cache.get_or_fetch(
+            cache_key(spec, method, url, kwargs), spec.api_name, ttl, method, url,
+            lambda: self._send(spec, *prepared)
+        )
+
+    def _send(self, spec, method, url, kwargs, host, timeout, attempts) -> httpx.Response:
+        """发出请求（失败时按配置重试）"""
+        breaker = self.breaker(spec)
+        response = None
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise ApiCallError(f"API {spec.api_name} 暂时不可用（连续失败后已熔断），请稍后重试")
+            try:
+                if self.per_host_limit > 0:
+                    with self._host_semaphore(host):
+                        response = self.client.request(method, url, timeout=timeout, **kwargs)
+                else:
+                    response = self.client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                response = None
+                if attempt + 1 >= attempts:
+                    raise ApiCallError(f"API {spec.api_name} 请求失败: {type(e).__name__}: {e}") from e
+            except BaseException:
+                # 其他异常（无效 URL、请求头编码错误、任务被取消等）也要记录，否则半开状态的探测调用不会释放，
+                # 熔断器会一直拒绝调用
+                breaker.record_failure()
+                raise
+            else:
+                if not self._record(breaker, response) or attempt + 1 >= attempts:
+                    return response
+            time.sleep(self._backoff(attempt, response))
+        return response
+
+    async def acall(self, spec, params: Dict[str, Any]) -> httpx.Response:
+        """执行一次 API 调用（异步），参数和返回值同 call()"""
+        prepared = self._prepare(spec, params)
+        ttl = cache_ttl(spec)
+        if self.cache is None or ttl <= 0:
+            return await self._asend(spec, *prepared)
+        method, url, kwargs = prepared[:3]
+        return await self.cache.aget_or_fetch(
+            cache_key(spec, method, url, kwargs), spec.api_name, ttl, method, url,
+            lambda: self._asend(spec, *prepared)
+        )
+
+    async def _asend(self, spec, method, url, kwargs, host, timeout, attempts) -> httpx.Response:
+        """_send 的异步版本"""
+        breaker = self.breaker(spec)
+        response = None
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise ApiCallError(f"API {spec.api_name} 暂时不可用（连续失败后已熔断），请稍后重试")
+            try:
+                if self.per_host_limit > 0:
+                    async with self._async_host_semaphore(host):
+                        response = await self.async_client.request(method, url, timeout=timeout, **kwargs)
+                else:
+                    response = await self.async_client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                breaker.record_failure()
+                response = None
+                if attempt + 1 >= attempts:
+                    raise ApiCallError(f"API {spec.api_name} 请求失败: {type(e).__name__}: {e}") from e
+            except BaseException:
+                # 其他异常（无效 URL、请求头编码错误、任务被取消等）也要记录，否则半开状态的探测调用不会释放，
+                # 熔断器会一直拒绝调用
+                breaker.record_failure()
+                raise
+            else:
+                if not self._record(breaker, response) or attempt + 1 >= attempts:
+                    return response
+            await asyncio.sleep(self._backoff(attempt, response))
+        return response
+
+
+_default_executor: Optional[ApiExecutor] = None
+_default_lock = threading.Lock()
+
+
+def get_api_executor(db_manager=None, async_db_manager=None) -> ApiExecutor:
+    """获取本进程共享的 API 调用执行器（配置从环境变量读取）
+
+    执行器带有进程内的响应缓存；环境变量 SKILL_API_CACHE_SHARED 为 true 且提供了 db_manager 时，
+    响应缓存同时使用该数据库作为多个进程共享的缓存层（只在第一次设置）。
+
+    Args:
+        db_manager: 数据库管理器（可选）
+        async_db_manager: 异步数据库管理器（可选）
+
+    Returns:
+        API 调用执行器
+    """
+    global _default_executor
+    if _default_executor is None:
+        with _default_lock:
+            if _default_executor is None:
+                _default_executor = ApiExecutor(cache=ApiResponseCache())
+    if db_manager is not None and env_bool("SKILL_API_CACHE_SHARED", "false"):
+        _default_executor.cache.set_database(db_manager, async_db_manager)
+    return _default_executor
+
+
+# ========== 工具 ==========
+
+def api_tool_name(spec) -> str:
+    """API 调用对应的工具名称（只保留字母、数字、下划线和连字符）"""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", spec.api_name or "api")[:64]
+
+
+def api_args_schema(spec) -> Dict:
+    """API 调用参数的 JSON Schema"""
+    properties = {}
+    required = []
+    for param, is_required in (
+        [(p, True) for p in _param_specs(spec.required_params)]
+        + [(p, False) for p in _param_specs(spec.optional_params)]
+    ):
+        schema = {"description": param.get("description") or param["name"]}
+        if param.get("type"):
+            schema["type"] = param["type"]
+        properties[param["name"]] = schema
+        if is_required:
+            required.append(param["name"])
+    return {"type": "object", "properties": properties, "required": required}
+
+
+def create_api_tool(spec, executor: ApiExecutor, name: Optional[str] = None) -> StructuredTool:
+    """把一个 API 调用配置转换为工具
+
+    工具返回状态码和响应内容；调用失败时返回错误信息，由模型决定是否重试或换用其他方式。
+
+    Args:
+        spec: API 调用配置（ApiCallRecord）
+        executor: API 调用执行器
+        name: 工具名称，默认为 api_tool_name(spec)
+
+    Returns:
+        API 调用工具
+    """
+    def run(**params) -> str:
+        try:
+            return format_response(executor.call(spec, params))
+        except ApiCallError as e:
+            return f"API 调用失败: {e}"
+
+    async def arun(**params) -> str:
+        try:
+            return format_response(await executor.acall(spec, params))
+        except ApiCallError as e:
+            return f"API 调用失败: {e}"
+
+    description = spec.description or spec.api_name
+    if getattr(spec, "skill_name", None):
+        description = f"{description}（技能: {spec.skill_name}）"
+    return StructuredTool.from_function(
+        func=run,
+        coroutine=arun,
+        name=name or api_tool_name(spec),
+        description=description,
+        args_schema=api_args_schema(spec)
+    )
+
+
+def create_api_tools(api_calls: Sequence, executor: Optional[ApiExecutor] = None) -> List[StructuredTool]:
+    """为角色的 API 调用配置创建工具
+
+    工具名称重复时（不同技能中的同名 API）加上技能ID前缀，仍然重复时加上序号后缀。
+
+    Args:
+        api_calls: DatabaseManager.get_agent_api_calls() 返回的 API 调用配置
+        executor: API 调用执行器，默认为本进程共享的执行器
+
+    Returns:
+        工具列表
+    """
+    executor = executor or get_api_executor()
+    counts: Dict[str, int] = {}
+    for spec in api_calls:
+        counts[api_tool_name(spec)] = counts.get(api_tool_name(spec), 0) + 1
+    tools = []
+    used = set()
+    for spec in api_calls:
+        name = api_tool_name(spec)
+        if counts[name] > 1:
+            name = re.sub(r"[^A-Za-z0-9_-]", "_", f"{spec.skill_id}__{name}")[:64]
+        base, suffix = name, 2
+        while name in used:
+            name = f"{base[:60]}_{suffix}"
+            suffix += 1
+        used.add(name)
+        tools.append(create_api_tool(spec, executor, name))
+    return tools
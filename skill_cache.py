@@ -0,0 +1,123 @@
+"""
+技能目录缓存
+为 DatabaseManager 提供进程内、带版本号、容量受限的 LRU 缓存
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+# 缓存未命中标记（区别于被缓存的 None 结果）
+MISSING = object()
+
+
+class SkillCache:
+    """带版本号的 LRU 缓存
+
+    每次失效都会清空缓存并递增版本号。读取方在查询数据库前记录当前版本号，
+    写回时若版本号已变化（期间发生了失效），则丢弃该结果，避免旧数据回写。
+
+    其他进程的写入通过水位线发现：调用方在 watermark_due() 为真时查询数据库水位线，
+    并交给 update_watermark()，水位线变化时缓存失效。
+    """
+
+    def __init__(self, max_size: int = 1024, poll_interval: float = 5.0):
+        """初始化缓存
+
+        Args:
+            max_size: 最大缓存条目数，小于等于 0 表示禁用缓存
+            poll_interval: 检查水位线的间隔（秒），小于 0 表示不检查
+        """
+        self.max_size = max_size
+        self.poll_interval = poll_interval
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._watermark_checked_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """缓存是否启用"""
+        return self.max_size > 0
+
+    def get(self, key: Hashable) -> Any:
+        """读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的值，未命中时返回 MISSING
+        """
+        if not self.enabled:
+            return MISSING
+        with self._lock:
+            value = self._entries.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, version: int) -> None:
+        """写入缓存
+
+        Args:
+            key: 缓存键
+            value: 缓存的值
+            version: 读取数据前记录的缓存版本号
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def watermark_due(self) -> bool:
+        """是否到了检查水位线的时间"""
+        if not self.enabled or self.poll_interval < 0:
+            return False
+        return time.monotonic() - self._watermark_checked_at >= self.poll_interval
+
+    def update_watermark(self, watermark: Any) -> None:
+        """记录最新水位线，与上次不同时使缓存失效
+
+        Args:
+            watermark: 从数据库读取的水位线（可比较的值）
+        """
+        with self._lock:
+            changed = self._watermark is not None and watermark != self._watermark
+            self._watermark = watermark
+            self._watermark_checked_at = time.monotonic()
+        if changed:
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        """清空缓存并递增版本号"""
+        with self._lock:
+            self._entries.clear()
+            self.version += 1
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
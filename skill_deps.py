@@ -0,0 +1,135 @@
+"""
+技能依赖关系
+由 skill.json 中的 requirements.dependencies 构建依赖图，检测循环依赖和缺失的依赖，
+并计算传递闭包（保存在 skill_dependencies 表中，load_skill 一次查询读取技能及其全部依赖）
+"""
+
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+
+class DependencyError(ValueError):
+    """技能之间存在循环依赖"""
+
+    def __init__(self, cycle: Sequence[str]):
+        self.cycle = list(cycle)
+        super().__init__(f"技能存在循环依赖: {' -> '.join(self.cycle)}")
+
+
+def build_graph(edges: Iterable[Tuple[str, str]], nodes: Iterable[str] = ()) -> Dict[str, List[str]]:
+    """由 (技能ID, 依赖的技能ID) 构建依赖图
+
+    Args:
+        edges: 依赖关系
+        nodes: 没有依赖关系的其他技能ID
+
+    Returns:
+        技能ID 到其直接依赖（去重，保持顺序）的映射
+    """
+    graph: Dict[str, List[str]] = {node: [] for node in nodes}
+    for skill_id, dependency in edges:
+        targets = graph.setdefault(skill_id, [])
+        if dependency not in targets:
+            targets.append(dependency)
+    return graph
+
+
+def find_cycle(graph: Mapping[str, Sequence[str]]) -> Optional[List[str]]:
+    """查找依赖图中的一个环（依赖图外的节点视为没有依赖）
+
+    Args:
+        graph: 依赖图
+
+    Returns:
+        环上的技能ID（首尾相同，例如 ["a", "b", "a"]），没有环时返回 None
+    """
+    state: Dict[str, int] = {}  # 1: 正在访问（在当前路径上），2: 已访问完
+    for root in graph:
+        if state.get(root):
+            continue
+        path = [root]
+        stack = [iter(graph.get(root, ()))]
+        state[root] = 1
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                state[path.pop()] = 2
+                stack.pop()
+            elif state.get(node) == 1:
+                return path[path.index(node):] + [node]
+            elif not state.get(node):
+                state[node] = 1
+                path.append(node)
+                stack.append(iter(graph.get(node, ())))
+    return None
+
+
+def missing_dependencies(graph: Mapping[str, Sequence[str]], available: Iterable[str]) -> Dict[str, List[str]]:
+    """查找依赖了不存在（或不可用）技能的技能
+
+    Args:
+        graph: 依赖图
+        available: 可用的技能ID
+
+    Returns:
+        技能ID 到其缺失依赖的映射（只包含有缺失依赖的技能）
+    """
+    available = set(available)
+    missing = {}
+    for skill_id, dependencies in graph.items():
+        absent = [d for d in dependencies if d not in available]
+        if absent:
+            missing[skill_id] = absent
+    return missing
+
+
+def transitive_closure(graph: Mapping[str, Sequence[str]]) -> Dict[str, Dict[str, int]]:
+    """计算依赖图的传递闭包
+
+    深度为技能到依赖的最长路径长度，按深度从深到浅排列时每个依赖都在依赖它的技能之前。
+    图中有环时忽略使路径回到环上的依赖关系（只用于升级旧数据，正常导入时环会被拒绝）。
+
+    Args:
+        graph: 依赖图（不在图中的依赖会被忽略）
+
+    Returns:
+        技能ID 到 {直接或间接依赖的技能ID: 深度} 的映射，每个技能包含深度为 0 的自身
+    """
+    closure: Dict[str, Dict[str, int]] = {}
+    visiting = set()
+
+    def visit(node: str) -> Dict[str, int]:
+        if node in closure:
+            return closure[node]
+        visiting.add(node)
+        depths = {node: 0}
+        for dependency in graph[node]:
+            if dependency not in graph or dependency in visiting:
+                continue
+            for target, depth in visit(dependency).items():
+                if target != node and depths.get(target, -1) < depth + 1:
+                    depths[target] = depth + 1
+        visiting.discard(node)
+        closure[node] = depths
+        return depths
+
+    for root in graph:
+        visit(root)
+    return closure
+
+
+def resolve(graph: Mapping[str, Sequence[str]]) -> Dict[str, Dict[str, int]]:
+    """检查循环依赖并计算传递闭包
+
+    Args:
+        graph: 依赖图
+
+    Returns:
+        transitive_closure() 的结果
+
+    Raises:
+        DependencyError: 存在循环依赖
+    """
+    cycle = find_cycle(graph)
+    if cycle:
+        raise DependencyError(cycle)
+    return transitive_closure(graph)
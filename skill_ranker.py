@@ -0,0 +1,130 @@
+"""
+技能相关性排序
+在进程内为技能目录建立 BM25 词法索引，按用户消息选出最相关的技能
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+# 英文/数字按单词切分，中日韩文字按二元组（bigram）切分
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+_TOKEN_RE = re.compile(f"[a-z0-9_]+|[{_CJK_RANGES}]+")
+_CJK_RE = re.compile(f"[{_CJK_RANGES}]")
+
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为检索词
+
+    英文和数字按单词切分（小写）；连续的中日韩文字切分为相邻两字的二元组，
+    单个汉字保留为一个词。
+
+    Args:
+        text: 文本
+
+    Returns:
+        检索词列表
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if not _CJK_RE.match(run) or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的模型 token 数（每个中日韩文字约 1 个，其他字符约每 4 个 1 个）"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class SkillIndex:
+    """BM25 倒排索引
+
+    文档按构建时的顺序编号，检索结果按得分降序、得分相同时按编号升序，顺序稳定。
+    """
+
+    def __init__(self, documents: Iterable[str], k1: float = 1.5, b: float = 0.75):
+        """构建索引
+
+        Args:
+            documents: 文档文本（例如技能的名称、简短描述和标签）
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        for doc_id, text in enumerate(documents):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        size = len(self._lengths)
+        self._idf = {
+            term: math.log(1 + (size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def search(self, query: str, limit: int = 0) -> List[Tuple[int, float]]:
+        """检索与查询相关的文档
+
+        Args:
+            query: 查询文本
+            limit: 最多返回的结果数，0 表示不限制
+
+        Returns:
+            (文档编号, 得分) 列表，只包含得分大于 0 的文档
+        """
+        scores: Dict[int, float] = {}
+        k1, b, avg_length = self.k1, self.b, self._avg_length or 1.0
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_id, tf in postings:
+                norm = k1 * (1 - b + b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit > 0 else ranked
+
+
+def select_within_budget(
+    order: Sequence[int],
+    costs: Sequence[int],
+    max_items: int = 0,
+    token_budget: int = 0
+) -> List[int]:
+    """按顺序选取条目，直到达到数量上限或 token 预算
+
+    超出剩余预算的条目会被跳过，后面更短的条目仍可能被选中。
+
+    Args:
+        order: 候选条目编号，按优先顺序排列
+        costs: 每个条目的 token 数（按编号索引）
+        max_items: 最多选取的条目数，0 表示不限制
+        token_budget: token 预算，0 表示不限制
+
+    Returns:
+        选中的条目编号（保持 order 中的顺序）
+    """
+    selected = []
+    used = 0
+    for i in order:
+        if max_items > 0 and len(selected) >= max_items:
+            break
+        if token_budget > 0 and used + costs[i] > token_budget:
+            continue
+        selected.append(i)
+        used += costs[i]
+    return selected
@@ -0,0 +1,112 @@
+"""
+技能内容分节
+按 Markdown 标题将技能内容（content.md）切分为章节，供 load_skill 按章节加载
+"""
+
+import re
+from typing import Dict, List, Optional, Sequence
+
+from skill_ranker import estimate_tokens
+
+
+# ATX 标题：行首最多 3 个空格，1-6 个 #，后跟空格和标题文字（末尾的 # 可省略）
+_HEADING_RE = re.compile(r"^ {0,3}(#{1,6})[ \t]+(.+?)(?:[ \t]+#+)?[ \t]*$")
+# 围栏代码块的开始/结束行（``` 或 ~~~）
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# 锚点中保留的字符：字母、数字、下划线、连字符和中日韩文字
+_ANCHOR_STRIP_RE = re.compile(r"[^\w\- ]+")
+
+
+def make_anchor(title: str) -> str:
+    """由标题生成锚点（小写，去掉标点，空格替换为连字符）"""
+    anchor = _ANCHOR_STRIP_RE.sub("", title.strip().lower())
+    return re.sub(r"\s+", "-", anchor.strip()) or "section"
+
+
+def parse_sections(content: str) -> List[Dict]:
+    """按标题切分技能内容
+
+    每个章节从标题行开始，到下一个同级或更高级标题之前结束（包含其子章节）。
+    围栏代码块中以 # 开头的行不视为标题。偏移量为字符偏移，content[start:end] 即章节文本。
+
+    Args:
+        content: 技能内容（Markdown）
+
+    Returns:
+        章节列表，每个章节包含 position, level, title, anchor, start_offset,
+        end_offset, token_count，按在内容中的顺序排列
+    """
+    headings = []  # (level, title, start_offset)
+    fence = None
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        fence_match = _FENCE_RE.match(line)
+        if fence is not None:
+            # 结束围栏需与开始围栏字符相同且不短于开始围栏
+            if fence_match and fence_match.group(1)[0] == fence[0] and len(fence_match.group(1)) >= len(fence):
+                fence = None
+        elif fence_match:
+            fence = fence_match.group(1)
+        else:
+            heading = _HEADING_RE.match(line.rstrip("\r\n"))
+            if heading:
+                headings.append((len(heading.group(1)), heading.group(2).strip(), offset))
+        offset += len(line)
+
+    sections = []
+    anchors = set()
+    for i, (level, title, start) in enumerate(headings):
+        end = len(content)
+        for next_level, _, next_start in headings[i + 1:]:
+            if next_level <= level:
+                end = next_start
+                break
+        anchor = make_anchor(title)
+        if anchor in anchors:
+            suffix = 2
+            while f"{anchor}-{suffix}" in anchors:
+                suffix += 1
+            anchor = f"{anchor}-{suffix}"
+        anchors.add(anchor)
+        sections.append({
+            "position": i + 1,
+            "level": level,
+            "title": title,
+            "anchor": anchor,
+            "start_offset": start,
+            "end_offset": end,
+            "token_count": estimate_tokens(content[start:end]),
+        })
+    return sections
+
+
+def find_section(sections: Sequence, key: str) -> Optional[object]:
+    """按锚点、标题或序号查找章节
+
+    Args:
+        sections: 章节记录（带 position, title, anchor 属性）
+        key: 锚点、标题或章节序号
+
+    Returns:
+        匹配的章节，不存在时返回 None
+    """
+    key = key.strip().lstrip("#").strip()
+    for match in (
+        lambda s: s.anchor == key,
+        lambda s: s.title == key,
+        lambda s: s.anchor == make_anchor(key),
+        lambda s: str(s.position) == key,
+    ):
+        for section in sections:
+            if match(section):
+                return section
+    return None
+
+
+def format_toc(sections: Sequence) -> str:
+    """生成章节目录（按标题级别缩进，附带锚点和估算的 token 数）"""
+    top_level = min((s.level for s in sections), default=1)
+    return "\n".join(
+        f"{'  ' * (s.level - top_level)}- {s.title} [{s.anchor}]（约 {s.token_count} tokens）"
+        for s in sections
+    )
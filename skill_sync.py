@@ -0,0 +1,342 @@
+"""
+技能增量同步
+从技能仓库（Gitee 仓库的本地克隆或裸仓库）同步技能到数据库：
+对比上次同步的 commit 与 HEAD，只重新导入有文件变更的技能目录，并写入同步日志
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from db_utils import DatabaseManager
+from sync_log import SyncLogBuffer
+from load_skill_from_file import SkillData, decode_text, parse_skill_files
+
+load_dotenv()
+
+
+class SyncReport(NamedTuple):
+    """一次同步的结果"""
+    sync_type: str  # full, incremental, noop
+    from_commit: Optional[str]
+    to_commit: str
+    imported: List[str]
+    updated: List[str]
+    removed: List[str]
+    failed: Dict[str, str]  # skill_id 或目录名 -> 错误信息
+    duration_ms: int
+
+
+class GitBlobReader:
+    """通过一个常驻的 `git cat-file --batch` 进程读取文件内容，避免每个文件启动一次 git"""
+
+    def __init__(self, repo_path: str):
+        self._proc = subprocess.Popen(
+            ["git", "-C", repo_path, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+
+    def read(self, commit: str, path: str) -> Optional[bytes]:
+        """读取指定 commit 中的文件
+
+        Args:
+            commit: commit hash
+            path: 仓库内的文件路径
+
+        Returns:
+            文件内容，文件不存在时返回 None
+        """
+        self._proc.stdin.write(f"{commit}:{path}\n".encode("utf-8"))
+        self._proc.stdin.flush()
+        header = self._proc.stdout.readline()
+        if header.endswith(b" missing\n"):
+            return None
+        _, object_type, size = header.split()
+        data = self._proc.stdout.read(int(size))
+        self._proc.stdout.read(1)  # 内容后的换行符
+        return data if object_type == b"blob" else None
+
+    def close(self):
+        """结束 git 进程"""
+        if self._proc.poll() is None:
+            self._proc.stdin.close()
+            self._proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _git(repo_path: str, *args: str) -> str:
+    """执行 git 命令并返回标准输出"""
+    return subprocess.run(
+        ["git", "-C", repo_path, *args],
+        check=True,
+        capture_output=True,
+        text=True,
+        encoding="utf-8"
+    ).stdout
+
+
+def load_skill_from_git(reader: GitBlobReader, commit: str, skill_dir: str) -> SkillData:
+    """从 git 仓库的指定 commit 加载技能文件（与 load_skill_from_directory 格式相同）
+
+    Args:
+        reader: git 文件读取器
+        commit: commit hash
+        skill_dir: 仓库内的技能目录路径
+
+    Returns:
+        (skill_json, content, examples, metadata) 元组
+    """
+    def read_text(name: str) -> Optional[str]:
+        data = reader.read(commit, f"{skill_dir}/{name}")
+        return decode_text(data) if data is not None else None
+
+    return parse_skill_files(read_text, skill_dir)
+
+
+class SkillSyncEngine:
+    """技能同步引擎"""
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        repo_path: str,
+        agent_name: str = "default_agent",
+        repo_url: Optional[str] = None,
+        skills_root: str = "",
+        ref: str = "HEAD",
+        batch_size: int = 500,
+        sync_log: Optional[SyncLogBuffer] = None
+    ):
+        """初始化同步引擎
+
+        Args:
+            db_manager: 数据库管理器
+            repo_path: 技能仓库的本地路径（普通克隆或裸仓库）
+            agent_name: 技能所属的角色名称
+            repo_url: 记录在 skills.gitee_repo_url 中的仓库 URL，默认为仓库的绝对路径
+            skills_root: 技能目录在仓库中的上级目录，例如 "skill-example"，默认为仓库根目录
+            ref: 要同步的分支或 commit，默认为 HEAD
+            batch_size: 导入时每个事务的技能数
+            sync_log: 同步日志缓冲，多个同步引擎可以共用一个缓冲（由调用方 close()）；
+                默认每个引擎使用自己的缓冲，每次同步结束时写入
+        """
+        self.db_manager = db_manager
+        self.repo_path = repo_path
+        self.agent_name = agent_name
+        self.repo_url = repo_url or os.path.abspath(repo_path)
+        self.skills_root = skills_root.strip("/")
+        self.ref = ref
+        self.batch_size = batch_size
+        self._owns_sync_log = sync_log is None
+        self.sync_log = SyncLogBuffer(db_manager) if sync_log is None else sync_log
+
+    def _skill_dir_of(self, path: str) -> Optional[str]:
+        """返回文件所属的技能目录（skills_root 下的第一级目录），不属于任何技能目录时返回 None"""
+        prefix = f"{self.skills_root}/" if self.skills_root else ""
+        if not path.startswith(prefix):
+            return None
+        parts = path[len(prefix):].split("/")
+        if len(parts) < 2:
+            return None
+        return prefix + parts[0]
+
+    def _commit_exists(self, commit: str) -> bool:
+        """commit 是否存在于仓库中（例如强制推送后旧 commit 可能已被清理）"""
+        result = subprocess.run(
+            ["git", "-C", self.repo_path, "cat-file", "-e", f"{commit}^{{commit}}"],
+            capture_output=True
+        )
+        return result.returncode == 0
+
+    def _list_files(self, commit: str) -> List[str]:
+        """列出 commit 中 skills_root 下的所有文件"""
+        args = ["ls-tree", "-r", "-z", "--name-only", commit]
+        if self.skills_root:
+            args += ["--", self.skills_root]
+        return [p for p in _git(self.repo_path, *args).split("\0") if p]
+
+    def _changed_files(self, from_commit: str, to_commit: str) -> List[str]:
+        """列出两个 commit 之间 skills_root 下变更的文件（重命名视为删除加新增）"""
+        args = ["diff", "--name-only", "-z", "--no-renames", from_commit, to_commit]
+        if self.skills_root:
+            args += ["--", self.skills_root]
+        return [p for p in _git(self.repo_path, *args).split("\0") if p]
+
+    def sync(self, force_full: bool = False) -> SyncReport:
+        """执行一次同步
+
+        Args:
+            force_full: 是否强制全量同步
+
+        Returns:
+            同步结果
+        """
+        start = time.perf_counter()
+        head = _git(self.repo_path, "rev-parse", f"{self.ref}^{{commit}}").strip()
+        last = self.db_manager.get_last_synced_commit(self.repo_url, self.agent_name)
+
+        if last == head and not force_full:
+            return SyncReport("noop", last, head, [], [], [], {}, 0)
+
+        # 按技能目录分组变更的文件
+        if force_full or not last or not self._commit_exists(last):
+            sync_type = "full"
+            files = self._list_files(head)
+        else:
+            sync_type = "incremental"
+            files = self._changed_files(last, head)
+        changed: Dict[str, List[str]] = {}
+        for path in files:
+            skill_dir = self._skill_dir_of(path)
+            if skill_dir:
+                changed.setdefault(skill_dir, []).append(path)
+
+        items = []
+        item_files: Dict[str, List[str]] = {}
+        removed_ids = []
+        failed: Dict[str, str] = {}
+        with GitBlobReader(self.repo_path) as reader:
+            for skill_dir, dir_files in sorted(changed.items()):
+                if reader.read(head, f"{skill_dir}/skill.json") is None:
+                    # 技能目录已删除：从上次同步的 commit 中读取 skill_id 并禁用
+                    if sync_type == "incremental":
+                        old = reader.read(last, f"{skill_dir}/skill.json")
+                        if old is not None:
+                            try:
+                                removed_ids.append(json.loads(old).get("id"))
+                            except (ValueError, AttributeError) as e:
+                                # 无法确定 skill_id，不禁用该目录的技能；全量同步（--full）不依赖旧的 skill.json
+                                failed[skill_dir] = f"技能目录已删除，但上次同步的 skill.json 无法解析: {e}"
+                    continue
+                try:
+                    skill_json, content, examples, metadata = load_skill_from_git(reader, head, skill_dir)
+                except Exception as e:
+                    failed[skill_dir] = str(e)
+                    continue
+                items.append({
+                    "skill_json": skill_json,
+                    "content": content,
+                    "examples": examples,
+                    "metadata": metadata,
+                    "content_file_path": f"{skill_dir}/{skill_json.get('content_file', 'content.md')}",
+                    "gitee_repo_url": self.repo_url,
+                    "gitee_commit_hash": head
+                })
+                item_files[skill_json.get("id")] = sorted(dir_files)
+
+        # 全量同步时，数据库中有而仓库中已没有的技能也视为删除
+        # （有目录读取失败时无法确定其 skill_id，为避免误禁用，本次不处理删除）
+        if sync_type == "full" and not failed:
+            present = {item["skill_json"].get("id") for item in items}
+            removed_ids = [i for i in self.db_manager.get_repo_skill_ids(self.repo_url) if i not in present]
+        
+        results = self.db_manager.bulk_import_skills(
+            self.agent_name, items, batch_size=self.batch_size, update_existing=True
+        )
+        removed = self.db_manager.disable_skills([i for i in removed_ids if i], self.repo_url)
+
+        imported, updated = [], []
+        for result in results:
+            if result.status in ("imported", "linked"):
+                imported.append(result.skill_id)
+            elif result.status == "updated":
+                updated.append(result.skill_id)
+            elif result.status == "skipped":
+                # 内容 hash 未变化（例如只修改了不影响技能定义的文件），无需写入
+                continue
+            else:
+                failed[result.skill_id or "?"] = result.message or result.status
+
+        # 全部成功时才推进同步位置，失败的技能在下次同步时会被重新导入
+        if not failed:
+            self.db_manager.mark_repo_synced(self.repo_url, head, self.agent_name)
+        duration_ms = int((time.perf_counter() - start) * 1000)
+
+        # 写入同步日志（失败且从未导入过的技能没有数据库ID，无法记录；按目录记录的失败
+        # 通过 content_file_path 找到该目录导入的技能）
+        pks = self.db_manager.get_skill_pks(list(item_files) + list(failed))
+        pks.update(self.db_manager.get_skill_pks_by_dir(self.repo_url, [k for k in failed if k in changed]))
+        logs = []
+        for skill_id in imported + updated:
+            logs.append({
+                "skill_id": pks[skill_id],
+                "sync_type": sync_type,
+                "sync_status": "success",
+                "sync_message": "新增" if skill_id in imported else "更新",
+                "gitee_commit_hash": head,
+                "files_updated": item_files.get(skill_id)
+            })
+        for skill_id, pk in removed.items():
+            logs.append({
+                "skill_id": pk,
+                "sync_type": sync_type,
+                "sync_status": "success",
+                "sync_message": "技能目录已删除，技能已禁用",
+                "gitee_commit_hash": head
+            })
+        for skill_id, message in failed.items():
+            if skill_id in pks:
+                logs.append({
+                    "skill_id": pks[skill_id],
+                    "sync_type": sync_type,
+                    "sync_status": "failed",
+                    "sync_message": message,
+                    "gitee_commit_hash": head,
+                    "files_updated": item_files.get(skill_id) or changed.get(skill_id)
+                })
+        if logs:
+            # 耗时是整次同步的总耗时，只记录在第一条日志上（每次同步计一次）
+            logs[0]["sync_duration_ms"] = duration_ms
+        # 写入失败的日志留在缓冲中，下次同步时重试
+        self.sync_log.extend(logs)
+        if self._owns_sync_log:
+            self.sync_log.flush()
+
+        return SyncReport(
+            sync_type, last, head, imported, updated, list(removed), failed, duration_ms
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从技能仓库同步技能到数据库")
+    parser.add_argument("repo", help="技能仓库的本地路径（普通克隆或裸仓库）")
+    parser.add_argument("--agent", default="default_agent", help="技能所属的角色名称")
+    parser.add_argument("--root", default="", help="技能目录在仓库中的上级目录")
+    parser.add_argument("--repo-url", default=None, help="记录在数据库中的仓库 URL")
+    parser.add_argument("--ref", default="HEAD", help="要同步的分支或 commit")
+    parser.add_argument("--full", action="store_true", help="强制全量同步")
+    args = parser.parse_args()
+
+    engine = SkillSyncEngine(
+        DatabaseManager(),
+        args.repo,
+        agent_name=args.agent,
+        repo_url=args.repo_url,
+        skills_root=args.root,
+        ref=args.ref
+    )
+    report = engine.sync(force_full=args.full)
+
+    print(f"同步类型: {report.sync_type}")
+    print(f"Commit: {report.from_commit or '-'} -> {report.to_commit}")
+    print(f"  - 新增: {len(report.imported)} 个技能")
+    print(f"  - 更新: {len(report.updated)} 个技能")
+    print(f"  - 禁用: {len(report.removed)} 个技能")
+    for name, message in report.failed.items():
+        print(f"  ✗ 失败 {name}: {message}")
+    print(f"耗时: {report.duration_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+同步日志缓冲和维护
+把同步结果先保存在内存中，按条数或时间间隔批量写入 skill_sync_log（每批一个事务），
+代替逐条调用 add_sync_log（每条日志一个事务）；命令行 `python sync_log.py prune` 清理过期日志
+"""
+
+import argparse
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+from db_utils import DatabaseManager, sync_log_row
+
+load_dotenv()
+
+
+class SyncLogBuffer:
+    """同步日志的写入缓冲
+
+    add() 只把日志追加到内存中，缓冲的日志达到 max_size 条、或距上次写入超过 flush_interval 秒时，
+    由调用 add() 的线程批量写入数据库。没有后台线程：停止写入后剩余的日志在 flush() 或 close() 时写入，
+    可以作为上下文管理器使用。
+
+    写入失败时日志放回缓冲，异常抛给调用方，下次写入时重试。线程安全。
+    """
+
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        max_size: Optional[int] = None,
+        flush_interval: Optional[float] = None
+    ):
+        """初始化缓冲
+
+        Args:
+            db_manager: 数据库管理器
+            max_size: 缓冲的最大日志条数，如果不提供则从环境变量 SYNC_LOG_BUFFER_SIZE 读取，默认为 500
+            flush_interval: 最长缓冲时间（秒），如果不提供则从环境变量 SYNC_LOG_FLUSH_SECONDS 读取，默认为 5
+        """
+        self.db_manager = db_manager
+        if max_size is None:
+            max_size = int(os.getenv("SYNC_LOG_BUFFER_SIZE", "500"))
+        if flush_interval is None:
+            flush_interval = float(os.getenv("SYNC_LOG_FLUSH_SECONDS", "5"))
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.flushes = 0
+        self._rows: List[Dict] = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程写入数据库，保持日志的写入顺序
+        self._flush_lock = threading.Lock()
+
+    def add(
+        self,
+        skill_id: int,
+        sync_type: str,
+        sync_status: str,
+        sync_message: Optional[str] = None,
+        gitee_commit_hash: Optional[str] = None,
+        files_updated: Optional[List[str]] = None,
+        sync_duration_ms: Optional[int] = None
+    ) -> None:
+        """追加一条同步日志，参数同 DatabaseManager.add_sync_log"""
+        self.extend([{
+            "skill_id": skill_id,
+            "sync_type": sync_type,
+            "sync_status": sync_status,
+            "sync_message": sync_message,
+            "gitee_commit_hash": gitee_commit_hash,
+            "files_updated": files_updated,
+            "sync_duration_ms": sync_duration_ms
+        }])
+
+    def extend(self, entries: Iterable[Dict]) -> None:
+        """追加多条同步日志
+
+        Args:
+            entries: 同步日志字典，键同 DatabaseManager.add_sync_log 的参数
+        """
+        rows = [sync_log_row(entry) for entry in entries]
+        with self._lock:
+            self._rows.extend(rows)
+            due = (
+                len(self._rows) >= self.max_size
+                or time.monotonic() - self._flushed_at >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """把缓冲的日志写入数据库
+
+        Returns:
+            写入的日志条数
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._flushed_at = time.monotonic()
+            if not rows:
+                return 0
+            try:
+                self.db_manager.add_sync_logs(rows)
+            except Exception:
+                with self._lock:
+                    self._rows[:0] = rows
+                raise
+            self.written += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    def close(self) -> int:
+        """写入剩余的日志
+
+        Returns:
+            写入的日志条数
+        """
+        return self.flush()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def __enter__(self) -> "SyncLogBuffer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步日志维护")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prune = subparsers.add_parser("prune", help="删除早于保留时间的同步日志（可由定时任务执行）")
+    prune.add_argument(
+        "--days", type=float, default=None,
+        help="保留天数，默认从环境变量 SYNC_LOG_RETENTION_DAYS 读取"
+    )
+    prune.add_argument("--batch-size", type=int, default=10000, help="每个事务删除的最大行数")
+    args = parser.parse_args()
+
+    db_manager = DatabaseManager(sync_log_retention_days=args.days)
+    if db_manager.sync_log_retention_days <= 0:
+        print("未设置保留天数（--days 或 SYNC_LOG_RETENTION_DAYS），不清理同步日志")
+        return
+    removed = db_manager.prune_sync_logs(batch_size=args.batch_size)
+    print(f"已删除 {removed} 条早于 {db_manager.sync_log_retention_days:g} 天的同步日志")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+测试公共夹具
+测试使用临时目录中的 SQLite 数据库，不需要 PostgreSQL
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_utils import DatabaseManager  # noqa: E402
+
+
+def sqlite_url(path) -> str:
+    """返回 SQLite 数据库文件的连接 URL"""
+    return f"sqlite:///{path}"
+
+
+def skill_item(skill_id: str, content: str = "内容", **fields):
+    """构造 bulk_import_skills 的一项技能数据"""
+    skill_json = {
+        "id": skill_id,
+        "name": fields.pop("name", skill_id),
+        "version": "1.0.0",
+        "description": fields.pop("description", f"{skill_id} 的描述"),
+    }
+    skill_json.update(fields)
+    return {"skill_json": skill_json, "content": content}
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    """已建表的 SQLite 数据库 URL"""
+    url = sqlite_url(tmp_path / "skills.db")
+    DatabaseManager(url, cache_size=0, replica_urls=[]).create_tables()
+    return url
+
+
+@pytest.fixture
+def db(db_url):
+    """带缓存、不轮询水位线的 DatabaseManager，已创建角色 tester"""
+    manager = DatabaseManager(db_url, cache_size=16, cache_poll_interval=-1, replica_urls=[])
+    manager.add_agent("tester", "测试角色", "你是测试助手")
+    return manager
@@ -0,0 +1,165 @@
+"""
+API 响应缓存测试：并发请求合并（线程和 asyncio）、只缓存成功响应、发起请求的调用被取消、
+数据库共享层的读写和共享层出错时按未命中处理
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from api_cache import ApiResponseCache
+from db_utils import SkillApiResponse
+from test_skill_api import make_executor, make_spec
+
+URL = "https://api.example.com/weather"
+
+
+class Fetcher:
+    """返回给定状态码的请求函数，记录调用次数；设置 gate 时等待 gate 打开后才返回"""
+
+    def __init__(self, status_code=200, gate=None):
+        self.status_code = status_code
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        return httpx.Response(self.status_code, text=f"第 {self.calls} 次请求")
+
+
+def get(cache, fetch, key="k"):
+    return cache.get_or_fetch(key, "get_weather", 60, "GET", URL, fetch)
+
+
+@pytest.fixture
+def broken_db(db):
+    """共享层的表不存在，每次读写都抛出 OperationalError"""
+    SkillApiResponse.__table__.drop(db.engine)
+    return db
+
+
+def test_concurrent_callers_share_one_fetch():
+    cache = ApiResponseCache(max_size=16)
+    gate = threading.Event()
+    fetch = Fetcher(gate=gate)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get(cache, fetch).text)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()["coalesced"] < 4:
+        time.sleep(0.01)
+    gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == 1
+    assert results == ["第 1 次请求"] * 5
+    assert get(cache, fetch).text == "第 1 次请求"
+    assert cache.stats()["hits"] == 1
+
+
+def test_async_concurrent_callers_share_one_fetch():
+    cache = ApiResponseCache(max_size=16)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, text="ok")
+
+    async def run():
+        return await asyncio.gather(*(
+            cache.aget_or_fetch("k", "get_weather", 60, "GET", URL, fetch) for _ in range(5)
+        ))
+
+    assert [r.text for r in asyncio.run(run())] == ["ok"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_non_2xx_not_cached():
+    cache = ApiResponseCache(max_size=16)
+    fetch = Fetcher(status_code=503)
+    assert get(cache, fetch).status_code == 503
+    assert get(cache, fetch).status_code == 503
+    assert fetch.calls == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_cancelled_leader_releases_waiters():
+    cache = ApiResponseCache(max_size=16)
+    started = []
+
+    async def slow_fetch():
+        started.append("leader")
+        await asyncio.sleep(10)
+
+    async def fast_fetch():
+        started.append("waiter")
+        return httpx.Response(200, text="waiter")
+
+    async def run():
+        leader = asyncio.create_task(cache.aget_or_fetch("k", "get_weather", 60, "GET", URL, slow_fetch))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.aget_or_fetch("k", "get_weather", 60, "GET", URL, fast_fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(waiter, 1)
+
+    assert asyncio.run(run()).text == "waiter"
+    assert started == ["leader", "waiter"]
+
+
+def test_shared_tier_between_processes(db):
+    first = ApiResponseCache(max_size=16, db_manager=db)
+    second = ApiResponseCache(max_size=16, db_manager=db)
+    fetch = Fetcher()
+    assert get(first, fetch).text == "第 1 次请求"
+    assert get(second, fetch).text == "第 1 次请求"
+    assert fetch.calls == 1
+    assert second.stats()["shared_hits"] == 1
+
+
+def test_prune_expired(db):
+    cache = ApiResponseCache(max_size=0, db_manager=db)
+    cache.get_or_fetch("old", "get_weather", 0.01, "GET", URL, Fetcher())
+    get(cache, Fetcher(), key="new")
+    time.sleep(0.02)
+    assert cache.prune_expired() == 1
+    assert get(cache, Fetcher(), key="new").text == "第 1 次请求"
+
+
+def test_shared_tier_failure_returns_live_response(broken_db):
+    cache = ApiResponseCache(max_size=16, db_manager=broken_db)
+    fetch = Fetcher()
+    assert get(cache, fetch).text == "第 1 次请求"
+    assert fetch.calls == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["shared_errors"]) == (1, 2)
+    # 进程内缓存层仍然可用
+    assert get(cache, fetch).text == "第 1 次请求"
+
+
+def test_async_shared_tier_failure_returns_live_response(broken_db):
+    cache = ApiResponseCache(max_size=16, db_manager=broken_db)
+
+    async def fetch():
+        return httpx.Response(200, text="ok")
+
+    response = asyncio.run(cache.aget_or_fetch("k", "get_weather", 60, "GET", URL, fetch))
+    assert response.text == "ok"
+    assert cache.stats()["shared_errors"] == 2
+
+
+def test_executor_call_survives_shared_tier_failure(broken_db):
+    handler = lambda request: httpx.Response(200, text="晴")  # noqa: E731
+    executor = make_executor(handler, cache=ApiResponseCache(max_size=16, db_manager=broken_db))
+    spec = make_spec(response_format={"cache_ttl_seconds": 60})
+    assert executor.call(spec, {"city": "北京"}).text == "晴"
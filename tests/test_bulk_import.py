@@ -0,0 +1,44 @@
+"""
+批量导入测试：幂等导入、内容变化时更新、写入前的角色查询不走只读副本
+"""
+
+import time
+
+import pytest
+
+from db_utils import DatabaseManager
+from conftest import sqlite_url, skill_item
+
+
+def test_import_is_idempotent(db):
+    items = [skill_item("s1"), skill_item("s2")]
+    assert [r.status for r in db.bulk_import_skills("tester", items)] == ["imported", "imported"]
+    assert [r.status for r in db.bulk_import_skills("tester", items)] == ["skipped", "skipped"]
+
+    changed = [skill_item("s1", "新内容"), skill_item("s2")]
+    results = db.bulk_import_skills("tester", changed, update_existing=True)
+    assert [r.status for r in results] == ["updated", "skipped"]
+
+
+def test_unknown_agent_raises(db):
+    with pytest.raises(ValueError):
+        db.bulk_import_skills("nobody", [skill_item("s1")])
+    with pytest.raises(ValueError):
+        db.assign_skills("nobody", ["s1"])
+
+
+def test_writes_do_not_look_up_agent_on_lagging_replica(tmp_path):
+    primary, replica = sqlite_url(tmp_path / "primary.db"), sqlite_url(tmp_path / "replica.db")
+    for url in (primary, replica):
+        DatabaseManager(url, cache_size=0, replica_urls=[]).create_tables()
+    # 角色由另一个进程创建，还没有复制到副本
+    DatabaseManager(primary, cache_size=0, replica_urls=[]).add_agent("tester")
+
+    db = DatabaseManager(primary, cache_size=0, replica_urls=[replica])
+    db.replicas.replicas[0].checked_at = time.monotonic()
+    assert db.get_agent("tester") is None
+
+    assert [r.status for r in db.bulk_import_skills("tester", [skill_item("s1")])] == ["imported"]
+    assert db.assign_skills("tester", ["s1"], priority=3) == 1
+    with db.read_your_writes():
+        assert db.get_skill("tester", "s1").priority == 3
@@ -0,0 +1,146 @@
+"""
+数据库检查点存储测试：通过 LangGraph 图保存和读取检查点、列出检查点、清理过期检查点、删除会话
+"""
+
+import asyncio
+import operator
+from datetime import datetime, timezone
+from typing import Annotated, List
+
+import pytest
+from langgraph.graph import END, START, StateGraph
+from sqlalchemy import func, select, update
+from typing_extensions import TypedDict
+
+from async_db_utils import AsyncDatabaseManager
+from checkpointer import CHECKPOINTS, DatabaseCheckpointSaver
+from db_utils import AgentCheckpointBlob
+
+LONG_AGO = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+class State(TypedDict):
+    items: Annotated[List[str], operator.add]
+
+
+def build_graph(saver):
+    graph = StateGraph(State)
+    graph.add_node("echo", lambda state: {"items": [f"echo {len(state['items'])}"]})
+    graph.add_edge(START, "echo")
+    graph.add_edge("echo", END)
+    return graph.compile(checkpointer=saver)
+
+
+def thread(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+@pytest.fixture
+def saver(db):
+    return DatabaseCheckpointSaver(db)
+
+
+def count_checkpoints(db, thread_id):
+    session = db.get_session()
+    try:
+        return session.execute(
+            select(func.count()).select_from(CHECKPOINTS).where(CHECKPOINTS.c.thread_id == thread_id)
+        ).scalar()
+    finally:
+        session.close()
+
+
+def backdate(db, thread_id):
+    """把会话的检查点和通道值的创建时间改为很久以前"""
+    session = db.get_session()
+    try:
+        for table in (CHECKPOINTS, AgentCheckpointBlob.__table__):
+            session.execute(update(table).where(table.c.thread_id == thread_id).values(created_at=LONG_AGO))
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_put_get_list_round_trip(saver):
+    graph = build_graph(saver)
+    graph.invoke({"items": ["a"]}, thread("t1"))
+    graph.invoke({"items": ["b"]}, thread("t1"))
+
+    # 新的图实例（例如另一个 worker）读取同一会话的状态
+    state = build_graph(saver).get_state(thread("t1"))
+    assert state.values["items"] == ["a", "echo 1", "b", "echo 3"]
+
+    checkpoints = list(saver.list(thread("t1")))
+    assert len(checkpoints) > 2
+    ids = [c.config["configurable"]["checkpoint_id"] for c in checkpoints]
+    assert ids == sorted(ids, reverse=True)
+    assert saver.get_tuple(thread("t1")).config == checkpoints[0].config
+    assert checkpoints[0].parent_config == checkpoints[1].config
+    assert len(list(saver.list(thread("t1"), limit=1))) == 1
+    assert len(list(saver.list(thread("t1"), before=checkpoints[0].config))) == len(checkpoints) - 1
+    assert [c.metadata["source"] for c in saver.list(thread("t1"), filter={"source": "input"})] == ["input", "input"]
+    assert saver.get_tuple(thread("t2")) is None
+
+
+def test_async_round_trip(db_url, db):
+    async def run():
+        async_db = AsyncDatabaseManager(db_url, cache_size=0, replica_urls=[])
+        graph = build_graph(DatabaseCheckpointSaver(db, async_db))
+        await graph.ainvoke({"items": ["a"]}, thread("t1"))
+        state = await graph.aget_state(thread("t1"))
+        await async_db.dispose()
+        return state.values["items"]
+
+    assert asyncio.run(run()) == ["a", "echo 1"]
+
+
+def test_prune_keeps_latest_checkpoint(db, saver):
+    graph = build_graph(saver)
+    graph.invoke({"items": ["a"]}, thread("old"))
+    graph.invoke({"items": ["b"]}, thread("old"))
+    graph.invoke({"items": ["a"]}, thread("active"))
+    graph.invoke({"items": ["b"]}, thread("active"))
+    before = count_checkpoints(db, "active")
+
+    # active 会话的历史检查点过期，但在保留时间内有新的检查点
+    backdate(db, "old")
+    backdate(db, "active")
+    graph.invoke({"items": ["c"]}, thread("active"))
+    recent = count_checkpoints(db, "active") - before
+    latest = saver.get_tuple(thread("active")).config
+
+    removed = saver.prune_expired(ttl_seconds=3600)
+    assert removed == {"threads": 1, "checkpoints": before}
+    assert saver.get_tuple(thread("old")) is None
+    assert count_checkpoints(db, "active") == recent
+    assert saver.get_tuple(thread("active")).config == latest
+    state = build_graph(saver).get_state(thread("active"))
+    assert state.values["items"] == ["a", "echo 1", "b", "echo 3", "c", "echo 5"]
+
+
+def test_prune_without_ttl_is_noop(db, saver):
+    build_graph(saver).invoke({"items": ["a"]}, thread("t1"))
+    backdate(db, "t1")
+    assert saver.prune_expired() == {"threads": 0, "checkpoints": 0}
+    assert saver.get_tuple(thread("t1")) is not None
+
+
+def test_put_does_not_prune(db):
+    saver = DatabaseCheckpointSaver(db, ttl_seconds=3600)
+    graph = build_graph(saver)
+    graph.invoke({"items": ["a"]}, thread("old"))
+    backdate(db, "old")
+    graph.invoke({"items": ["a"]}, thread("new"))
+    assert saver.get_tuple(thread("old")) is not None
+
+
+def test_delete_thread(db, saver):
+    graph = build_graph(saver)
+    graph.invoke({"items": ["a"]}, thread("t1"))
+    graph.invoke({"items": ["a"]}, thread("t2"))
+
+    saver.delete_thread("t1")
+    assert saver.get_tuple(thread("t1")) is None
+    assert list(saver.list(thread("t1"))) == []
+    assert count_checkpoints(db, "t1") == 0
+    assert build_graph(saver).get_state(thread("t2")).values["items"] == ["a", "echo 1"]
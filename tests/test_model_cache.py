@@ -0,0 +1,112 @@
+"""
+模型响应缓存测试：工具定义变化（不改名）时缓存键随之变化；中间件命中缓存时不调用模型，
+缓存的数据库共享层出错时照常调用模型并返回响应
+"""
+
+import asyncio
+
+import pytest
+from langchain.agents.middleware import ModelRequest, ModelResponse
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy.exc import OperationalError
+
+from create_agent import ModelCacheMiddleware, _tool_definition
+from db_utils import ModelResponseRecord
+from fake_chat_model import FakeChatModel
+from model_cache import ModelResponseCache, model_cache_key
+from skill_api import ApiExecutor, create_api_tool
+from test_skill_api import make_spec
+
+
+def key(tools):
+    return model_cache_key("fake", 0, "v1", "system", [{"type": "human", "content": "hi"}], tools)
+
+
+def api_tool(**fields):
+    return _tool_definition(create_api_tool(make_spec(**fields), ApiExecutor(allow_insecure=True)))
+
+
+def test_key_ignores_tool_order():
+    a, b = api_tool(api_name="a"), api_tool(api_name="b")
+    assert key([a, b]) == key([b, a])
+
+
+def test_key_changes_with_tool_schema():
+    base = api_tool()
+    assert key([base]) == key([api_tool()])
+    assert key([base]) != key([api_tool(description="查询未来三天的天气")])
+    assert key([base]) != key([api_tool(optional_params=[{"name": "days", "type": "integer"}])])
+    assert key([base]) != key([api_tool(required_params=[{"name": "city", "type": "string"}])])
+
+
+def test_dict_tools_keyed_by_full_definition():
+    tool = {"type": "function", "function": {"name": "search", "parameters": {"type": "object"}}}
+    changed = {"type": "function", "function": {"name": "search", "parameters": {"type": "object", "required": ["q"]}}}
+    assert key([_tool_definition(tool)]) != key([_tool_definition(changed)])
+
+
+# ========== 中间件 ==========
+
+class Model:
+    """记录调用次数的模型处理函数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, request):
+        self.calls += 1
+        return ModelResponse(result=[AIMessage(content=f"第 {self.calls} 次回答")])
+
+    async def acall(self, request):
+        return self(request)
+
+
+def make_request():
+    return ModelRequest(model=FakeChatModel(), messages=[HumanMessage(content="你好")], tools=[], model_settings={})
+
+
+def answer(response):
+    return response.result[-1].content
+
+
+@pytest.fixture
+def broken_db(db):
+    """共享层的表不存在，每次读写都抛出 OperationalError"""
+    ModelResponseRecord.__table__.drop(db.engine)
+    return db
+
+
+def test_middleware_serves_cached_response(db):
+    middleware = ModelCacheMiddleware(ModelResponseCache(max_size=0, db_manager=db), db, "tester")
+    model = Model()
+    assert answer(middleware.wrap_model_call(make_request(), model)) == "第 1 次回答"
+    assert answer(middleware.wrap_model_call(make_request(), model)) == "第 1 次回答"
+    assert model.calls == 1
+
+
+def test_middleware_calls_model_when_cache_db_fails(broken_db):
+    middleware = ModelCacheMiddleware(ModelResponseCache(max_size=16, db_manager=broken_db), broken_db, "tester")
+    model = Model()
+    assert answer(middleware.wrap_model_call(make_request(), model)) == "第 1 次回答"
+    assert answer(middleware.wrap_model_call(make_request(), model)) == "第 2 次回答"
+
+
+def test_async_middleware_calls_model_when_cache_db_fails(broken_db):
+    middleware = ModelCacheMiddleware(ModelResponseCache(max_size=16, db_manager=broken_db), broken_db, "tester")
+    model = Model()
+
+    async def run():
+        return [answer(await middleware.awrap_model_call(make_request(), model.acall)) for _ in range(2)]
+
+    assert asyncio.run(run()) == ["第 1 次回答", "第 2 次回答"]
+
+
+def test_middleware_returns_response_when_cache_write_fails(db, monkeypatch):
+    cache = ModelResponseCache(max_size=16, db_manager=db)
+
+    def fail(*args):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(cache, "set", fail)
+    middleware = ModelCacheMiddleware(cache, db, "tester")
+    assert answer(middleware.wrap_model_call(make_request(), Model())) == "第 1 次回答"
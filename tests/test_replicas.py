@@ -0,0 +1,161 @@
+"""
+只读副本路由测试：两个 SQLite 文件分别作为主库和副本（内容不同，以便区分查询走了哪个数据库）
+覆盖轮询路由、复制延迟超限和副本不可用时回退主库、写入后和 read_your_writes() 中读主库
+"""
+
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import exc
+
+from async_db_utils import AsyncDatabaseManager
+from db_utils import DatabaseManager
+from conftest import sqlite_url
+
+
+@pytest.fixture
+def urls(tmp_path):
+    """主库中有角色 primary_agent，副本中有角色 replica_agent"""
+    primary, replica = sqlite_url(tmp_path / "primary.db"), sqlite_url(tmp_path / "replica.db")
+    for url, agent in ((primary, "primary_agent"), (replica, "replica_agent")):
+        manager = DatabaseManager(url, cache_size=0, replica_urls=[])
+        manager.create_tables()
+        manager.add_agent(agent)
+    return primary, replica
+
+
+def agent_names(db):
+    return [agent.name for agent in db.get_all_agents()]
+
+
+def test_reads_go_to_replica(urls):
+    primary, replica = urls
+    db = DatabaseManager(primary, cache_size=0, replica_urls=[replica])
+    assert agent_names(db) == ["replica_agent"]
+    assert db.get_agent("replica_agent") is not None
+
+    status = db.get_replica_status()
+    assert status["replicas"][0]["healthy"] is True
+    assert status["replicas"][0]["lag_seconds"] == 0
+    assert status["replicas"][0]["reads"] == 2
+
+
+def test_lagging_replica_falls_back_to_primary(urls):
+    primary, replica = urls
+    db = DatabaseManager(primary, cache_size=0, replica_urls=[replica], max_replica_lag=5,
+                         replica_lag_probe=lambda connection: 30.0)
+    assert agent_names(db) == ["primary_agent"]
+
+    status = db.get_replica_status()
+    assert status["fallback_reads"] == 1
+    assert status["replicas"][0]["healthy"] is False
+    assert "复制延迟" in status["replicas"][0]["error"]
+
+
+def test_unreachable_replica_falls_back_to_primary(urls, tmp_path):
+    primary, _ = urls
+    db = DatabaseManager(primary, cache_size=0, replica_urls=[sqlite_url(tmp_path / "missing" / "replica.db")])
+    assert agent_names(db) == ["primary_agent"]
+    assert db.get_replica_status()["replicas"][0]["healthy"] is False
+
+
+@pytest.mark.parametrize("error", [ZeroDivisionError("division by zero"), exc.TimeoutError("QueuePool limit")])
+def test_failing_lag_probe_falls_back_to_primary(urls, error):
+    primary, replica = urls
+    calls = []
+
+    def probe(connection):
+        calls.append(1)
+        raise error
+
+    db = DatabaseManager(primary, cache_size=0, replica_urls=[replica], replica_lag_probe=probe)
+    assert agent_names(db) == ["primary_agent"]
+    assert db.get_agent("primary_agent") is not None
+    # 到下一次检查前不再重试
+    assert len(calls) == 1
+
+    status = db.get_replica_status()
+    assert status["fallback_reads"] == 2
+    assert status["replicas"][0]["healthy"] is False
+    assert type(error).__name__ in status["replicas"][0]["error"]
+
+
+def test_reads_pinned_to_primary_after_write(urls):
+    primary, replica = urls
+    db = DatabaseManager(primary, cache_size=0, replica_urls=[replica], max_replica_lag=0.2)
+    assert agent_names(db) == ["replica_agent"]
+
+    db.add_agent("new_agent")
+    assert agent_names(db) == ["primary_agent", "new_agent"]
+    time.sleep(0.25)
+    assert agent_names(db) == ["replica_agent"]
+
+    with db.read_your_writes():
+        assert agent_names(db) == ["primary_agent", "new_agent"]
+    assert agent_names(db) == ["replica_agent"]
+
+
+def test_async_routing(urls):
+    primary, replica = urls
+
+    async def run():
+        db = AsyncDatabaseManager(primary, cache_size=0, replica_urls=[replica], max_replica_lag=0.2)
+        names = [[agent.name for agent in await db.get_all_agents()]]
+        await db.add_agent("new_agent")
+        names.append([agent.name for agent in await db.get_all_agents()])
+        await asyncio.sleep(0.25)
+        names.append([agent.name for agent in await db.get_all_agents()])
+        with db.read_your_writes():
+            names.append([agent.name for agent in await db.get_all_agents()])
+        status = db.get_replica_status()
+        await db.dispose()
+        for replica_state in db.replicas.replicas:
+            await replica_state.engine.dispose()
+        return names, status
+
+    names, status = asyncio.run(run())
+    assert names == [
+        ["replica_agent"],
+        ["primary_agent", "new_agent"],
+        ["replica_agent"],
+        ["primary_agent", "new_agent"],
+    ]
+    assert status["replicas"][0]["reads"] == 2
+
+
+def test_async_lag_probe_runs_on_replica(urls):
+    primary, replica = urls
+    probed = []
+
+    def probe(connection):
+        probed.append(connection.dialect.name)
+        return 30.0
+
+    async def run():
+        db = AsyncDatabaseManager(primary, cache_size=0, replica_urls=[replica], replica_lag_probe=probe)
+        names = [agent.name for agent in await db.get_all_agents()]
+        await db.dispose()
+        await db.replicas.replicas[0].engine.dispose()
+        return names
+
+    assert asyncio.run(run()) == ["primary_agent"]
+    assert probed == ["sqlite"]
+
+
+def test_async_failing_lag_probe_falls_back_to_primary(urls):
+    primary, replica = urls
+
+    async def run():
+        db = AsyncDatabaseManager(primary, cache_size=0, replica_urls=[replica],
+                                  replica_lag_probe=lambda connection: 1 / 0)
+        names = [[agent.name for agent in await db.get_all_agents()] for _ in range(2)]
+        status = db.get_replica_status()
+        await db.dispose()
+        await db.replicas.replicas[0].engine.dispose()
+        return names, status
+
+    names, status = asyncio.run(run())
+    assert names == [["primary_agent"], ["primary_agent"]]
+    assert status["replicas"][0]["healthy"] is False
+    assert "ZeroDivisionError" in status["replicas"][0]["error"]
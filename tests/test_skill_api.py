@@ -0,0 +1,262 @@
+"""
+API 调用执行器测试：使用 httpx.MockTransport 代替真实的 HTTP 服务
+覆盖 5xx 重试、熔断器状态转换、按主机的并发限制和 URL 检查
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from db_utils import ApiCallRecord
+from skill_api import ApiCallError, ApiExecutor
+
+
+def make_spec(url="https://api.example.com/weather/{city}", retry_count=0, **fields):
+    values = {
+        "skill_id": "weather",
+        "skill_name": "天气",
+        "api_name": "get_weather",
+        "method": "GET",
+        "url": url,
+        "description": "查询天气",
+        "required_params": ["city"],
+        "optional_params": [],
+        "auth_type": "none",
+        "auth_config": None,
+        "request_headers": None,
+        "request_body_template": None,
+        "response_format": None,
+        "timeout_seconds": 5,
+        "retry_count": retry_count,
+    }
+    values.update(fields)
+    return ApiCallRecord(**values)
+
+
+def make_executor(handler=None, async_handler=None, **kwargs):
+    kwargs.setdefault("backoff_base", 0)
+    kwargs.setdefault("allow_insecure", False)
+    return ApiExecutor(
+        transport=httpx.MockTransport(handler) if handler else None,
+        async_transport=httpx.MockTransport(async_handler) if async_handler else None,
+        **kwargs
+    )
+
+
+class Responses:
+    """依次返回给定状态码的处理函数（最后一个状态码重复使用），记录收到的请求"""
+
+    def __init__(self, *status_codes):
+        self.status_codes = list(status_codes)
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        index = min(len(self.requests), len(self.status_codes)) - 1
+        return httpx.Response(self.status_codes[index], text="ok")
+
+
+# ========== 重试 ==========
+
+def test_retries_5xx_until_success():
+    handler = Responses(503, 502, 200)
+    response = make_executor(handler).call(make_spec(retry_count=2), {"city": "北京"})
+    assert response.status_code == 200
+    assert len(handler.requests) == 3
+    assert handler.requests[0].url.raw_path == b"/weather/%E5%8C%97%E4%BA%AC"
+
+
+def test_returns_last_response_after_retries():
+    handler = Responses(503)
+    response = make_executor(handler).call(make_spec(retry_count=1), {"city": "x"})
+    assert response.status_code == 503
+    assert len(handler.requests) == 2
+
+
+def test_client_errors_are_not_retried():
+    handler = Responses(404)
+    assert make_executor(handler).call(make_spec(retry_count=3), {"city": "x"}).status_code == 404
+    assert len(handler.requests) == 1
+
+
+def test_transport_error_retried_then_raised():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    with pytest.raises(ApiCallError, match="ConnectError"):
+        make_executor(handler).call(make_spec(retry_count=2), {"city": "x"})
+    assert len(calls) == 3
+
+
+def test_backoff_honours_retry_after():
+    executor = make_executor(backoff_base=0.01, backoff_max=5)
+    response = httpx.Response(503, headers={"Retry-After": "2"})
+    assert executor._backoff(0, response) == 2
+    assert executor._backoff(10, None) <= 0.01 * 2 ** 10
+
+
+# ========== 熔断 ==========
+
+def test_breaker_opens_then_half_open_then_closes():
+    handler = Responses(500, 500, 200)
+    executor = make_executor(handler, failure_threshold=2, reset_timeout=0.05)
+    spec = make_spec()
+    breaker = executor.breaker(spec)
+
+    executor.call(spec, {"city": "x"})
+    assert breaker.state == "closed"
+    executor.call(spec, {"city": "x"})
+    assert breaker.state == "open"
+    with pytest.raises(ApiCallError, match="熔断"):
+        executor.call(spec, {"city": "x"})
+    assert len(handler.requests) == 2
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert executor.call(spec, {"city": "x"}).status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_failure_reopens():
+    handler = Responses(500, 500)
+    executor = make_executor(handler, failure_threshold=1, reset_timeout=0.05)
+    spec = make_spec()
+    executor.call(spec, {"city": "x"})
+    time.sleep(0.06)
+    executor.call(spec, {"city": "x"})
+    assert executor.breaker(spec).state == "open"
+
+
+def test_half_open_probe_released_on_unexpected_error():
+    outcomes = [httpx.Response(500), RuntimeError("bad header"), httpx.Response(200)]
+
+    def handler(request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    executor = make_executor(handler, failure_threshold=1, reset_timeout=0.05)
+    spec = make_spec()
+    executor.call(spec, {"city": "x"})
+    time.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        executor.call(spec, {"city": "x"})
+
+    time.sleep(0.06)
+    assert executor.call(spec, {"city": "x"}).status_code == 200
+    assert executor.breaker(spec).state == "closed"
+
+
+def test_async_half_open_probe_released_on_cancel():
+    outcomes = [httpx.Response(500), asyncio.CancelledError(), httpx.Response(200)]
+
+    async def handler(request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    executor = make_executor(async_handler=handler, failure_threshold=1, reset_timeout=0.05)
+    spec = make_spec()
+
+    async def run():
+        await executor.acall(spec, {"city": "x"})
+        await asyncio.sleep(0.06)
+        with pytest.raises(asyncio.CancelledError):
+            await executor.acall(spec, {"city": "x"})
+        await asyncio.sleep(0.06)
+        response = await executor.acall(spec, {"city": "x"})
+        await executor.aclose()
+        return response
+
+    assert asyncio.run(run()).status_code == 200
+    assert executor.breaker(spec).state == "closed"
+
+
+# ========== 按主机的并发限制 ==========
+
+class ConcurrencyProbe:
+    """记录同时处理中的请求数的最大值"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def exit(self):
+        with self._lock:
+            self.active -= 1
+
+
+def test_per_host_limit_sync():
+    probe = ConcurrencyProbe()
+
+    def handler(request):
+        probe.enter()
+        time.sleep(0.05)
+        probe.exit()
+        return httpx.Response(200)
+
+    executor = make_executor(handler, per_host_limit=2)
+    spec = make_spec()
+    threads = [threading.Thread(target=executor.call, args=(spec, {"city": str(i)})) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert probe.peak == 2
+
+
+def test_per_host_limit_async():
+    probe = ConcurrencyProbe()
+
+    async def handler(request):
+        probe.enter()
+        await asyncio.sleep(0.02)
+        probe.exit()
+        return httpx.Response(200)
+
+    executor = make_executor(async_handler=handler, per_host_limit=2)
+    spec = make_spec()
+
+    async def run():
+        await asyncio.gather(*(executor.acall(spec, {"city": str(i)}) for i in range(6)))
+        await executor.aclose()
+
+    asyncio.run(run())
+    assert probe.peak == 2
+
+
+# ========== URL 检查 ==========
+
+@pytest.mark.parametrize("url", [
+    "http://api.example.com/weather/{city}",
+    "https://localhost/weather/{city}",
+    "https://127.0.0.1/weather/{city}",
+    "https://10.1.2.3/weather/{city}",
+    "https://192.168.0.1/weather/{city}",
+    "https://169.254.169.254/weather/{city}",
+])
+def test_rejects_plain_http_and_private_addresses(url):
+    handler = Responses(200)
+    with pytest.raises(ApiCallError):
+        make_executor(handler).call(make_spec(url), {"city": "x"})
+    assert handler.requests == []
+
+
+def test_allow_insecure_permits_local_server():
+    handler = Responses(200)
+    executor = make_executor(handler, allow_insecure=True)
+    assert executor.call(make_spec("http://127.0.0.1:8080/weather/{city}"), {"city": "x"}).status_code == 200
@@ -0,0 +1,95 @@
+"""
+技能缓存测试：LRU 淘汰、写入后失效、跨进程水位线轮询、缓存结果不可变
+"""
+
+import pytest
+
+from db_utils import DatabaseManager
+from skill_cache import SkillCache, MISSING
+from conftest import skill_item
+
+
+def test_lru_evicts_least_recently_used():
+    cache = SkillCache(max_size=2, poll_interval=-1)
+    cache.set("a", 1, cache.version)
+    cache.set("b", 2, cache.version)
+    assert cache.get("a") == 1
+    cache.set("c", 3, cache.version)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_set_with_stale_version_is_dropped():
+    cache = SkillCache(max_size=4, poll_interval=-1)
+    version = cache.version
+    cache.invalidate()
+    cache.set("a", 1, version)
+    assert cache.get("a") is MISSING
+
+
+def test_watermark_change_invalidates():
+    cache = SkillCache(max_size=4, poll_interval=0)
+    cache.update_watermark((1, 1))
+    cache.set("a", 1, cache.version)
+    cache.update_watermark((1, 1))
+    assert cache.get("a") == 1
+    cache.update_watermark((2, 1))
+    assert cache.get("a") is MISSING
+
+
+def test_update_invalidates_cached_skill(db):
+    db.bulk_import_skills("tester", [skill_item("s1", "旧内容")])
+    assert db.get_skill("tester", "s1").content == "旧内容"
+
+    results = db.bulk_import_skills("tester", [skill_item("s1", "新内容")], update_existing=True)
+    assert results[0].status == "updated"
+    assert db.get_skill("tester", "s1").content == "新内容"
+    assert db.get_all_skills("tester")[0]["content"] == "新内容"
+
+
+def test_other_process_write_seen_after_poll(db_url, db):
+    db.bulk_import_skills("tester", [skill_item("s1", "旧内容")])
+    reader = DatabaseManager(db_url, cache_size=16, cache_poll_interval=0, replica_urls=[])
+    assert reader.get_skill("tester", "s1").content == "旧内容"
+
+    # 另一个进程（独立的缓存）更新技能，reader 本身没有写入
+    db.bulk_import_skills("tester", [skill_item("s1", "新内容")], update_existing=True)
+    assert reader.get_skill("tester", "s1").content == "新内容"
+
+
+def test_other_process_write_not_seen_without_poll(db_url, db):
+    db.bulk_import_skills("tester", [skill_item("s1", "旧内容")])
+    reader = DatabaseManager(db_url, cache_size=16, cache_poll_interval=-1, replica_urls=[])
+    assert reader.get_skill("tester", "s1").content == "旧内容"
+
+    db.bulk_import_skills("tester", [skill_item("s1", "新内容")], update_existing=True)
+    assert reader.get_skill("tester", "s1").content == "旧内容"
+
+
+def test_cached_results_cannot_be_mutated(db):
+    db.bulk_import_skills("tester", [skill_item("s1", "内容")])
+
+    skill = db.get_skill("tester", "s1")
+    with pytest.raises(AttributeError):
+        skill.content = "被修改"
+    with pytest.raises(AttributeError):
+        db.get_agent("tester").system_prompt = "被修改"
+
+    skills = db.get_all_skills("tester")
+    skills[0]["content"] = "被修改"
+    skills.append({"name": "多出的技能"})
+    assert db.get_all_skills("tester") == [
+        {"name": "s1", "skill_id": "s1", "description": "s1 的描述", "content": "内容"}
+    ]
+    assert db.cache.stats()["hits"] > 0
+
+
+def test_skill_record_uses_effective_priority(db):
+    db.bulk_import_skills("tester", [skill_item("s1", priority=1), skill_item("s2", priority=2)])
+    db.assign_skills("tester", ["s1"], priority=5)
+
+    assert [s.skill_id for s in db.get_skills_by_agent("tester")] == ["s1", "s2"]
+    assert db.get_skill("tester", "s1").priority == 5
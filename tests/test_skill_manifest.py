@@ -0,0 +1,86 @@
+"""
+技能目录清单测试：未变化的目录跳过、只有确认导入成功的目录计入清单
+"""
+
+import json
+import os
+
+import pytest
+
+from load_skill_from_file import SkillManifest, iter_skills_from_dir
+
+
+@pytest.fixture
+def skills_dir(tmp_path):
+    root = tmp_path / "skills"
+    for name in ("a", "b", "c"):
+        skill_dir = root / name
+        skill_dir.mkdir(parents=True)
+        (skill_dir / "skill.json").write_text(json.dumps({"id": name, "name": name}), encoding="utf-8")
+        (skill_dir / "content.md").write_text(f"{name} 的内容", encoding="utf-8")
+    return root
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / "manifest.json")
+
+
+def load(skills_dir, manifest):
+    return sorted(name for name, _ in iter_skills_from_dir(str(skills_dir), manifest=manifest))
+
+
+def import_all(skills_dir, manifest_path):
+    """模拟 init_database：全部导入成功后确认并保存清单"""
+    manifest = SkillManifest(manifest_path)
+    names = load(skills_dir, manifest)
+    for name in names:
+        manifest.confirm(name)
+    manifest.save()
+    return names
+
+
+def test_unchanged_dirs_skipped(skills_dir, manifest_path):
+    assert import_all(skills_dir, manifest_path) == ["a", "b", "c"]
+    assert import_all(skills_dir, manifest_path) == []
+
+    (skills_dir / "b" / "content.md").write_text("新内容", encoding="utf-8")
+    assert import_all(skills_dir, manifest_path) == ["b"]
+
+
+def test_touched_file_with_same_content_skipped(skills_dir, manifest_path):
+    import_all(skills_dir, manifest_path)
+    content = skills_dir / "a" / "content.md"
+    stat = content.stat()
+    os.utime(content, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert import_all(skills_dir, manifest_path) == []
+
+
+def test_unconfirmed_dirs_not_saved(skills_dir, manifest_path):
+    manifest = SkillManifest(manifest_path)
+    with pytest.raises(KeyboardInterrupt):
+        for name, _ in iter_skills_from_dir(str(skills_dir), max_workers=1, manifest=manifest):
+            # 第一个技能导入成功后中断，其余已读取的目录没有导入
+            manifest.confirm(name)
+            first = name
+            raise KeyboardInterrupt
+    manifest.save()
+
+    assert sorted(SkillManifest(manifest_path).entries) == [first]
+    assert import_all(skills_dir, manifest_path) == sorted({"a", "b", "c"} - {first})
+
+
+def test_generator_does_not_save(skills_dir, manifest_path):
+    manifest = SkillManifest(manifest_path)
+    load(skills_dir, manifest)
+    assert not os.path.exists(manifest_path)
+    assert manifest.entries == {}
+
+
+def test_failed_import_reloaded(skills_dir, manifest_path):
+    manifest = SkillManifest(manifest_path)
+    for name in load(skills_dir, manifest):
+        if name != "b":
+            manifest.confirm(name)
+    manifest.save()
+    assert import_all(skills_dir, manifest_path) == ["b"]
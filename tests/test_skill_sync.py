@@ -0,0 +1,158 @@
+"""
+技能同步测试：全量/增量同步、删除的技能目录、同步日志（经 SyncLogBuffer 写入）
+"""
+
+import json
+import subprocess
+
+import pytest
+from sqlalchemy import select
+
+from db_utils import SkillSyncLog
+from skill_sync import SkillSyncEngine
+from sync_log import SyncLogBuffer
+
+REPO_URL = "https://gitee.com/example/skills"
+
+
+class SkillRepo:
+    """临时 git 仓库，技能目录位于 skills/ 下"""
+
+    def __init__(self, path):
+        self.path = path
+        path.mkdir()
+        self.git("init", "-q")
+
+    def git(self, *args):
+        return subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", "-C", str(self.path), *args],
+            check=True, capture_output=True, text=True
+        ).stdout
+
+    def write_skill(self, name, content="内容", skill_json=None):
+        skill_dir = self.path / "skills" / name
+        skill_dir.mkdir(parents=True, exist_ok=True)
+        if skill_json is None:
+            skill_json = json.dumps({"id": name, "name": name, "version": "1.0.0", "description": f"{name} 的描述"})
+        (skill_dir / "skill.json").write_text(skill_json, encoding="utf-8")
+        (skill_dir / "content.md").write_text(content, encoding="utf-8")
+
+    def remove_skill(self, name):
+        self.git("rm", "-q", "-r", f"skills/{name}")
+
+    def commit(self, message="update"):
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", message)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return SkillRepo(tmp_path / "repo")
+
+
+@pytest.fixture
+def engine(db, repo):
+    return SkillSyncEngine(db, str(repo.path), agent_name="tester", repo_url=REPO_URL, skills_root="skills")
+
+
+def sync_logs(db):
+    session = db.get_session()
+    try:
+        return session.execute(select(SkillSyncLog).order_by(SkillSyncLog.id)).scalars().all()
+    finally:
+        session.close()
+
+
+def test_full_then_incremental(engine, repo, db):
+    repo.write_skill("a")
+    repo.write_skill("b")
+    repo.commit()
+    report = engine.sync()
+    assert (report.sync_type, sorted(report.imported)) == ("full", ["a", "b"])
+    assert engine.sync().sync_type == "noop"
+
+    repo.write_skill("a", "新内容")
+    repo.commit()
+    report = engine.sync()
+    assert (report.sync_type, report.updated, report.imported) == ("incremental", ["a"], [])
+    assert db.get_skill("tester", "a").content == "新内容"
+
+
+def test_duration_recorded_once_per_sync(engine, repo, db):
+    repo.write_skill("a")
+    repo.write_skill("b")
+    repo.commit()
+    report = engine.sync()
+
+    logs = sync_logs(db)
+    assert len(logs) == 2
+    assert [log.sync_duration_ms for log in logs if log.sync_duration_ms is not None] == [report.duration_ms]
+
+
+def test_deleted_dir_with_malformed_skill_json(engine, repo, db):
+    repo.write_skill("a")
+    repo.write_skill("b")
+    repo.commit()
+    engine.sync()
+
+    # 上一次同步的 commit 中 a 的 skill.json 已损坏（技能仍保留之前导入的内容）
+    repo.write_skill("a", skill_json="[1, 2]")
+    repo.commit()
+    assert "skills/a" in engine.sync().failed
+    db.mark_repo_synced(REPO_URL, repo.git("rev-parse", "HEAD").strip(), "tester")
+
+    repo.remove_skill("a")
+    repo.remove_skill("b")
+    repo.commit()
+    report = engine.sync()
+    assert report.removed == ["b"]
+    assert "skills/a" in report.failed
+
+    failed = [log for log in sync_logs(db) if log.sync_status == "failed"]
+    assert failed[-1].skill_id == db.get_skill_pks(["a"])["a"]
+    assert "skill.json" in failed[-1].sync_message
+
+
+def test_watermark_stored_without_skill_rows(engine, repo):
+    (repo.path / "skills").mkdir(parents=True)
+    (repo.path / "skills" / "README.md").write_text("技能仓库", encoding="utf-8")
+    repo.commit()
+
+    assert engine.sync().sync_type == "full"
+    assert engine.sync().sync_type == "noop"
+
+    repo.write_skill("a")
+    repo.commit()
+    report = engine.sync()
+    assert (report.sync_type, report.imported) == ("incremental", ["a"])
+
+
+def test_shared_sync_log_buffer(db, repo):
+    repo.write_skill("a")
+    repo.commit()
+    with SyncLogBuffer(db, max_size=100, flush_interval=60) as buffer:
+        engine = SkillSyncEngine(db, str(repo.path), agent_name="tester", repo_url=REPO_URL,
+                                 skills_root="skills", sync_log=buffer)
+        engine.sync()
+        assert (len(buffer), sync_logs(db)) == (1, [])
+    assert [log.sync_message for log in sync_logs(db)] == ["新增"]
+
+
+def test_failed_log_write_retried_on_next_sync(engine, repo, db, monkeypatch):
+    repo.write_skill("a")
+    repo.commit()
+    add_sync_logs = db.add_sync_logs
+
+    def fail_once(rows):
+        monkeypatch.setattr(db, "add_sync_logs", add_sync_logs)
+        raise RuntimeError("数据库不可用")
+
+    monkeypatch.setattr(db, "add_sync_logs", fail_once)
+    with pytest.raises(RuntimeError):
+        engine.sync()
+    assert len(engine.sync_log) == 1
+
+    repo.write_skill("a", "新内容")
+    repo.commit()
+    engine.sync()
+    assert [log.sync_message for log in sync_logs(db)] == ["新增", "更新"]
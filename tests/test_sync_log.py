@@ -0,0 +1,76 @@
+"""
+同步日志缓冲测试：按条数和时间间隔批量写入、写入失败时日志放回缓冲
+"""
+
+import time
+
+import pytest
+from sqlalchemy import select
+
+from db_utils import SkillSyncLog
+from sync_log import SyncLogBuffer
+from conftest import skill_item
+
+
+@pytest.fixture
+def skill_pk(db):
+    db.bulk_import_skills("tester", [skill_item("s1")])
+    return db.get_skill_pks(["s1"])["s1"]
+
+
+def log_messages(db):
+    session = db.get_session()
+    try:
+        return session.execute(select(SkillSyncLog.sync_message).order_by(SkillSyncLog.id)).scalars().all()
+    finally:
+        session.close()
+
+
+def test_flushes_when_full(db, skill_pk):
+    buffer = SyncLogBuffer(db, max_size=3, flush_interval=60)
+    buffer.add(skill_pk, "full", "success", "1")
+    buffer.add(skill_pk, "full", "success", "2")
+    assert (len(buffer), log_messages(db)) == (2, [])
+
+    buffer.add(skill_pk, "full", "success", "3")
+    assert (len(buffer), buffer.flushes) == (0, 1)
+    assert log_messages(db) == ["1", "2", "3"]
+
+
+def test_flushes_after_interval(db, skill_pk):
+    buffer = SyncLogBuffer(db, max_size=100, flush_interval=0.05)
+    buffer.add(skill_pk, "full", "success", "1")
+    assert log_messages(db) == []
+
+    time.sleep(0.06)
+    buffer.add(skill_pk, "full", "success", "2")
+    assert log_messages(db) == ["1", "2"]
+
+
+def test_close_writes_remaining(db, skill_pk):
+    with SyncLogBuffer(db, max_size=100, flush_interval=60) as buffer:
+        buffer.add(skill_pk, "full", "success", "1")
+    assert log_messages(db) == ["1"]
+    assert buffer.written == 1
+
+
+def test_failed_flush_requeues_in_order(db, skill_pk, monkeypatch):
+    buffer = SyncLogBuffer(db, max_size=100, flush_interval=60)
+    buffer.add(skill_pk, "full", "success", "1")
+    buffer.add(skill_pk, "full", "success", "2")
+
+    add_sync_logs = db.add_sync_logs
+
+    def fail_once(rows):
+        monkeypatch.setattr(db, "add_sync_logs", add_sync_logs)
+        raise RuntimeError("数据库不可用")
+
+    monkeypatch.setattr(db, "add_sync_logs", fail_once)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert (len(buffer), buffer.written) == (2, 0)
+
+    buffer.add(skill_pk, "full", "success", "3")
+    assert buffer.flush() == 3
+    assert log_messages(db) == ["1", "2", "3"]
+